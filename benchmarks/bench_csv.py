@@ -0,0 +1,96 @@
+'''
+Benchmark comparing the original `json_to_csv()` (headers from the first
+document only) with the streaming version, using MRIQC-like documents.
+Documents are generated on the fly, so the peak memory of the generator
+and `columns` modes does not depend on the number of rows.
+
+Run from the repository root using:
+	python3 -m benchmarks.bench_csv
+'''
+
+import os
+import time
+import random
+import tempfile
+import tracemalloc
+from xnat_wrapper.utils import json_to_csv
+
+
+IQMS = ['iqm_{}'.format(i) for i in range(60)]
+KEYS = ['subject_id','session_id','modality']
+
+def make_docs(n_rows, extra=True):
+	'''Generates MRIQC-like documents (every other one with an extra metric, 
+	which the legacy function cannot handle)
+	'''
+
+	rng = random.Random(0)
+	for i in range(n_rows):
+		doc = {
+			'bids_meta': {
+				'subject_id': '{:05d}'.format(i//2),
+				'session_id': '01',
+				'modality': 'T1w' if i%2 == 0 else 'bold'
+			},
+			'provenance': {'md5sum': '{:032x}'.format(i), 'settings': {'fd_thres': 0.2}}
+		}
+		for k in IQMS: doc[k] = rng.random()
+		if extra and i%2 == 1: doc['dvars_nstd'] = rng.random()
+		yield doc
+
+def legacy_json_to_csv(files,fname,keys=[]):
+	'''The `json_to_csv()` function prior to the streaming version
+	'''
+
+	if not fname.endswith('.csv'): fname += '.csv'
+
+	headers = []
+	with open(fname,'w') as csv:
+		for f in files:
+			if len(headers) == 0:
+				headers.extend(keys)
+				headers.extend([k for k,v in f.items() if not isinstance(v,dict)])
+				line = ','.join(headers)
+				csv.write('{}\n'.format(','.join(headers)))
+
+			output = {h:'' for h in headers}
+			for key,value in f.items():
+				if key in output:
+					output[key] = str(value)
+				else:
+					for k in keys:
+						if k in value: output[k] = str(value[k])
+
+			csv.write('{}\n'.format(','.join([v.replace(',',';') for k,v in output.items()])))
+
+def measure(func):
+	'''Returns the time taken (in seconds) and peak memory (in MB) of a function
+	'''
+
+	s_time = time.perf_counter()
+	func()
+	t = time.perf_counter() - s_time
+
+	tracemalloc.start()
+	func()
+	peak = tracemalloc.get_traced_memory()[1]/2**20
+	tracemalloc.stop()
+	return t,peak
+
+if __name__ == '__main__':
+	n = 100000
+	fname = os.path.join(tempfile.mkdtemp(),'bench')
+	columns = KEYS + IQMS + ['dvars_nstd']
+
+	modes = [
+		('legacy (first document headers)', lambda: legacy_json_to_csv(make_docs(n,False),fname,KEYS)),
+		('streaming (list, two passes)', lambda: json_to_csv(list(make_docs(n)),fname,KEYS)),
+		('streaming (generator, spill)', lambda: json_to_csv(make_docs(n),fname,KEYS)),
+		('streaming (generator, columns)', lambda: json_to_csv(make_docs(n),fname,KEYS,columns=columns)),
+		('streaming (generator, flatten)', lambda: json_to_csv(make_docs(n),fname,KEYS,flatten=True))
+	]
+
+	print('{:<34} {:>9} {:>10} {:>10}'.format('mode ({} rows)'.format(n),'time (s)','rows/s','peak (MB)'))
+	for name,func in modes:
+		t,peak = measure(func)
+		print('{:<34} {:>9.2f} {:>10.0f} {:>10.1f}'.format(name,t,n/t,peak))
@@ -0,0 +1,64 @@
+'''
+Benchmark comparing the original UID importer filter loop with the 
+compiled `SeriesFilter` used by `UIDImporter.find_studies()`.
+
+Run from the repository root using:
+	python3 -m benchmarks.bench_filters
+'''
+
+import time
+import random
+from xnat_wrapper.filters import SeriesFilter
+
+
+def make_series(n_series, n_desc=200):
+	'''Creates fake PACS series information
+	'''
+
+	descs = ['Series {}'.format(i) for i in range(n_desc)]
+	return [{
+		'seriesDescription': random.choice(descs),
+		'modality': random.choice(['MR','CT','PT']),
+		'seriesInstanceUid': '1.2.840.{}'.format(i)
+	} for i in range(n_series)]
+
+def legacy_filter(series, filters):
+	'''The filter loop used by `find_studies()` prior to `SeriesFilter`
+	'''
+
+	filtered_list = []
+	for item in series:
+		add_item = True
+		if filters:
+			for k,v in filters.items():
+				if item[k] not in v: add_item = False
+		if add_item: filtered_list.append(item)
+	return filtered_list
+
+def best_of(func, repeat=5):
+	'''Returns the fastest of several runs of a function (in seconds)
+	'''
+
+	times = []
+	for i in range(repeat):
+		s_time = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - s_time)
+	return min(times)
+
+if __name__ == '__main__':
+	random.seed(0)
+	filters = {
+		'seriesDescription': ['Series {}'.format(i) for i in range(0,200,2)],
+		'modality': ['MR','CT']
+	}
+
+	print('{:>10} {:>12} {:>13} {:>8}'.format('series','legacy (ms)','compiled (ms)','speedup'))
+	for n in [1000, 10000, 100000]:
+		series = make_series(n)
+		compiled = SeriesFilter(filters)
+		assert legacy_filter(series,filters) == compiled.apply(series)
+
+		t_old = best_of(lambda: legacy_filter(series,filters))
+		t_new = best_of(lambda: compiled.apply(series))
+		print('{:>10} {:>12.2f} {:>13.2f} {:>7.1f}x'.format(n,1000*t_old,1000*t_new,t_old/t_new))
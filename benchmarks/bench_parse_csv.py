@@ -0,0 +1,66 @@
+'''
+Benchmark comparing `parse_csv()` (a Python list and a try/except per
+cell) with the columnar `load_csv()`, using an MRIQC-like table written
+by `json_to_csv()`.
+
+Run from the repository root using:
+	python3 -m benchmarks.bench_parse_csv --rows 100000
+'''
+
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+from xnat_wrapper.utils import (
+	json_to_csv,
+	parse_csv
+)
+from xnat_wrapper.table import (
+	np,
+	load_csv
+)
+from benchmarks.bench_csv import (
+	IQMS,
+	KEYS,
+	make_docs
+)
+
+
+def measure(func):
+	'''Returns the time taken (in seconds) and peak memory (in MB) of a function
+	'''
+
+	s_time = time.perf_counter()
+	func()
+	t = time.perf_counter() - s_time
+
+	tracemalloc.start()
+	func()
+	peak = tracemalloc.get_traced_memory()[1]/2**20
+	tracemalloc.stop()
+	return t,peak
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks CSV parsing of an MRIQC-like table')
+	parser.add_argument('--rows', type=int, default=100000)
+	args = parser.parse_args()
+
+	n = args.rows
+	fname = os.path.join(tempfile.mkdtemp(),'bench.csv')
+	json_to_csv(make_docs(n,False),fname,KEYS,columns=KEYS+IQMS)
+	filt = IQMS[:5]
+
+	modes = [
+		('parse_csv', lambda: parse_csv(fname,KEYS)),
+		('columnar (array)', lambda: load_csv(fname,use_numpy=False)),
+		('columnar (array, 5 columns)', lambda: load_csv(fname,filt,use_numpy=False)),
+		('columnar (array, numeric only)', lambda: load_csv(fname,strings=False,use_numpy=False))
+	]
+	if np is not None: modes.append(('columnar (numpy)', lambda: load_csv(fname,use_numpy=True)))
+
+	print('{} ({:.1f} MB)'.format(fname,os.path.getsize(fname)/2**20))
+	print('{:<34} {:>9} {:>10} {:>10}'.format('mode ({} rows)'.format(n),'time (s)','rows/s','peak (MB)'))
+	for name,func in modes:
+		t,peak = measure(func)
+		print('{:<34} {:>9.2f} {:>10.0f} {:>10.1f}'.format(name,t,n/t,peak))
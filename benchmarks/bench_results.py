@@ -0,0 +1,75 @@
+'''
+Benchmark of loading MRIQC-like results into a `ResultsStore` and computing
+box-and-whisker statistics of every IQM for each modality, with and without
+NumPy.
+
+Run from the repository root using:
+	python3 -m benchmarks.bench_results --scans 5000 --iqms 120
+'''
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from xnat_wrapper.utils import json_to_csv
+from xnat_wrapper.table import np
+from xnat_wrapper.results import (
+	KEYS,
+	ResultsStore
+)
+
+
+MODALITIES = ['T1w','T2w','bold']
+
+def make_docs(n_scans, n_iqms):
+	'''Generates MRIQC-like documents with normally distributed IQMs
+	'''
+
+	rng = random.Random(0)
+	for i in range(n_scans):
+		doc = {'bids_meta': {
+			'subject_id': '{:05d}'.format(i//len(MODALITIES)),
+			'session_id': '01',
+			'modality': MODALITIES[i%len(MODALITIES)]
+		}}
+		for j in range(n_iqms): doc['iqm_{}'.format(j)] = rng.gauss(j,1)
+		yield doc
+
+def measure(func, repeat=5):
+	'''Returns the best time taken (in seconds) of a function
+	'''
+
+	times = []
+	for _ in range(repeat):
+		s_time = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - s_time)
+	return min(times)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks ResultsStore statistics')
+	parser.add_argument('--scans', type=int, default=5000)
+	parser.add_argument('--iqms', type=int, default=120)
+	args = parser.parse_args()
+
+	docs = list(make_docs(args.scans,args.iqms))
+	fname = os.path.join(tempfile.mkdtemp(),'results.csv')
+	json_to_csv(docs,fname,KEYS)
+	store = ResultsStore.from_json(docs)
+
+	modes = [
+		('from_json', lambda: ResultsStore.from_json(docs), 1),
+		('from_csv', lambda: ResultsStore.from_csv(fname), 1),
+		('stats (pure Python)', lambda: store.stats(use_numpy=False), 5),
+		('stats (pure Python, by subject)', lambda: store.stats('subject_id',use_numpy=False), 5)
+	]
+	if np is not None:
+		modes.extend([
+			('stats (numpy)', lambda: store.stats(use_numpy=True), 5),
+			('stats (numpy, by subject)', lambda: store.stats('subject_id',use_numpy=True), 5)
+		])
+
+	print('{:<34} {:>10}'.format('mode ({} scans, {} IQMs)'.format(args.scans,args.iqms),'time (ms)'))
+	for name,func,repeat in modes:
+		print('{:<34} {:>10.1f}'.format(name,measure(func,repeat)*1000))
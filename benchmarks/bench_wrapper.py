@@ -0,0 +1,121 @@
+'''
+End-to-end benchmark of the `Connector` utilities against the mock XNAT
+server (see `benchmarks.mock_xnat`). Each benchmark is timed at several
+project sizes, and the number of requests received by the server is
+reported alongside the time taken.
+
+Run from the repository root using:
+	python3 -m benchmarks.bench_wrapper --scales 100 1000 10000 --latency 0.002
+'''
+
+import time
+import logging
+import argparse
+from pyxnat import Interface
+from xnat_wrapper import Connector
+from xnat_wrapper.command_utility import CommandUtility
+from benchmarks.mock_xnat import (
+	MockXNAT,
+	PROJECT,
+	RESOURCE,
+	COMMAND
+)
+
+
+def find_experiments(conn, mock, **kwargs):
+	conn.commands.find_project_experiments(PROJECT, **kwargs)
+	assert len(conn.commands.sessions) == len(mock.sessions)
+
+def run_commands(conn, mock, **kwargs):
+	conn.commands.find_project_experiments(PROJECT, bulk=True)
+	mock.reset()
+	conn.commands.invalidate_wrapper_cache()
+	conn.commands.run_commands(commands={'session':{'name':COMMAND,'opts':{}}}, **kwargs)
+
+def run_commands_plain(conn, mock, **kwargs):
+	'''Runs the commands through a plain `pyxnat.Interface` (without the HTTP adapter 
+	of the `Connector`), which must accept the launch timeout
+	'''
+
+	utility = CommandUtility(Interface(server=mock.url, user='admin', password='admin'), PROJECT)
+	utility.find_project_experiments(bulk=True)
+	mock.reset()
+	utility.launch_timeout = kwargs.get('launch_timeout', utility.launch_timeout)
+	utility.run_commands(commands={'project':{'name':COMMAND,'opts':{}},'session':{'name':COMMAND,'opts':{}}})
+	results = [r for level in utility.get_results().values() for r in level]
+	assert results and not any(r['result']['error'] for r in results)
+	utility.xnat.disconnect()
+
+def find_studies(conn, mock, **kwargs):
+	conn.importer.find_studies(list(mock.studies), {'seriesDescription':['Ax T1','Ax T2']}, **kwargs)
+	assert conn.importer.studies
+
+def import_and_monitor(conn, mock, **kwargs):
+	conn.importer.studies = {uid:{
+		'seriesDescriptions': [s['seriesDescription'] for s in series],
+		'seriesInstanceUids': [s['seriesInstanceUid'] for s in series]
+	} for uid,series in mock.studies.items()}
+	assert conn.importer.import_studies(**kwargs)
+	conn.importer.monitor_import_queue(timeout=60)
+
+def download_json(conn, mock, **kwargs):
+	docs = conn.commands.download_json_files(PROJECT, RESOURCE, **kwargs)
+	assert len(docs) == len(mock.files)
+
+'''
+Benchmarks to run at each scale: (name, function, keyword arguments)
+'''
+BENCHMARKS = [
+	('find_project_experiments', find_experiments, {}),
+	('find_project_experiments (workers=8)', find_experiments, {'workers':8}),
+	('find_project_experiments (bulk)', find_experiments, {'bulk':True}),
+	('run_commands', run_commands, {}),
+	('run_commands (bulk)', run_commands, {'bulk':True}),
+	('run_commands (concurrency=8)', run_commands, {'concurrency':8}),
+	('run_commands (plain Interface)', run_commands_plain, {}),
+	('run_commands (plain, no timeout)', run_commands_plain, {'launch_timeout':None}),
+	('find_studies', find_studies, {'chunk_size':100}),
+	('find_studies (workers=4)', find_studies, {'chunk_size':100,'workers':4}),
+	('import_studies + monitor_import_queue', import_and_monitor, {}),
+	('download_json_files', download_json, {}),
+	('download_json_files (workers=8)', download_json, {'workers':8})
+]
+
+def run_benchmarks(scale, latency=0, jitter=0, failure_rate=0, padding=0, pool_size=10, retries=0):
+	'''Runs every benchmark against a mock server with `scale` sessions (and files)
+
+	:return: List of (name, seconds, requests) results
+	:rtype: list
+	'''
+
+	results = []
+	with MockXNAT(sessions=scale, latency=latency, jitter=jitter, failure_rate=failure_rate,
+				padding=padding, queue_time=1, container_time=1) as mock:
+		conn = Connector(server=mock.url, user='admin', password='admin', project=PROJECT,
+						pool_size=pool_size, retries=retries, backoff=0.01)
+		for name,func,kwargs in BENCHMARKS:
+			mock.reset()
+			s_time = time.perf_counter()
+			func(conn,mock,**kwargs)
+			results.append((name, time.perf_counter() - s_time, sum(mock.counts.values())))
+		conn.close_session()
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks xnat_wrapper against a mock XNAT server')
+	parser.add_argument('--scales', type=int, nargs='+', default=[100,1000,10000])
+	parser.add_argument('--latency', type=float, default=0)
+	parser.add_argument('--jitter', type=float, default=0)
+	parser.add_argument('--failure-rate', type=float, default=0)
+	parser.add_argument('--padding', type=int, default=0)
+	parser.add_argument('--pool-size', type=int, default=10)
+	parser.add_argument('--retries', type=int, default=0)
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.ERROR)
+
+	print('{:>7} {:<40} {:>10} {:>10}'.format('scale','benchmark','time (s)','requests'))
+	for scale in args.scales:
+		for name,t,n in run_benchmarks(scale, args.latency, args.jitter, args.failure_rate,
+									args.padding, args.pool_size, args.retries):
+			print('{:>7} {:<40} {:>10.3f} {:>10}'.format(scale,name,t,n))
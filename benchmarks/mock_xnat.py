@@ -0,0 +1,458 @@
+'''
+Local stand-in for the parts of the XNAT REST API used by `xnat_wrapper`,
+with generated projects, sessions, scans, PACS studies, import queue items,
+containers, and resource files. The server can add latency to each request,
+pad each listing item to increase payload sizes, and fail a fraction of
+requests with a 503 status.
+
+Run from the repository root using:
+	python3 -m benchmarks.mock_xnat --sessions 1000 --latency 0.01
+'''
+
+import re
+import json
+import hashlib
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import (
+	urlsplit,
+	parse_qs
+)
+from http.server import (
+	ThreadingHTTPServer,
+	BaseHTTPRequestHandler
+)
+
+
+'''
+Names used for the generated data
+'''
+PROJECT = 'MOCK'
+RESOURCE = 'MRIQC'
+COMMAND = 'mriqc'
+SERIES_DESCRIPTIONS = ['Ax T1','Ax T2','Ax FLAIR','Sag T1','DWI','Localizer']
+IQMS = ['cjv','cnr','efc','fber','fwhm_avg','qi_1','qi_2','snr_total','tpm_overlap_csf','wm2max']
+
+
+class MockXNAT(object):
+	'''Mock XNAT server running in a background thread
+
+	:param sessions: Number of sessions in the project (and PACS studies), defaults to 100
+	:param scans: Number of scans per session (and series per study), defaults to 4
+	:param files: Number of JSON files in the project resource, defaults to `sessions`
+	:param latency: Number of seconds added to each request, defaults to 0
+	:param jitter: Maximum number of random seconds added to each request, defaults to 0
+	:param failure_rate: Fraction of requests that fail with a 503 status, defaults to 0
+	:param padding: Number of characters added to each listing item, defaults to 0
+	:param queue_time: Number of seconds each study spends in the import queue, defaults to 2
+	:param container_time: Number of seconds each container runs for, defaults to 2
+	:param seed: Seed used to generate the data, defaults to 0
+	:param port: Port to listen on, defaults to 0 (any free port)
+	:type sessions: int, optional
+	:type scans: int, optional
+	:type files: int, optional
+	:type latency: float, optional
+	:type jitter: float, optional
+	:type failure_rate: float, optional
+	:type padding: int, optional
+	:type queue_time: float, optional
+	:type container_time: float, optional
+	:type seed: int, optional
+	:type port: int, optional
+	'''
+
+	def __init__(self, sessions=100, scans=4, files=None, latency=0, jitter=0, failure_rate=0,
+				padding=0, queue_time=2, container_time=2, seed=0, port=0):
+		'''Constructor method
+		'''
+
+		self.latency = latency
+		self.jitter = jitter
+		self.failure_rate = failure_rate
+		self.padding = 'x'*padding
+		self.queue_time = queue_time
+		self.container_time = container_time
+		self.counts = Counter()
+
+		self._lock = threading.Lock()
+		self._rng = random.Random(seed)
+		self._queue = []
+		self._containers = []
+		self._build(sessions,scans,sessions if files is None else files)
+
+		self.routes = [
+			('GET', r'/data/JSESSION', self.get_jsession),
+			('DELETE', r'/data/JSESSION', self.get_jsession),
+			('GET', r'/xapi/siteConfig/uptime/display', self.get_uptime),
+			('GET', r'/data/projects/([^/]+)/experiments', self.get_experiments),
+			('GET', r'/data/experiments/([^/]+)/scans', self.get_scans),
+			('GET', r'/data/projects/([^/]+)/config', self.get_config),
+			('GET', r'/data/projects/([^/]+)/config/bids', self.get_bids_config),
+			('PUT', r'/data/projects/([^/]+)/config/.*', self.put_config),
+			('GET', r'/xapi/commands/available', self.get_commands),
+			('GET', r'/xapi/projects/([^/]+)/wrappers/(\d+)/launch', self.get_launch_info),
+			('POST', r'/xapi/projects/([^/]+)/wrappers/(\d+)/launch', self.post_launch),
+			('POST', r'/xapi/projects/([^/]+)/wrappers/(\d+)/bulklaunch', self.post_bulk_launch),
+			('GET', r'/xapi/containers', self.get_containers),
+			('GET', r'/xapi/projects/([^/]+)/containers', self.get_containers),
+			('GET', r'/xapi/dicomscp', self.get_dicomscp),
+			('POST', r'/xapi/dqr/seriesInfo/pacs/1/studies', self.post_series_info),
+			('POST', r'/xapi/dqr/csvimport/generalImportFromJson', self.post_import),
+			('GET', r'/xapi/dqr/query/queue/all', self.get_queue),
+			('GET', r'/data/projects/([^/]+)/files', self.get_files),
+			('GET', r'/data/projects/([^/]+)/resources/([^/]+)/files', self.get_files),
+			('GET', r'/data/projects/([^/]+)/resources/([^/]+)/files/(.+)', self.get_file)
+		]
+		self.routes = [(m,re.compile(p+'$'),f) for m,p,f in self.routes]
+		self.server = None
+		self._thread = None
+		self.port = port
+
+	def _build(self, n_sessions, n_scans, n_files):
+		'''Generates the sessions, scans, PACS studies, and resource files
+		'''
+
+		rng = self._rng
+		self.sessions = []
+		self.scans = {}
+		self.studies = {}
+		for i in range(n_sessions):
+			sid = 'XNAT_E{:05d}'.format(i)
+			study_uid = '1.2.826.0.1.3680043.{}'.format(i)
+			self.sessions.append({
+				'ID': sid,
+				'label': 'sub-{:05d}_ses-01'.format(i),
+				'xsiType': 'xnat:mrSessionData',
+				'project': PROJECT,
+				'date': '2021-01-{:02d}'.format(i%28 + 1),
+				'URI': '/data/experiments/{}'.format(sid),
+				'UID': study_uid
+			})
+			series = []
+			for j in range(n_scans):
+				desc = SERIES_DESCRIPTIONS[(i+j)%len(SERIES_DESCRIPTIONS)]
+				series.append({
+					'seriesDescription': desc,
+					'seriesInstanceUid': '{}.{}'.format(study_uid,j+1),
+					'seriesNumber': j+1,
+					'modality': 'MR'
+				})
+			self.studies[study_uid] = series
+			self.scans[sid] = [{
+				'ID': str(j+1),
+				'xsiType': 'xnat:mrScanData',
+				'type': s['seriesDescription'],
+				'quality': 'usable' if rng.random() > 0.1 else 'questionable',
+				'series_description': s['seriesDescription'],
+				'URI': '/data/experiments/{}/scans/{}'.format(sid,j+1),
+				'UID': s['seriesInstanceUid']
+			} for j,s in enumerate(series)]
+
+		self.files = {}
+		for i in range(n_files):
+			modality = 'T1w' if i%2 == 0 else 'bold'
+			name = 'sub-{:05d}_ses-01_{}.json'.format(i//2,modality)
+			doc = {
+				'bids_meta': {
+					'subject_id': '{:05d}'.format(i//2),
+					'session_id': '01',
+					'modality': modality
+				},
+				'provenance': {'md5sum': '{:032x}'.format(i), 'version': '0.16.1'}
+			}
+			for k in IQMS: doc[k] = round(rng.gauss(1,0.2),6)
+			self.files[name] = json.dumps(doc).encode()
+
+	'''
+	Server control
+	'''
+
+	@property
+	def url(self):
+		'''Address of the running server (e.g. `http://127.0.0.1:8080`)
+		'''
+
+		return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+	def start(self):
+		'''Starts the server in a background thread
+
+		:return: The mock server
+		:rtype: MockXNAT
+		'''
+
+		mock = self
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+			disable_nagle_algorithm = True
+			def log_message(self, *args): pass
+			def do_GET(self): mock.handle(self,'GET')
+			def do_POST(self): mock.handle(self,'POST')
+			def do_PUT(self): mock.handle(self,'PUT')
+			def do_DELETE(self): mock.handle(self,'DELETE')
+
+		self.server = ThreadingHTTPServer(('127.0.0.1',self.port),Handler)
+		self.server.daemon_threads = True
+		self._thread = threading.Thread(target=self.server.serve_forever,daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		'''Stops the server
+		'''
+
+		if self.server is None: return
+		self.server.shutdown()
+		self.server.server_close()
+		self.server = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def handle(self, request, method):
+		'''Routes a request to its endpoint, applying the latency and failure injection
+		'''
+
+		url = urlsplit(request.path)
+		query = {k:v[-1] for k,v in parse_qs(url.query).items()}
+		length = int(request.headers.get('Content-Length') or 0)
+		body = request.rfile.read(length) if length else b''
+
+		route = None
+		for m,pattern,func in self.routes:
+			match = pattern.match(url.path)
+			if m == method and match:
+				route = (func,match.groups())
+				break
+
+		with self._lock:
+			self.counts[route[0].__name__ if route else 'unknown'] += 1
+			delay = self.latency + (self._rng.uniform(0,self.jitter) if self.jitter else 0)
+			fail = self._rng.random() < self.failure_rate
+
+		if delay: time.sleep(delay)
+		if route is None:
+			status,data = 404,{'message':'Not found: {} {}'.format(method,url.path)}
+		elif fail and route[0] not in [self.get_jsession,self.get_uptime]:
+			status,data = 503,{'message':'Service unavailable'}
+		else:
+			try:
+				status,data = 200,route[0](*route[1],query=query,body=body)
+			except Exception as ex:
+				status,data = 500,{'message':str(ex)}
+
+		if isinstance(data,str): data = data.encode()
+		if not isinstance(data,bytes): data = json.dumps(data).encode()
+
+		request.send_response(status)
+		request.send_header('Content-Type','application/json')
+		request.send_header('Content-Length',str(len(data)))
+		request.end_headers()
+		request.wfile.write(data)
+
+	def reset(self):
+		'''Clears the request counts, import queue, and containers
+		'''
+
+		with self._lock:
+			self.counts.clear()
+			self._queue = []
+			self._containers = []
+
+	def _pad(self, items):
+		if self.padding:
+			for item in items: item['padding'] = self.padding
+		return items
+
+	@staticmethod
+	def _result_set(items):
+		return {'ResultSet': {'Result': items, 'totalRecords': str(len(items))}}
+
+	'''
+	Endpoints
+	'''
+
+	def get_jsession(self, query, body):
+		return '0123456789ABCDEF0123456789ABCDEF'
+
+	def get_uptime(self, query, body):
+		return '1 Day, 2 Hours, 3 Minutes'
+
+	def get_experiments(self, project, query, body):
+		if 'columns' not in query:
+			keys = ['ID','label','xsiType','project','date','URI']
+			return self._result_set(self._pad([{k:s[k] for k in keys} for s in self.sessions]))
+
+		rows = []
+		for s in self.sessions:
+			for scan in self.scans[s['ID']]:
+				rows.append({
+					'ID': s['ID'],
+					'xsiType': s['xsiType'],
+					'xnat:imagesessiondata/uid': s['UID'],
+					'xnat:imagescandata/id': scan['ID'],
+					'xnat:imagescandata/xsi_type': scan['xsiType'],
+					'xnat:imagescandata/type': scan['type'],
+					'xnat:imagescandata/quality': scan['quality'],
+					'xnat:imagescandata/series_description': scan['series_description'],
+					'xnat:imagescandata/uid': scan['UID']
+				})
+		return self._result_set(self._pad(rows))
+
+	def get_scans(self, session_id, query, body):
+		keys = ['ID','xsiType','type','quality','series_description','URI']
+		return self._result_set(self._pad([{k:s[k] for k in keys} for s in self.scans[session_id]]))
+
+	def get_config(self, project, query, body):
+		return self._result_set([{'tool':'bids'},{'tool':'pipelines'}])
+
+	def get_bids_config(self, project, query, body):
+		return self._result_set([{'path':'bidsmap','status':'enabled','create_date':'2021-01-01'}])
+
+	def put_config(self, project, query, body):
+		return ''
+
+	def get_commands(self, query, body):
+		xsi = query.get('xsiType','')
+		if xsi.endswith('ScanData'):
+			root = 'scan'
+		elif xsi.endswith('SessionData'):
+			root = 'session'
+		else:
+			root = 'project'
+
+		return [{
+			'wrapper-id': i+1,
+			'wrapper-name': '{}-{}'.format(name,root),
+			'command-id': i+1,
+			'command-name': name,
+			'image-name': 'poldracklab/{}'.format(name),
+			'enabled': True,
+			'root-element-name': root,
+			'contexts': [xsi]
+		} for i,name in enumerate([COMMAND,'dcm2bids'])]
+
+	def get_launch_info(self, project, wrapper_id, query, body):
+		root = next((k for k in ['scan','session','project'] if k in query),None)
+		return {
+			'command': int(wrapper_id),
+			'input-config': [{
+				'name': root or 'session',
+				'user-settable': True,
+				'required': True,
+				'input-type': 'text',
+				'children': [{'name':'n_procs','user-settable':True,'required':False,'input-type':'text','children':[]}]
+			}],
+			'input-values': [
+				{'name': root or 'session', 'values': [{'value':query[root]}] if root else []},
+				{'name': 'n_procs', 'values': []}
+			]
+		}
+
+	def _launch(self, project, wrapper_id, params):
+		with self._lock:
+			container = {
+				'id': len(self._containers)+1,
+				'container-id': '{:064x}'.format(len(self._containers)+1),
+				'project': project,
+				'wrapper-id': int(wrapper_id),
+				'status': 'Created',
+				'created': time.time()
+			}
+			self._containers.append(container)
+		return {
+			'status': 'success',
+			'container-id': container['container-id'],
+			'params': params,
+			'type': 'container'
+		}
+
+	def post_launch(self, project, wrapper_id, query, body):
+		return self._launch(project,wrapper_id,json.loads(body))
+
+	def post_bulk_launch(self, project, wrapper_id, query, body):
+		return {
+			'successes': [self._launch(project,wrapper_id,p) for p in json.loads(body)],
+			'failures': []
+		}
+
+	def get_containers(self, project=None, query={}, body=b''):
+		now = time.time()
+		output = []
+		with self._lock:
+			for c in self._containers:
+				if project is not None and c['project'] != project: continue
+				age = now - c['created']
+				status = 'Complete' if age > self.container_time else 'Running' if age > self.container_time/2 else 'Created'
+				output.append(dict(c,status=status))
+		return output
+
+	def get_dicomscp(self, query, body):
+		return [{'id':1,'aeTitle':'XNAT','port':8104,'enabled':True}]
+
+	def post_series_info(self, query, body):
+		uids = [u for u in body.decode().split(',') if u]
+		return {u:{'results':self.studies[u]} for u in uids if u in self.studies}
+
+	def post_import(self, query, body):
+		now = time.time()
+		with self._lock:
+			for uid,study in json.loads(body).items():
+				self._queue.append({
+					'xnatProject': query.get('project',PROJECT),
+					'studyInstanceUid': uid,
+					'seriesIds': ','.join(study['seriesInstanceUids']),
+					'queuedTime': int(now*1000),
+					'created': now
+				})
+		return ''
+
+	def get_queue(self, query, body):
+		now = time.time()
+		with self._lock:
+			self._queue = [q for q in self._queue if now - q['created'] < self.queue_time]
+			items = []
+			for q in self._queue:
+				status = 'PROCESSING' if now - q['created'] > self.queue_time/2 else 'QUEUED'
+				item = {k:v for k,v in q.items() if k != 'created'}
+				items.append(dict(item,status=status,timestamp=int(now*1000)))
+		return items
+
+	def get_files(self, project, resource=RESOURCE, query={}, body=b''):
+		return self._result_set(self._pad([{
+			'Name': name,
+			'Size': str(len(data)),
+			'URI': '/data/projects/{}/resources/{}/files/{}'.format(project,resource,name),
+			'collection': resource,
+			'file_content': '',
+			'file_format': 'JSON',
+			'digest': hashlib.md5(data).hexdigest()
+		} for name,data in self.files.items()]))
+
+	def get_file(self, project, resource, name, query, body):
+		return self.files[name]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Runs a mock XNAT server')
+	parser.add_argument('--port', type=int, default=8080)
+	parser.add_argument('--sessions', type=int, default=100)
+	parser.add_argument('--scans', type=int, default=4)
+	parser.add_argument('--latency', type=float, default=0)
+	parser.add_argument('--jitter', type=float, default=0)
+	parser.add_argument('--failure-rate', type=float, default=0)
+	parser.add_argument('--padding', type=int, default=0)
+	args = parser.parse_args()
+
+	mock = MockXNAT(sessions=args.sessions, scans=args.scans, latency=args.latency, jitter=args.jitter,
+					failure_rate=args.failure_rate, padding=args.padding, port=args.port).start()
+	print('Mock XNAT server running at {} (project {})'.format(mock.url,PROJECT))
+	try:
+		while True: time.sleep(1)
+	except KeyboardInterrupt:
+		mock.stop()
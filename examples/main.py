@@ -116,9 +116,11 @@ if __name__ == '__main__':
         if xnat.commands.get_results():
             '''
             An XNAT project can also be supplied here if the JSON files are located under 
-            a project other than what was supplied in the initialization of the XNAT instance.
+            a project other than what was supplied in the initialization of the XNAT instance. 
+            The files are downloaded in parallel and streamed straight into the CSV file, so 
+            they are never all held in memory at once (use `download_json_files()` for a list).
             '''
-            json_files = xnat.commands.download_json_files(resource=resource_dir)
+            json_files = xnat.commands.iter_json_files(resource=resource_dir, workers=8)
 
             '''
             Define the name of the CSV file
@@ -1,11 +1,22 @@
 __all__ = [
 	'Connector',
+	'AsyncConnector',
 	'format_err',
 	'convert_seconds',
 	'write_json',
+	'flatten_json',
 	'json_to_csv',
-	'parse_csv'
+	'parse_csv',
+	'ColumnTable',
+	'load_csv',
+	'ResultsStore'
 ]
 
 from .connector import Connector
+from .aio import AsyncConnector
 from .utils import *
+from .table import (
+	ColumnTable,
+	load_csv
+)
+from .results import ResultsStore
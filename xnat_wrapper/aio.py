@@ -0,0 +1,306 @@
+import asyncio
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from .utils import format_err
+from .connector import Connector
+
+
+def run(coro):
+	'''Runs a coroutine from synchronous code and returns its result
+
+	:param coro: The coroutine to run (e.g. `conn.commands.find_project_experiments()`)
+	:return: The result of the coroutine
+	'''
+
+	return asyncio.run(coro)
+
+async def iterate(gen):
+	'''Iterates over a blocking generator without blocking the event loop. The 
+	generator is advanced by the default executor of the event loop, so it never 
+	takes up a request slot of an `AsyncExecutor`, and is closed when the 
+	iteration stops (even if it stops early).
+
+	:param gen: The generator (e.g. `CommandUtility.iter_commands()`)
+	:return: Async iterator of the items of the generator
+	:rtype: async_generator
+	'''
+
+	loop = asyncio.get_running_loop()
+	done = object()
+	try:
+		while True:
+			item = await loop.run_in_executor(None,next,gen,done)
+			if item is done: break
+			yield item
+	finally:
+		await loop.run_in_executor(None,gen.close)
+
+
+class AsyncExecutor(object):
+	'''Runs blocking XNAT requests for the async classes. Every async class
+	created from the same connection shares one executor, so the number of
+	requests in flight never exceeds `limit` (which matches the connection
+	pool size of the `Connector`).
+
+	:param limit: Maximum number of requests in flight, defaults to 10
+	:type limit: int, optional
+	'''
+
+	def __init__(self, limit=10):
+		'''Constructor method
+		'''
+
+		self.limit = limit
+		self.pool = ThreadPoolExecutor(max_workers=limit)
+
+	async def call(self, func, *args, **kwargs):
+		'''Runs a blocking function without blocking the event loop
+
+		:param func: The function to run
+		:return: The result of the function
+		'''
+
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.pool, functools.partial(func,*args,**kwargs))
+
+	async def map(self, func, items):
+		'''Runs a blocking function once per item, concurrently
+
+		:param func: The function to run
+		:param items: The items passed to the function
+		:return: List of results (in the same order as `items`), with an
+			exception in place of each call that failed
+		:rtype: list
+		'''
+
+		return await asyncio.gather(*[self.call(func,i) for i in items], return_exceptions=True)
+
+	def shutdown(self):
+		'''Stops the executor once the requests in flight have finished
+		'''
+
+		self.pool.shutdown(wait=False)
+
+
+class _AsyncWrapper(object):
+	'''Exposes every method of a synchronous object as a coroutine that is run
+	by an `AsyncExecutor`, and every generator method as an async generator (see 
+	`iterate()`). Attributes that are not methods are returned as is.
+	'''
+
+	def __init__(self, sync, executor):
+		self.sync = sync
+		self.executor = executor
+
+	def __getattr__(self, name):
+		if name.startswith('__') or name in ['sync','executor']: raise AttributeError(name)
+
+		attr = getattr(self.sync,name)
+		if not callable(attr): return attr
+
+		if inspect.isgeneratorfunction(attr):
+			@functools.wraps(attr)
+			def generator(*args, **kwargs):
+				return iterate(attr(*args,**kwargs))
+			return generator
+
+		@functools.wraps(attr)
+		async def method(*args, **kwargs):
+			return await self.executor.call(attr,*args,**kwargs)
+		return method
+
+
+class AsyncUIDImporter(_AsyncWrapper):
+	'''Async counterpart of `UIDImporter`. Every method of the importer is
+	available as a coroutine, and `find_studies()` sends its chunks of UIDs
+	to the PACS concurrently from the event loop.
+
+	:param importer: The UID importer of an open connection
+	:param executor: The executor shared by the connection
+	:type importer: UIDImporter
+	:type executor: AsyncExecutor
+	'''
+
+	async def find_studies(self, uids=[], filters={}, chunk_size=None, retries=2):
+		'''Find studies using a list of study UIDs (see `UIDImporter.find_studies()`).
+		Each chunk of UIDs is sent as a separate request, all at once (capped by
+		the executor), and chunks that fail are retried on their own.
+
+		:param uids: List of study UIDs
+		:param filters: Dictionary with keys corresponding to the keyword
+			(e.g. `seriesDescription`) and values corresponding to a list
+			of approved values (e.g. [`Ax T1`,`Ax T2`]).
+		:param chunk_size: The maximum number of UIDs sent per request, defaults to None (all at once)
+		:param retries: The number of times a failed chunk is retried, defaults to 2
+		:type uids: list, optional
+		:type filters: dict, optional
+		:type chunk_size: int, optional
+		:type retries: int, optional
+		'''
+
+		query = self.sync._query_chunks(uids,filters,chunk_size,retries)
+		try:
+			chunks,delay = next(query)
+			while True:
+				await asyncio.sleep(delay)
+				chunks,delay = query.send(await self.executor.map(self.sync.query_studies,chunks))
+		except StopIteration:
+			pass
+
+
+class AsyncCommandUtility(_AsyncWrapper):
+	'''Async counterpart of `CommandUtility`. Every method of the command
+	utility is available as a coroutine. Session scan listings and JSON file
+	downloads are sent concurrently from the event loop (capped by the executor),
+	and `iter_json_files()` and `iter_commands()` are async generators.
+
+	:param utility: The command utility of an open connection
+	:param executor: The executor shared by the connection
+	:type utility: CommandUtility
+	:type executor: AsyncExecutor
+	'''
+
+	async def find_project_experiments(self, project=None, bulk=False, quality='usable'):
+		'''Finds all of the sessions and scans under an XNAT project
+		(see `CommandUtility.find_project_experiments()`). Sessions whose scans
+		cannot be listed are skipped.
+
+		:param project: The name of the XNAT project
+		:param bulk: Gather all sessions and scans using two project-wide
+			listings instead of one scan listing per session, defaults to False
+		:param quality: The scan quality (or list of qualities) that will be
+			kept in `scans`, or `None` to keep every scan, defaults to `usable`
+		:type project: str, optional
+		:type bulk: bool, optional
+		:type quality: str or list, optional
+		'''
+
+		utility = self.sync
+		if bulk: return await self.executor.call(utility.find_project_experiments,project,True,quality)
+
+		if project is not None: utility.set_project(project)
+		if utility.project is None:
+			raise ValueError('Unable to get project experiments: Project has not been defined.')
+
+		try:
+			await self.executor.call(utility._load_sessions)
+			sids = [exp['ID'] for exp in utility.index.sessions]
+			for sid,scans in zip(sids,await self.executor.map(utility._get_session_scans,sids)):
+				if isinstance(scans,Exception):
+					format_err('Unable to list scans for {}: {}'.format(sid,scans))
+					continue
+				for scan in scans: utility.index.add_scan(sid,scan)
+		except Exception as ex:
+			format_err(ex)
+
+		utility._set_experiments(quality)
+
+	async def iter_json_files(self, project=None, resource='', ordered=True, files=None):
+		'''Downloads data from JSON files located under an XNAT project (and optionally
+		filtered by a resource name), yielding each JSON structure as soon as it is
+		downloaded (see `CommandUtility.iter_json_files()`).
+
+		:param project: The name of the XNAT project
+		:param resource: The name of the XNAT project resource
+		:param ordered: Yield the files in the order they are listed in XNAT rather than
+			in the order they finish downloading, defaults to True
+		:param files: XNAT file entries to download instead of searching the project/resource
+		:type project: str, optional
+		:type resource: str, optional
+		:type ordered: bool, optional
+		:type files: list, optional
+		:return: Async iterator of JSON structures
+		:rtype: async_generator
+		'''
+
+		utility = self.sync
+		if files is None: files = await self.executor.call(utility.find_json_files,project,resource)
+
+		entries = utility._iter_json_entries(files,self.executor.limit,ordered,self.executor.pool)
+		async for entry,doc in iterate(entries): yield doc
+
+	async def download_json_files(self, project=None, resource=''):
+		'''Downloads data from JSON files located under an XNAT project
+		and (optionally) filtered by a resource name
+
+		:param project: The name of the XNAT project
+		:param resource: The name of the XNAT project resource
+		:type project: str, optional
+		:type resource: str, optional
+		:return: A list of JSON structures downloaded from JSON files located
+			in under a specific XNAT project/resource.
+		:rtype: list
+		'''
+
+		return [doc async for doc in self.iter_json_files(project,resource)]
+
+
+class AsyncConnector(_AsyncWrapper):
+	'''Async counterpart of `Connector`. Every method of the connector is
+	available as a coroutine, and `importer` and `commands` are async versions
+	of the UID importer and command utility. All three share one executor,
+	sized to the connection pool of the connector.
+
+	Can be used as an async context manager, which closes the session on exit::
+
+		async with await AsyncConnector.connect(config='xnat.cfg') as conn:
+			await conn.commands.find_project_experiments('PROJECT')
+
+	From synchronous code, coroutines can be run with `run()`.
+
+	:param connector: An open connection, defaults to a new `Connector`
+		created from the keyword arguments (see `Connector`)
+	:type connector: Connector, optional
+	'''
+
+	def __init__(self, connector=None, **kwargs):
+		'''Constructor method
+		'''
+
+		if connector is None: connector = Connector(**kwargs)
+		super(AsyncConnector, self).__init__(connector, AsyncExecutor(connector._http_opts['pool_size']))
+
+	@classmethod
+	async def connect(cls, **kwargs):
+		'''Opens a new connection without blocking the event loop
+
+		:return: The async connector
+		:rtype: AsyncConnector
+		'''
+
+		loop = asyncio.get_running_loop()
+		connector = await loop.run_in_executor(None, functools.partial(Connector,**kwargs))
+		return cls(connector)
+
+	@property
+	def importer(self):
+		'''The async UID importer of the current session
+		'''
+
+		return AsyncUIDImporter(self.sync.importer, self.executor)
+
+	@property
+	def commands(self):
+		'''The async command utility of the current session
+		'''
+
+		return AsyncCommandUtility(self.sync.commands, self.executor)
+
+	async def aclose(self):
+		'''Disconnects from the current XNAT session and stops the executor
+		'''
+
+		try:
+			if self.sync.xnat is not None: await self.executor.call(self.sync.close_session)
+		finally:
+			self.executor.shutdown()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *args):
+		await self.aclose()
+
+if __name__ == '__main__':
+	pass
@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import base64
+import fnmatch
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from requests.structures import CaseInsensitiveDict
+from .utils import (
+	format_err,
+	write_json
+)
+
+
+'''
+Default cache lifetimes (in seconds) of XNAT endpoints that rarely change,
+matched against the path of each request (see `ResponseCache`)
+'''
+CACHE_RULES = {
+	'/xapi/commands/available': 300,
+	'/xapi/dicomscp': 3600,
+	'/data/projects/*/config': 300,
+	'/data/projects/*/config/*': 300
+}
+
+
+'''
+Response headers that are never stored by `ResponseCache` (cookies, 
+authentication, and hop-by-hop headers)
+'''
+EXCLUDED_HEADERS = [
+	'set-cookie',
+	'set-cookie2',
+	'www-authenticate',
+	'proxy-authenticate',
+	'authorization',
+	'proxy-authorization',
+	'connection',
+	'keep-alive',
+	'te',
+	'trailer',
+	'transfer-encoding',
+	'upgrade'
+]
+
+class TTLCache(object):
+	'''Thread-safe dictionary whose entries expire after a set amount of time. 
+	Callers that compute missing values can hold the lock of a key (see 
+	`key_lock()`) so that each value is only computed once at a time.
+
+	:param ttl: Number of seconds an entry remains valid (`None` to never
+		expire), defaults to 300
+	:type ttl: float, optional
+	'''
+
+	_missing = object()
+
+	def __init__(self, ttl=300):
+		'''Constructor method
+		'''
+
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._data = {}
+		self._key_locks = {}
+
+	def __contains__(self, key):
+		return self.get(key,self._missing) is not self._missing
+
+	def __len__(self):
+		with self._lock:
+			return len(self._data)
+
+	def get(self, key, default=None):
+		'''Returns the value stored for a key if it has not expired
+
+		:param key: The cache key
+		:param default: Value returned when the key is missing or expired
+		:return: The cached value or `default`
+		'''
+
+		with self._lock:
+			try:
+				value,expires = self._data[key]
+			except KeyError:
+				return default
+
+			if expires is not None and expires <= time.monotonic():
+				del self._data[key]
+				return default
+			return value
+
+	def key_lock(self, key):
+		'''Returns the lock of a key, which is held while its value is computed 
+		and stored. Callers that miss on the same key at the same time wait for 
+		the first one, then find its value in the cache::
+
+			with cache.key_lock(key):
+				value = cache.get(key)
+				if value is None:
+					value = compute(key)
+					cache.set(key, value)
+
+		:param key: The cache key
+		:return: Lock shared by every caller using the key
+		:rtype: threading.Lock
+		'''
+
+		with self._lock:
+			if key not in self._key_locks: self._key_locks[key] = threading.Lock()
+			return self._key_locks[key]
+
+	def set(self, key, value, ttl=None):
+		'''Stores a value for a key
+
+		:param key: The cache key
+		:param value: The value to store
+		:param ttl: Number of seconds the entry remains valid, defaults to
+			the cache `ttl`
+		:type ttl: float, optional
+		'''
+
+		if ttl is None: ttl = self.ttl
+		expires = None if ttl is None else time.monotonic() + ttl
+		with self._lock:
+			self._data[key] = (value,expires)
+
+	def invalidate(self, match=None):
+		'''Removes entries from the cache
+
+		:param match: A key to remove, or a function that receives each key
+			and returns `True` if it should be removed. If `None`, every
+			entry is removed.
+		:type match: optional
+		:return: Number of entries removed
+		:rtype: int
+		'''
+
+		with self._lock:
+			if match is None:
+				keys = list(self._data)
+			elif callable(match):
+				keys = [k for k in self._data if match(k)]
+			else:
+				keys = [match] if match in self._data else []
+
+			for k in keys: del self._data[k]
+		return len(keys)
+
+	def clear(self):
+		'''Removes every entry from the cache
+		'''
+
+		self.invalidate()
+
+
+class ResponseCache(object):
+	'''Size-bounded (least recently used) cache of HTTP responses, used by the
+	HTTP adapter of a `Connector` to answer GET requests without going to the
+	network. The lifetime of each response is set by the first rule whose
+	pattern (e.g. `/data/projects/*/config`) matches the request path, and
+	requests that do not match any rule are not cached.
+
+	Expired responses that were sent with an `ETag` or `Last-Modified` header are
+	kept and revalidated with a conditional request, so unchanged data is not
+	downloaded again. Any other request (e.g. PUT) to a path removes the cached
+	responses of that path and its parents.
+
+	The cache can be saved to (and loaded from) a JSON file so that repeated runs
+	start warm. Responses are stored as returned by the server (without cookies,
+	authentication, or hop-by-hop headers), so each user should have their own
+	cache file.
+
+	:param maxsize: Maximum number of responses stored, defaults to 1024
+	:param rules: Dictionary with path patterns as keys and lifetimes (in seconds)
+		as values, defaults to `CACHE_RULES`
+	:param ttl: Lifetime of responses that do not match a rule, defaults to 0 (not cached)
+	:param path: Name of the file used to persist the cache, defaults to None (not persisted)
+	:type maxsize: int, optional
+	:type rules: dict, optional
+	:type ttl: float, optional
+	:type path: str, optional
+	'''
+
+	def __init__(self, maxsize=1024, rules=None, ttl=0, path=None):
+		'''Constructor method
+		'''
+
+		if path and not path.endswith('.json'): path += '.json'
+
+		self.maxsize = maxsize
+		self.rules = dict(CACHE_RULES if rules is None else rules)
+		self.ttl = ttl
+		self.path = path
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._data = OrderedDict()
+		if path: self.load()
+
+	def __len__(self):
+		with self._lock:
+			return len(self._data)
+
+	def get_ttl(self, url):
+		'''Returns the lifetime of the responses for a URL
+
+		:param str url: The request URL
+		:return: Number of seconds a response is used for (0 if it is not cached)
+		:rtype: float
+		'''
+
+		path = urlsplit(url).path
+		for pattern,ttl in self.rules.items():
+			if fnmatch.fnmatchcase(path,pattern): return ttl
+		return self.ttl
+
+	def get(self, url):
+		'''Returns the cached response for a URL, expired or not
+
+		:param str url: The request URL
+		:return: Dictionary containing the response `status`, `headers`, `content` 
+			(bytes), and `expires` (wall-clock time), or `None` if there is none
+		:rtype: dict
+		'''
+
+		with self._lock:
+			entry = self._data.get(url)
+			if entry is None:
+				self.misses += 1
+				return None
+
+			self._data.move_to_end(url)
+			if self.is_fresh(entry): self.hits += 1
+			return entry
+
+	@staticmethod
+	def is_fresh(entry):
+		'''Checks if a cached response can be used without revalidating it
+		'''
+
+		return entry['expires'] > time.time()
+
+	@staticmethod
+	def get_validators(entry):
+		'''Returns the conditional request headers for a cached response
+
+		:param dict entry: The cached response
+		:return: Dictionary of headers (empty if the response cannot be revalidated)
+		:rtype: dict
+		'''
+
+		stored = CaseInsensitiveDict(entry['headers'])
+		headers = {}
+		if stored.get('ETag'): headers['If-None-Match'] = stored['ETag']
+		if stored.get('Last-Modified'): headers['If-Modified-Since'] = stored['Last-Modified']
+		return headers
+
+	@staticmethod
+	def get_headers(headers):
+		'''Returns the response headers that can be stored (see `EXCLUDED_HEADERS`), 
+		with lowercase names so they can be looked up after a round trip through JSON
+
+		:param dict headers: The response headers
+		:return: Dictionary of headers
+		:rtype: dict
+		'''
+
+		return {k.lower():v for k,v in headers.items() if k.lower() not in EXCLUDED_HEADERS}
+
+	def set(self, url, status, headers, content, ttl=None):
+		'''Stores a response
+
+		:param str url: The request URL
+		:param int status: The response status
+		:param dict headers: The response headers
+		:param bytes content: The response body
+		:param ttl: Number of seconds the response is used for, defaults to the rule for the URL
+		:type ttl: float, optional
+		'''
+
+		if ttl is None: ttl = self.get_ttl(url)
+		entry = {
+			'status': status,
+			'headers': self.get_headers(headers),
+			'content': content,
+			'expires': time.time() + ttl
+		}
+		with self._lock:
+			self._data[url] = entry
+			self._data.move_to_end(url)
+			while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+	def refresh(self, url, ttl=None):
+		'''Restarts the lifetime of a cached response (after the server confirms it has not changed)
+
+		:param str url: The request URL
+		:param ttl: Number of seconds the response is used for, defaults to the rule for the URL
+		:type ttl: float, optional
+		'''
+
+		if ttl is None: ttl = self.get_ttl(url)
+		with self._lock:
+			if url in self._data: self._data[url]['expires'] = time.time() + ttl
+
+	def invalidate(self, url=None):
+		'''Removes the cached responses of a path and its parents (or every response)
+
+		:param url: The URL (or path) that changed, defaults to None (every response)
+		:type url: str, optional
+		:return: Number of responses removed
+		:rtype: int
+		'''
+
+		with self._lock:
+			if url is None:
+				keys = list(self._data)
+			else:
+				path = urlsplit(url).path.rstrip('/')
+				keys = [k for k in self._data if path.startswith(urlsplit(k).path.rstrip('/'))]
+
+			for k in keys: del self._data[k]
+		return len(keys)
+
+	def clear(self):
+		'''Removes every response from the cache
+		'''
+
+		self.invalidate()
+
+	def load(self):
+		'''Loads the cache file (if it exists)
+		'''
+
+		if not self.path or not os.path.isfile(self.path): return
+
+		try:
+			with open(self.path,'r') as f:
+				data = json.load(f).get('responses',{})
+			with self._lock:
+				self._data = OrderedDict(
+					(url,dict(entry,headers=self.get_headers(entry['headers']),content=base64.b64decode(entry['content'])))
+					for url,entry in data.items()
+				)
+		except Exception as ex:
+			format_err(ex)
+
+	def save(self):
+		'''Writes the cache to file (if a file was given)
+		'''
+
+		if not self.path: return
+
+		with self._lock:
+			data = {
+				url: dict(entry,content=base64.b64encode(entry['content']).decode('ascii'))
+				for url,entry in self._data.items()
+			}
+		write_json({'responses':data}, self.path, indent=None)
+
+if __name__ == '__main__':
+	pass
@@ -1,9 +1,30 @@
 import json
 import logging
+from collections import deque
+from concurrent.futures import (
+	ThreadPoolExecutor,
+	FIRST_COMPLETED,
+	wait
+)
 from .utils import (
 	format_err, 
 	write_json
 )
+from .cache import TTLCache
+from .metrics import timed
+from .experiment_index import ExperimentIndex
+from .manifest import FileManifest
+from .scheduler import CommandScheduler
+from .watcher import ContainerWatcher
+from .throttle import default_limiter
+from .transport import (
+	DEFAULT_TIMEOUT,
+	NO_TIMEOUT,
+	timeout_options
+)
+
+
+SCAN_COLUMNS = ['id','xsi_type','type','quality','series_description']
 
 
 class CommandUtility(object):
@@ -32,6 +53,13 @@ class CommandUtility(object):
 		self.commands = commands
 		self.scans = []
 		self.sessions = [] 
+		self.index = ExperimentIndex()
+		self.limiter = default_limiter
+		self.launch_timeout = DEFAULT_TIMEOUT
+		self.metrics = None
+		self.wrapper_cache = TTLCache(ttl=300)
+		self._container_variants = {}
+		self._container_inputs = {}
 		self._has_experiments = False
 		self._has_bids = False
 		self._results = {}
@@ -55,11 +83,21 @@ class CommandUtility(object):
 
 		self.project = project
 
-	def find_project_experiments(self, project=None):
+	@timed('discovery')
+	def find_project_experiments(self, project=None, bulk=False, quality='usable', workers=1):
 		'''Finds all of the sessions and scans under an XNAT project.
 
 		:param project: The name of the XNAT project
+		:param bulk: Gather all sessions and scans using two project-wide 
+			listings instead of one scan listing per session, defaults to False
+		:param quality: The scan quality (or list of qualities) that will be 
+			kept in `scans`, or `None` to keep every scan, defaults to `usable`
+		:param workers: Number of scan listings to request at once when not 
+			using `bulk` (still capped by `limiter`), defaults to 1
 		:type project: str, optional
+		:type bulk: bool, optional
+		:type quality: str or list, optional
+		:type workers: int, optional
 		'''
 
 		if project is not None: self.set_project(project)
@@ -67,21 +105,86 @@ class CommandUtility(object):
 		if self.project is None:
 			raise ValueError('Unable to get project experiments: Project has not been defined.')
 
+		try:
+			self._load_sessions()
+			if bulk:
+				self._find_scans_bulk()
+			elif workers > 1:
+				with ThreadPoolExecutor(max_workers=workers) as pool:
+					sids = [exp['ID'] for exp in self.index.sessions]
+					for sid,scans in zip(sids,pool.map(self._get_session_scans,sids)):
+						for scan in scans: self.index.add_scan(sid,scan)
+			else:
+				for exp in self.index.sessions:
+					for scan in self._get_session_scans(exp['ID']): self.index.add_scan(exp['ID'],scan)
+		except Exception as ex:
+			format_err(ex)
+
+		self._set_experiments(quality)
+
+	def _load_sessions(self):
+		'''Clears the experiment index and adds every session in the project to it
+		'''
+
 		self.scans = []
 		self.sessions = []
+		self.index.clear()
 		self._has_experiments = False
-		try:
-			uri = '/data/projects/{}/experiments'.format(self.project)
+
+		uri = '/data/projects/{}/experiments'.format(self.project)
+		res = self.xnat.get(uri).json()
+		for exp in res['ResultSet']['Result']: self.index.add_session(exp)
+
+	def _set_experiments(self, quality='usable'):
+		'''Sets `sessions` and `scans` from the experiment index
+		'''
+
+		self.sessions = list(self.index.sessions)
+		self.scans = self.index.find(quality=quality)
+		self._has_experiments = len(self.sessions) > 0
+
+	@timed('discovery')
+	def _get_session_scans(self, session_id):
+		'''Lists the scans of a single session. Safe to call from worker 
+		threads, as the number of requests in flight is capped by `limiter`.
+
+		:param str session_id: The `ID` of the XNAT session
+		:return: List of the session's scans
+		:rtype: list
+		'''
+
+		uri = '/data/experiments/{}/scans'.format(session_id)
+		with self.limiter.slot(getattr(self.xnat,'_server','')):
 			res = self.xnat.get(uri).json()
-			self.sessions.extend(res['ResultSet']['Result'])
+		return res['ResultSet']['Result']
 
-			for exp in self.sessions:
-				uri = '/data/experiments/{}/scans'.format(exp['ID'])
-				res = self.xnat.get(uri).json()
-				self.scans.extend([s for s in res['ResultSet']['Result'] if s['quality'] == 'usable'])
-				self._has_experiments = True
-		except Exception as ex:
-			format_err(ex)
+	def _find_scans_bulk(self):
+		'''Adds every scan in the project to the experiment index using a 
+		single listing (via the `columns` option of the experiments endpoint) 
+		rather than one scan listing per session.
+		'''
+
+		uri = '/data/projects/{}/experiments'.format(self.project)
+		opts = {
+			'format': 'json',
+			'columns': ','.join(['ID','xsiType'] + ['xnat:imagescandata/{}'.format(c) for c in SCAN_COLUMNS])
+		}
+		res = self.xnat.get(uri,params=opts).json()
+		for row in res['ResultSet']['Result']:
+			row = {k.lower():v for k,v in row.items()}
+			scan_id = row.get('xnat:imagescandata/id')
+			exp = self.index.get_session(row.get('id'))
+			if not scan_id or exp is None: continue
+
+			xsi = row.get('xnat:imagescandata/xsi_type') or exp['xsiType'].replace('SessionData','ScanData')
+			self.index.add_scan(exp['ID'],{
+				'xsiType': xsi,
+				'ID': scan_id,
+				'type': row.get('xnat:imagescandata/type',''),
+				'quality': row.get('xnat:imagescandata/quality',''),
+				'series_description': row.get('xnat:imagescandata/series_description',''),
+				'URI': '/data/experiments/{}/scans/{}'.format(exp['ID'],scan_id)
+			})
 
 	def has_experiments(self, project=None):
 		'''Determines if a project has experiments (sessions and/or scans)
@@ -110,6 +213,7 @@ class CommandUtility(object):
 		
 		return {'sessions':self.sessions, 'scans':self.scans}
 
+	@timed('bids_map')
 	def check_bids_map(self):
 		'''Utility to check if a BIDS map exists within an XNAT project.
 			If one does not exist, then one will be uploaded.
@@ -154,8 +258,12 @@ class CommandUtility(object):
 
 		self._has_bids = has_bids
 
+	@timed('wrapper_lookup')
 	def get_wrapper_command(self,name,xsi):
 		'''Function that looks for a function in an XNAT project matching a name and XSI type.
+		Results are kept in `wrapper_cache` (keyed by project, XSI type, and name) so the 
+		list of available commands is only downloaded once per `wrapper_cache.ttl` seconds, 
+		and threads that miss on the same key wait for a single download.
 
 		:param str name: The name of the XNAT function
 		:param str xsi: The domain level of the XNAT function (e.g. `xnat:mrScanData`)
@@ -163,29 +271,63 @@ class CommandUtility(object):
 		:rtype: dict or None
 		'''
 
-		try:
-			url = '/xapi/commands/available'
-			opts = {'project':self.project,'xsiType':xsi}
-			res = xnat.get(url,params=opts).json()
-
-			for item in res:
-				if not item['enabled']: continue
-				if name not in item['command-name']: continue
-
-				cmd = '/xapi/projects/{}/'.format(self.project)
-				if 'wrapper-id' in item:
-					cmd += 'wrappers/{}/launch'.format(item['wrapper-id'])
-				elif 'command-id' in item and 'wrapper-name' in item:
-					cmd += 'commands/{}/wrappers/{}/launch'.format(item['command-id'],item['wrapper-name'])
-				else:
-					continue
+		key = (self.project,xsi,name)
+		wrapper = self.wrapper_cache.get(key,False)
+		if wrapper is not False: return wrapper
 
-				item['launch'] = cmd 
-				return item
-		except Exception as ex:
-			format_err(ex)
+		with self.wrapper_cache.key_lock(key):
+			wrapper = self.wrapper_cache.get(key,False)
+			if wrapper is not False: return wrapper
+
+			try:
+				url = '/xapi/commands/available'
+				opts = {'project':self.project,'xsiType':xsi}
+				res = self.xnat.get(url,params=opts).json()
+
+				wrapper = None
+				for item in res:
+					if not item['enabled']: continue
+					if name not in item['command-name']: continue
+
+					cmd = '/xapi/projects/{}/'.format(self.project)
+					if 'wrapper-id' in item:
+						cmd += 'wrappers/{}/launch'.format(item['wrapper-id'])
+					elif 'command-id' in item and 'wrapper-name' in item:
+						cmd += 'commands/{}/wrappers/{}/launch'.format(item['command-id'],item['wrapper-name'])
+					else:
+						continue
+
+					item['launch'] = cmd 
+					wrapper = item
+					break
+
+				self.wrapper_cache.set(key,wrapper)
+				return wrapper
+			except Exception as ex:
+				format_err(ex)
 		return None
 
+	def invalidate_wrapper_cache(self, name=None, xsi=None, project=None):
+		'''Removes command wrappers from the cache so they are looked up again. 
+		Any arguments left as `None` match every wrapper.
+
+		:param name: The name of the XNAT function
+		:param xsi: The domain level of the XNAT function (e.g. `xnat:mrScanData`)
+		:param project: The name of the XNAT project
+		:type name: str, optional
+		:type xsi: str, optional
+		:type project: str, optional
+		:return: Number of wrappers removed from the cache
+		:rtype: int
+		'''
+
+		def match(key):
+			return all(v is None or v == k for k,v in zip(key,(project,xsi,name)))
+
+		self._container_variants.clear()
+		self._container_inputs.clear()
+		return self.wrapper_cache.invalidate(match)
+
 	def get_inputs(self, search_list):
 		'''Recursively search an XNAT function wrapper for inputs.
 
@@ -209,7 +351,7 @@ class CommandUtility(object):
 			except: pass
 			
 			try:
-				c = get_inputs(item['children'])
+				c = self.get_inputs(item['children'])
 				for k,v in c.items():
 					v['is_child'] = True
 					output[k] = v
@@ -217,8 +359,37 @@ class CommandUtility(object):
 
 		return output
 
+	def get_param_variants(self, params):
+		'''Builds the rewrites of a set of container parameters that are tried when 
+		probing a container: `archive` (`/data` replaced by `/archive`), `unchanged`, 
+		and `stripped` (leading `/data/...` path segments removed).
+
+		:param dict params: Parameters passed to the XNAT container API
+		:return: List of (variant name, parameters) pairs without duplicates
+		:rtype: list
+		'''
+
+		archive = dict(params)
+		stripped = dict(params)
+		for k,v in params.items():
+			if '/data' in str(v):
+				archive[k] = v.replace('/data','/archive')
+				v_split = v.split('/')
+				if len(v_split) > 3:
+					stripped[k] = '/'.join(v_split[3:])
+				else:
+					stripped[k] = v_split[-1]
+
+		variants = []
+		for name,opts in (('archive',archive),('unchanged',dict(params)),('stripped',stripped)):
+			if all(opts != v for n,v in variants): variants.append((name,opts))
+		return variants
+
+	@timed('container_probe')
 	def get_container_info(self,url,params={}):
-		'''Get XNAT container/plugin information and check that all required parameters are valid.
+		'''Get XNAT container/plugin information and check that all required parameters are valid. 
+		The parameter variant that succeeds is remembered per launch URL and tried first on 
+		the next call, and the parsed input configuration is cached per launch URL.
 
 		:param params: Parameters passed to the XNAT container API
 		:type params: dict, optional 
@@ -226,22 +397,17 @@ class CommandUtility(object):
 		:rtype: dict or None
 		'''
 
-		params['format'] = 'json'
-		param_list = [params,params,params]
-		for k,v in params.items():
-			if '/data' in str(v):
-				param_list[0][k] = param_list[0][k].replace('/data','/archive')
-				v_split = param_list[2][k].split('/')
-				if len(v_split) > 3:
-					param_list[2][k] = '/'.join(v_split[3:])
-				else:
-					param_list[2][k] = v_split[-1]
+		variants = self.get_param_variants(dict(params,format='json'))
+		best = self._container_variants.get(url)
+		variants.sort(key=lambda v: v[0] != best)
 
 		errs = []
-		for opts in param_list:
+		for variant,opts in variants:
 			try:
 				res = self.xnat.get(url,params=opts).json()
-				inputs = self.get_inputs(res['input-config'])
+				if url not in self._container_inputs:
+					self._container_inputs[url] = self.get_inputs(res['input-config'])
+				inputs = self._container_inputs[url]
 				res['params'] = opts
 
 				in_vals = res['input-values']
@@ -255,13 +421,29 @@ class CommandUtility(object):
 								errs.append('Required value "{}" missing from input values.'.format(name))
 					except: pass
 
-				if not errs: return res
+				if not errs: 
+					self._container_variants[url] = variant
+					return res
 			except Exception as ex:
 				format_err(ex)
 
 		for e in errs: logging.warning(e)
 		return None
 
+	def get_launch_timeout(self, params):
+		'''Returns the timeout used to launch a container. Project-level launches use 
+		`launch_timeout` (`None` for no timeout), and every other launch uses the 
+		default timeout of the session. The timeout is converted by `timeout_options()` 
+		before it is sent, so launches also work on a session without a `TimeoutHTTPAdapter`.
+
+		:param dict params: Parameters passed to the XNAT container API
+		:return: The timeout (`DEFAULT_TIMEOUT`, `NO_TIMEOUT`, a number of seconds, or a `(connect, read)` tuple)
+		'''
+
+		if 'project' not in params: return DEFAULT_TIMEOUT
+		return NO_TIMEOUT if self.launch_timeout is None else self.launch_timeout
+
+	@timed('launch')
 	def run_container(self,cmd,params):
 		'''Run an XNAT container/plugin on a project, session, or scan.
 
@@ -278,15 +460,10 @@ class CommandUtility(object):
 			'error': False
 		}
 		try:
-			if 'project' in params:
-				output = self.xnat.post(cmd,
-					headers={'Content-type': 'application/json'},
-					data=json.dumps(params),
-					timeout=None).json()
-			else:
-				output = self.xnat.post(cmd,
-					headers={'Content-type': 'application/json'},
-					data=json.dumps(params)).json()
+			output = self.xnat.post(cmd,
+				headers={'Content-type': 'application/json'},
+				data=json.dumps(params),
+				**timeout_options(self.get_launch_timeout(params))).json()
 
 			if 'status' in output:
 				if output['status'] != 'success': 
@@ -305,13 +482,105 @@ class CommandUtility(object):
 
 		return result
 
-	def find_and_run_command(self, exp_list, cmd, params={}):
+	@timed('launch')
+	def run_bulk_container(self,cmd,param_list):
+		'''Run an XNAT container/plugin on several projects, sessions, or scans using a 
+		single request to the XNAT bulk launch endpoint.
+
+		:param str cmd: XNAT command API endpoint to run command (i.e. the wrapper `launch` endpoint)
+		:param list param_list: List of parameters passed to the XNAT container API (one per launch)
+		:return: Results of the command in the same format as `run_container()`, one per item 
+			in `param_list` and in the same order
+		:rtype: list
+		'''
+
+		url = cmd[:-len('launch')] + 'bulklaunch' if cmd.endswith('/launch') else cmd
+		results = [{
+			'command': url,
+			'opts': params,
+			'result': None,
+			'error': 'No launch report returned for item.'
+		} for params in param_list]
+
+		try:
+			output = self.xnat.post(url,
+				headers={'Content-type': 'application/json'},
+				data=json.dumps(param_list)).json()
+
+			'''
+			Launch reports are matched to their items using the launch parameters 
+			that differ between items (e.g. the root element, such as `scan`).
+			'''
+			keys = [k for k in param_list[0] if len(set(str(p.get(k)) for p in param_list)) > 1]
+			lookup = {tuple(str(p.get(k)) for k in keys):i for i,p in enumerate(param_list)}
+
+			for status in ['successes','failures']:
+				for report in output.get(status,[]):
+					i = lookup.get(tuple(str(report.get('params',{}).get(k)) for k in keys))
+					if i is None: continue
+
+					results[i]['result'] = report
+					results[i]['error'] = False
+					if status == 'failures':
+						results[i]['error'] = 'Status: {}'.format(report.get('status','failure'))
+						if 'message' in report: results[i]['error'] += '. Message: {}'.format(report['message'])
+		except Exception as ex:
+			format_err(ex)
+			for r in results: r['error'] = '{}'.format(ex)
+
+		return results
+
+	def prepare_command(self, exp, cmd, params={}):
+		'''Finds the command wrapper and container information needed to run a 
+		command on a single project, session, or scan.
+
+		:param dict exp: An XNAT project, session, or scan
+		:param str cmd: The name of the command 
+		:param params: The optional parameters (or `kwargs`) that should be passed to the command
+		:type params: dict, optional
+		:return: The experiment info, wrapper, and container information, 
+			or `None` if the command cannot be run on the experiment
+		:rtype: dict or None
+		'''
+
+		xsi = exp['xsiType']
+		xid = exp['URI']
+
+		logging.info('>> Getting wrapper...')
+		wrapper = self.get_wrapper_command(cmd,xsi)
+		if wrapper is None: 
+			logging.warning('>> No command found for {} ({}).'.format(xid,xsi))
+			return None
+
+		root_elem = wrapper['root-element-name']
+		opts = {k:v for k,v in params.items()}
+		opts[root_elem] = xid
+		
+		logging.info('>> Getting container...')
+		container = self.get_container_info(wrapper['launch'],opts)
+		if container is None: 
+			logging.warning('>> Unable to get container information for {} ({})'.format(xid,root_elem))
+			return None
+
+		return {
+			'info': exp,
+			'wrapper': wrapper,
+			'container': container,
+			'result': None
+		}
+
+	def find_and_run_command(self, exp_list, cmd, params={}, bulk=False, chunk_size=50):
 		'''Function that runs a given XNAT command on a list of projects, sessions, of scans.
 
 		:param list exp_list: A list of XNAT projects, sessions, or scans.
 		:param str cmd: The name of the command 
 		:param params: The optional parameters (or `kwargs`) that should be passed to the command
+		:param bulk: Launch the containers through the XNAT bulk launch endpoint (grouped by 
+			wrapper) instead of one request per item, defaults to False
+		:param chunk_size: The maximum number of containers per bulk launch request, defaults to 50
 		:type params: dict, optional
+		:type bulk: bool, optional
+		:type chunk_size: int, optional
 		:return: List of the command results including the its wrapper and container information
 		:rtype: list
 		'''
@@ -323,51 +592,92 @@ class CommandUtility(object):
 				count += 1
 				logging.info('({}/{}) Gathering info on {}...'.format(count,len(exp_list),e['URI']))
 
-				xsi = e['xsiType']
-				xid = e['URI']
-
-				logging.info('>> Getting wrapper...')
-				wrapper = self.get_wrapper_command(cmd,xsi)
-				if wrapper is None: 
-					logging.warning('>> No command found for {} ({}).'.format(xid,xsi))
-					continue
-
-				root_elem = wrapper['root-element-name']
-				opts = {k:v for k,v in params.items()}
-				opts[root_elem] = xid
-				
-				logging.info('>> Getting container...')
-				container = self.get_container_info(wrapper['launch'],opts)
-				if container is None: 
-					logging.warning('>> Unable to get container information for {} ({})'.format(xid,root_elem))
-					continue
-
-				logging.info('>> Running container...')
-				result = self.run_container(wrapper['launch'],container['params'])
-				
-				if result is not None: logging.info('>> Success!')
-				results.append({
-					'info': e,
-					'wrapper': wrapper,
-					'container': container,
-					'result': result
-				})
+				item = self.prepare_command(e,cmd,params)
+				if item is None: continue
+
+				if not bulk:
+					logging.info('>> Running container...')
+					item['result'] = self.run_container(item['wrapper']['launch'],item['container']['params'])
+					if item['result'] is not None: logging.info('>> Success!')
+				results.append(item)
+
+			if bulk:
+				groups = {}
+				for item in results:
+					groups.setdefault(item['wrapper']['launch'],[]).append(item)
+
+				for launch,items in groups.items():
+					for i in range(0,len(items),chunk_size):
+						chunk = items[i:i+chunk_size]
+						logging.info('>> Running containers {}-{}/{}...'.format(i+1,i+len(chunk),len(items)))
+						res = self.run_bulk_container(launch,[item['container']['params'] for item in chunk])
+						for item,result in zip(chunk,res): item['result'] = result
 		except Exception as ex:
 			format_err(ex)
 
 		return results
 
-	def run_commands(self, project=None, commands=None):
-		'''Run a series of commands on XNAT projects, sessions, or scans.
+	def get_level_experiments(self, level):
+		'''Returns the experiments that a command on a given level is run on.
+
+		:param str level: The XNAT project level (i.e. project, session, or scan)
+		:return: A list of XNAT projects, sessions, or scans, or `None` if the level is unknown
+		:rtype: list or None
+		'''
+
+		if level == 'scan':
+			return self.scans 
+		elif level == 'session':
+			return self.sessions 
+		elif level == 'project':
+			return [{
+				'xsiType': 'xnat:projectData',
+				'URI': '/data/projects/{}'.format(self.project)
+			}]
+		return None
+
+	def run_commands(self, project=None, commands=None, bulk=False, chunk_size=50, 
+					concurrency=None, rate=None, callback=None, dag=False, wait=False, wait_timeout=3600):
+		'''Run a series of commands on XNAT projects, sessions, or scans. If `concurrency`, 
+		`rate`, or `dag` are defined, the commands are run by a `CommandScheduler` (see `iter_commands()`), 
+		which launches each container separately and cannot be combined with `bulk`.
 
 		:param project: Name of the XNAT project
 		:param commands: Dictionary of commands with the XNAT project level 
 			(i.e. project, session, or scan) as the keys and the command 
 			name and options as the values.
+		:param bulk: Launch containers through the XNAT bulk launch endpoint, defaults to False
+		:param chunk_size: The maximum number of containers per bulk launch request, defaults to 50
+		:param concurrency: Maximum number of launches in flight, either for every level 
+			or as a dictionary with levels as keys
+		:param rate: Maximum number of container probes and launches per second
+		:param callback: Function called with each progress event
+		:param dag: Run the commands as a dependency graph, where each session starts as soon 
+			as its own scans are complete, defaults to False
+		:param wait: When running as a dependency graph, wait for containers to finish (rather 
+			than for their launch requests to return) before starting dependent commands, defaults to False
+		:param wait_timeout: Maximum number of seconds to wait for the containers of each launch 
+			when `wait` is set, defaults to 3600
 		:type project: str, optional
 		:type commands: dict, optional
+		:type bulk: bool, optional
+		:type chunk_size: int, optional
+		:type concurrency: int or dict, optional
+		:type rate: float, optional
+		:type callback: function, optional
+		:type dag: bool, optional
+		:type wait: bool, optional
+		:type wait_timeout: float, optional
+		:raises ValueError: `bulk` is combined with `concurrency`, `rate`, or `dag`
 		'''
 
+		if concurrency is not None or rate is not None or dag:
+			if bulk:
+				raise ValueError('Unable to run commands: Bulk launches cannot be combined with concurrency, rate, or dag.')
+			for event in self.iter_commands(project, commands, concurrency or 1, rate, callback, dag, 
+											wait=wait, wait_timeout=wait_timeout): pass
+			return
+
 		try:
 			if project is not None: self.set_project(project)
 			if commands is not None: self.set_commands(commands)
@@ -377,18 +687,9 @@ class CommandUtility(object):
 			if not self.commands:
 				raise ValueError('Unable to run commands: No commands found.')
 
-			for level,cmd in commands.items():
-				exp_list = []
-				if level == 'scan':
-					exp_list = self.scans 
-				elif level == 'session':
-					exp_list = self.sessions 
-				elif level == 'project':
-					exp_list = [{
-						'xsiType': 'xnat:projectData',
-						'URI': '/data/projects/{}'.format(self.project)
-					}]
-				else:
+			for level,cmd in self.commands.items():
+				exp_list = self.get_level_experiments(level)
+				if exp_list is None:
 					logging.warning('Unexpected level found in commands: {}'.format(level))
 					continue
 
@@ -398,12 +699,87 @@ class CommandUtility(object):
 
 				if exp_list:
 					logging.info('Running "{}" on {} {}(s)'.format(cmd['name'],len(exp_list),level))
-					self._results[k] = self.find_and_run_command(exp_list, cmd['name'], cmd['opts'])
+					self._results[level] = self.find_and_run_command(exp_list, cmd['name'], cmd['opts'], bulk, chunk_size)
 				else:
 					logging.info('Unable to run command "{}": No {}(s) found.'.format(cmd['name'],level))
 		except Exception as ex:
 			format_err(ex)
 
+	def iter_commands(self, project=None, commands=None, concurrency=4, rate=None, callback=None, 
+					dag=False, strict=False, wait=False, wait_timeout=3600):
+		'''Run a series of commands with a bounded number of launches in flight per level 
+		and (optionally) a limit on requests per second, yielding progress as it happens.
+
+		:param project: Name of the XNAT project
+		:param commands: Dictionary of commands with the XNAT project level 
+			(i.e. project, session, or scan) as the keys and the command 
+			name and options as the values.
+		:param concurrency: Maximum number of launches in flight, either for every level 
+			or as a dictionary with levels as keys, defaults to 4
+		:param rate: Maximum number of container probes and launches per second
+		:param callback: Function called with each progress event
+		:param dag: Run the commands as a dependency graph (see `CommandScheduler.run_pipeline()`) 
+			instead of one level at a time, defaults to False
+		:param strict: When running as a dependency graph, skip experiments whose 
+			dependencies failed, defaults to False
+		:param wait: When running as a dependency graph, use a `ContainerWatcher` to wait for 
+			containers to finish before starting dependent commands, defaults to False
+		:param wait_timeout: Maximum number of seconds to wait for the containers of each launch 
+			when `wait` is set (see `CommandScheduler.run_pipeline()`), defaults to 3600
+		:type project: str, optional
+		:type commands: dict, optional
+		:type concurrency: int or dict, optional
+		:type rate: float, optional
+		:type callback: function, optional
+		:type dag: bool, optional
+		:type strict: bool, optional
+		:type wait: bool, optional
+		:type wait_timeout: float, optional
+		:return: Iterator of progress events (see `CommandScheduler.run()`)
+		:rtype: generator
+		'''
+
+		try:
+			if project is not None: self.set_project(project)
+			if commands is not None: self.set_commands(commands)
+
+			if self.project is None: 
+				raise ValueError('Unable to run commands: Project is not defined.')
+			if not self.commands:
+				raise ValueError('Unable to run commands: No commands found.')
+
+			waiter = None
+			if wait:
+				waiter = ContainerWatcher(self.xnat, self.project)
+				waiter.metrics = self.metrics
+			scheduler = CommandScheduler(self, concurrency, rate, callback, waiter)
+			if dag:
+				events = scheduler.run_pipeline(self.commands, strict, wait_timeout)
+			else:
+				events = scheduler.run(self.commands)
+			for event in events: yield event
+		except Exception as ex:
+			format_err(ex)
+
+	def watch_results(self, interval=2, max_interval=60, callback=None):
+		'''Creates a container watcher that tracks every container launched by the 
+		command utility (see `get_results()`).
+
+		:param interval: Minimum number of seconds between polls, defaults to 2
+		:param max_interval: Maximum number of seconds between polls, defaults to 60
+		:param callback: Function called with each state-transition event
+		:type interval: float, optional
+		:type max_interval: float, optional
+		:type callback: function, optional
+		:return: Container watcher tracking the launched containers
+		:rtype: ContainerWatcher
+		'''
+
+		watcher = ContainerWatcher(self.xnat, self.project, interval, max_interval, callback)
+		watcher.metrics = self.metrics
+		for level,results in self._results.items(): watcher.track_results(results)
+		return watcher
+
 	def get_results(self):
 		'''Returns the results stored in the command utility object
 
@@ -434,16 +810,16 @@ class CommandUtility(object):
 		else:
 			logging.warning('Unable to write results to file: No results found.')
 
-	def download_json_files(self, project=None, resource=''):
-		'''Downloads data from JSON files located under an XNAT project 
+	@timed('json_download')
+	def find_json_files(self, project=None, resource=''):
+		'''Lists the JSON files located under an XNAT project 
 		and (optionally) filtered by a resource name
 
 		:param project: The name of the XNAT project
 		:param resource: The name of the XNAT project resource
 		:type project: str, optional
 		:type resource: str, optional
-		:return: A list of JSON structures downloaded from JSON files located
-			in under a specific XNAT project/resource.
+		:return: A list of XNAT file entries (containing `URI`, `Name`, `Size`, etc.)
 		:rtype: list
 		'''
 
@@ -456,27 +832,147 @@ class CommandUtility(object):
 
 		logging.info('Searching for JSON files in {}'.format(uri))
 
-		pct = 20
 		output = []
 		try:
 			res = self.xnat.get(uri).json()
-			res = [f['URI'] for f in res['ResultSet']['Result'] if f['URI'].endswith('json')]
+			output = [f for f in res['ResultSet']['Result'] if f['URI'].endswith('json')]
+		except Exception as ex:
+			format_err(ex)
+
+		return output
+
+	@timed('json_download')
+	def _download_json(self, uri):
+		with self.limiter.slot(getattr(self.xnat,'_server','')):
+			return self.xnat.get(uri).json()
+
+	def iter_json_files(self, project=None, resource='', workers=4, ordered=True, files=None):
+		'''Downloads data from JSON files located under an XNAT project (and optionally 
+		filtered by a resource name), yielding each JSON structure as soon as it is 
+		downloaded. At most `2*workers` files are held in memory at once, so the output 
+		can be passed directly to `json_to_csv()` for very large resources.
 
-			logging.info('Search complete. Downloading data from {} files...'.format(len(res)))
-			for f in res:
-				tmp = self.xnat.get(f).json()
-				output.append(tmp)
+		:param project: The name of the XNAT project
+		:param resource: The name of the XNAT project resource
+		:param workers: Number of files to download at once (still capped by `limiter`), defaults to 4
+		:param ordered: Yield the files in the order they are listed in XNAT rather than 
+			in the order they finish downloading, defaults to True
+		:param files: XNAT file entries to download instead of searching the project/resource
+		:type project: str, optional
+		:type resource: str, optional
+		:type workers: int, optional
+		:type ordered: bool, optional
+		:type files: list, optional
+		:return: Iterator of JSON structures
+		:rtype: generator
+		'''
+
+		if files is None: files = self.find_json_files(project,resource)
+		for entry,doc in self._iter_json_entries(files,workers,ordered): yield doc
 
-				c_pct = 100*len(output)/len(res)
-				if c_pct >= pct:
+	def _iter_json_entries(self, files, workers=4, ordered=True, pool=None):
+		'''Downloads a list of XNAT JSON files (see `iter_json_files()`), yielding 
+		`(file entry, JSON structure)` pairs. Files that fail to download are skipped. 
+		At most `2*workers` downloads are pending at a time, sent by `pool` if one is 
+		given (e.g. by `AsyncCommandUtility.iter_json_files()`).
+		'''
+
+		entries = iter(files)
+		total = len(files)
+
+		logging.info('Search complete. Downloading data from {} files...'.format(total))
+
+		pct = 20
+		count = 0
+		own_pool = pool is None
+		if own_pool: pool = ThreadPoolExecutor(max_workers=max(1,workers))
+		pending = deque()
+		def submit():
+			entry = next(entries,None)
+			if entry is not None: pending.append((entry,pool.submit(self._download_json,entry['URI'])))
+
+		try:
+			for i in range(2*max(1,workers)): submit()
+			while pending:
+				if ordered:
+					entry,f = pending.popleft()
+				else:
+					wait([p[1] for p in pending],return_when=FIRST_COMPLETED)
+					entry,f = next(p for p in pending if p[1].done())
+					pending.remove((entry,f))
+				submit()
+
+				count += 1
+				try:
+					doc = f.result()
+				except Exception as ex:
+					format_err('Unable to download {}: {}'.format(entry['URI'],ex))
+					continue
+
+				if 100*count/total >= pct:
 					logging.info('>> {}{} complete'.format(pct,'%'))
 					pct += 20
+				yield entry,doc
 
 			logging.info('>> Download complete!')
-		except Exception as ex:
-			format_err(ex)
+		finally:
+			for entry,f in pending: f.cancel()
+			if own_pool: pool.shutdown()
 
-		return output
+	def download_json_files(self, project=None, resource='', workers=1):
+		'''Downloads data from JSON files located under an XNAT project 
+		and (optionally) filtered by a resource name
+
+		:param project: The name of the XNAT project
+		:param resource: The name of the XNAT project resource
+		:param workers: Number of files to download at once, defaults to 1
+		:type project: str, optional
+		:type resource: str, optional
+		:type workers: int, optional
+		:return: A list of JSON structures downloaded from JSON files located
+			in under a specific XNAT project/resource.
+		:rtype: list
+		'''
+
+		return list(self.iter_json_files(project,resource,workers))
+
+	def sync_json_files(self, project=None, resource='', manifest=None, workers=4):
+		'''Downloads data from JSON files located under an XNAT project (and optionally 
+		filtered by a resource name), only downloading files that are new or have changed 
+		(by size or digest) since the last sync. Downloaded files are stored in a local 
+		manifest file and merged with the previously downloaded files.
+
+		:param project: The name of the XNAT project
+		:param resource: The name of the XNAT project resource
+		:param manifest: Name of the local manifest file, defaults to `json_manifest_<project>` 
+			(or `json_manifest_<project>_<resource>`, see `FileManifest.get_default_name()`), so each 
+			project and resource has its own manifest
+		:param workers: Number of files to download at once, defaults to 4
+		:type project: str, optional
+		:type resource: str, optional
+		:type manifest: str, optional
+		:type workers: int, optional
+		:return: A list of JSON structures from every JSON file located under a specific 
+			XNAT project/resource (in the same order as `download_json_files()`)
+		:rtype: list
+		'''
+
+		files = self.find_json_files(project,resource)
+		if not files:
+			logging.warning('Unable to sync project files: No JSON files found.')
+			return []
+
+		if manifest is None: manifest = FileManifest.get_default_name(self.project,resource)
+		mf = FileManifest(manifest)
+		n_removed = mf.prune(files)
+		changed = mf.get_changed(files)
+		logging.info('{} of {} files are new or changed ({} removed since last sync).'.format(len(changed),len(files),n_removed))
+
+		if changed:
+			for entry,doc in self._iter_json_entries(changed,workers): mf.update(entry,doc)
+
+		mf.save()
+		return mf.get_data(files)
 
 if __name__ == '__main__': 
 	pass
@@ -1,6 +1,15 @@
 import logging
 from pyxnat import Interface
 from .utils import format_err
+from .transport import (
+	HTTP_OPTIONS,
+	make_cache,
+	make_metrics,
+	configure_session
+)
+from .metrics import Phase
+from .throttle import HostLimiter
+from .health import HealthMonitor
 from .uid_importer import UIDImporter
 from .command_utility import CommandUtility
 
@@ -15,7 +24,34 @@ class Connector(object):
 	:param str user: The username for the XNAT session
 	:param str password: The password for the XNAT session
 	:param project: The name of an XNAT project
+	:param pool_size: Maximum number of connections kept open to the server (and number of 
+		requests the importer and command utility send to it at once), defaults to 10
+	:param retries: Maximum number of retries for requests that fail to connect or 
+		return a 429, 502, 503, or 504 status (launches and imports are never retried), defaults to 0
+	:param backoff: Backoff factor in seconds between retries, defaults to 0.5
+	:param timeout: Default timeout in seconds (or a `(connect, read)` tuple) for 
+		every request, defaults to None (no timeout)
+	:param launch_timeout: Timeout for project-level container launches (`None` for 
+		no timeout), defaults to `timeout`
+	:param cache: Cache for GET requests to endpoints that rarely change: `True`, the 
+		name of a file used to persist the cache between runs, or a `ResponseCache`, 
+		defaults to None (no cache)
 	:type project: str, optional
+	:type pool_size: int, optional
+	:type retries: int, optional
+	:type backoff: float, optional
+	:type timeout: float or tuple, optional
+	:type launch_timeout: float or tuple, optional
+	:param metrics: Records every request in a `MetricsRegistry`: `True`, a function 
+		called with each request, or a `MetricsRegistry`, defaults to None (no metrics)
+	:param health_window: Number of seconds a connection check (or any other response) 
+		is trusted by `is_connected()`, defaults to 30
+	:param heartbeat: Number of seconds between background connection checks, 
+		defaults to None (no heartbeat thread)
+	:type cache: bool, str, or ResponseCache, optional
+	:type metrics: bool, function, or MetricsRegistry, optional
+	:type health_window: float, optional
+	:type heartbeat: float, optional
 	'''
 
 	def __init__(self, **kwargs):
@@ -28,7 +64,12 @@ class Connector(object):
 		self.commands = None
 
 		self._login = None
-		self._uptime = None
+		self._http_opts = dict(HTTP_OPTIONS)
+		self.limiter = HostLimiter(self._http_opts['pool_size'])
+		self.cache = None
+		self.metrics = None
+		self.health = None
+		self._health_opts = {'window': 30, 'heartbeat': None}
 		self._is_connected = False
 
 		self.initialize_session(**kwargs)
@@ -43,6 +84,9 @@ class Connector(object):
 		:param str password: The password for the XNAT session
 		:param project: The name of an XNAT project
 		:type project: str, optional
+
+		The HTTP options accepted by the constructor (e.g. `pool_size` and 
+		`timeout`) can also be passed here.
 		'''
 
 		if self.xnat is not None:
@@ -56,14 +100,66 @@ class Connector(object):
 			self._login = {k:v for k,v in kwargs.items() if k in ['server','user','password']}
 
 		if 'project' in kwargs: self.project = kwargs['project']
+		self._http_opts.update({k:v for k,v in kwargs.items() if k in HTTP_OPTIONS})
+		if 'health_window' in kwargs: self._health_opts['window'] = kwargs['health_window']
+		if 'heartbeat' in kwargs: self._health_opts['heartbeat'] = kwargs['heartbeat']
 
 		try:
 			self.xnat = Interface(**self._login)
 			self.importer = UIDImporter(self.xnat, self.project)
 			self.commands = CommandUtility(self.xnat, self.project)
+			self.importer.limiter = self.commands.limiter = self.limiter
+			self.health = HealthMonitor(self.xnat, **self._health_opts)
+			self.set_http_options()
 		except Exception as ex:
 			format_err(ex)
 
+	def set_http_options(self, **kwargs):
+		'''Applies the connection pool size, retry policy, and timeouts to the 
+		XNAT session, which are used by every request sent by the importer 
+		and command utilities. The pool size also sets the limit of the `limiter` 
+		of this connection, which is not shared with other connections.
+
+		:param pool_size: Maximum number of connections kept open to the server
+		:param retries: Maximum number of retries for failed requests
+		:param backoff: Backoff factor in seconds between retries
+		:param timeout: Default timeout in seconds (or a `(connect, read)` tuple)
+		:param launch_timeout: Timeout for project-level container launches (`None` for no timeout)
+		:param cache: Cache for GET requests (see `Connector`)
+		:param metrics: Registry that every request is recorded in (see `Connector`)
+		:type pool_size: int, optional
+		:type retries: int, optional
+		:type backoff: float, optional
+		:type timeout: float or tuple, optional
+		:type launch_timeout: float or tuple, optional
+		:type cache: bool, str, or ResponseCache, optional
+		:type metrics: bool, function, or MetricsRegistry, optional
+		'''
+
+		self._http_opts.update({k:v for k,v in kwargs.items() if k in HTTP_OPTIONS})
+		self._http_opts['cache'] = self.cache = make_cache(self._http_opts['cache'])
+		self._http_opts['metrics'] = self.metrics = make_metrics(self._http_opts['metrics'])
+		self.limiter.set_limit(self._http_opts['pool_size'])
+		if self.xnat is None: return
+
+		configure_session(self.xnat._http, **self._http_opts)
+		self.commands.launch_timeout = self._http_opts['launch_timeout']
+		self.commands.metrics = self.importer.metrics = self.metrics
+
+	def phase(self, name):
+		'''Creates a phase that labels the requests made within it (see `MetricsRegistry`). 
+		Can be used as a context manager or decorator, and does nothing if metrics are not enabled::
+
+			with xnat.phase('nightly'):
+				xnat.commands.run_commands()
+
+		:param str name: Name of the phase
+		:return: The phase
+		:rtype: Phase
+		'''
+
+		return Phase(self.metrics, name)
+
 	def get(self,endpoint,opts={}):
 		'''Gets custom endpoint via xnat.get()
 		'''
@@ -84,10 +180,13 @@ class Connector(object):
 		'''Disconnects from the current XNAT session
 		'''
 
+		if self.cache is not None: self.cache.save()
+		if self.health is not None: self.health.close()
 		self.xnat.disconnect()
 		self.xnat = None
 		self.importer = None
 		self.commands = None
+		self.health = None
 		self._is_connected = False
 
 	def set_project(self, project):
@@ -101,23 +200,17 @@ class Connector(object):
 		self.importer.set_project(project)
 		self.commands.set_project(project)
 
-	def is_connected(self):
-		'''Checks for a valid XNAT connection
+	def is_connected(self, force=False):
+		'''Checks for a valid XNAT connection. The server is only contacted if 
+		there has been no response from it within the health window.
 
+		:param force: Contact the server even if there was a recent response, defaults to False
+		:type force: bool, optional
 		:return: `True` if there is a valid XNAT connection, else `False`
 		:rtype: bool
 		'''
 
-		self._is_connected = False
-		if self.xnat is not None: 
-			try:
-				res = self.xnat.get('/xapi/siteConfig/uptime/display')
-				res.raise_for_status()
-				self._uptime = res.text
-				self._is_connected = True
-			except Exception as ex:
-				format_err(ex)
-
+		self._is_connected = self.health is not None and self.health.is_alive(force)
 		return self._is_connected
 
 	def get_uptime(self):
@@ -127,8 +220,10 @@ class Connector(object):
 		:rtype: str
 		'''
 
-		if self.is_connected():
-			return self._uptime
+		uptime = self.health.get_uptime() if self.health is not None else None
+		self._is_connected = uptime is not None
+		if self._is_connected:
+			return uptime
 		else:
 			return 'WARNING: XNAT server is offline'
 
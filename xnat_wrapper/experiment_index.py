@@ -0,0 +1,103 @@
+class ExperimentIndex(object):
+	'''In-memory index of the sessions and scans in an XNAT project. Scans
+	are indexed by their parent session, their XSI type, and their quality
+	so that subsets (e.g. all usable `xnat:mrScanData` scans) can be
+	selected without returning to the server.
+
+	:param sessions: A list of XNAT project sessions
+	:type sessions: list, optional
+	'''
+
+	def __init__(self, sessions=[]):
+		'''Constructor method
+		'''
+
+		self.clear()
+		for s in sessions: self.add_session(s)
+
+	def clear(self):
+		'''Removes all sessions and scans from the index
+		'''
+
+		self.sessions = []
+		self.scans = []
+		self._sessions = {}
+		self._by_session = {}
+		self._by_xsi = {}
+		self._by_quality = {}
+
+	def add_session(self, session):
+		'''Adds a session to the index. Sessions that have already been
+		added (by `ID`) are ignored.
+
+		:param dict session: XNAT session information (must contain `ID`)
+		'''
+
+		sid = session['ID']
+		if sid in self._sessions: return
+
+		self._sessions[sid] = session
+		self._by_session[sid] = []
+		self.sessions.append(session)
+
+	def add_scan(self, session_id, scan):
+		'''Adds a scan to the index under its parent session.
+
+		:param str session_id: The `ID` of the session the scan belongs to
+		:param dict scan: XNAT scan information
+		'''
+
+		pos = len(self.scans)
+		self.scans.append(scan)
+		self._by_session.setdefault(session_id,[]).append(pos)
+		self._by_xsi.setdefault(scan.get('xsiType'),[]).append(pos)
+		self._by_quality.setdefault(scan.get('quality'),[]).append(pos)
+
+	def get_session(self, session_id):
+		'''Returns the session with a given `ID`
+
+		:param str session_id: The `ID` of the XNAT session
+		:return: XNAT session information
+		:rtype: dict or None
+		'''
+
+		return self._sessions.get(session_id)
+
+	def find(self, session=None, xsi=None, quality=None):
+		'''Finds all scans matching a session, XSI type, and/or quality.
+		Any criteria left as `None` are not used to filter the scans, and
+		each criteria can be a single value or a list of values.
+
+		:param session: The `ID` of the parent session(s)
+		:param xsi: The XSI type(s) of the scans (e.g. `xnat:mrScanData`)
+		:param quality: The quality label(s) of the scans (e.g. `usable`)
+		:type session: str or list, optional
+		:type xsi: str or list, optional
+		:type quality: str or list, optional
+		:return: List of matching scans in the order they were added
+		:rtype: list
+		'''
+
+		matches = None
+		for idx,value in ((self._by_session,session),(self._by_xsi,xsi),(self._by_quality,quality)):
+			if value is None: continue
+			if not isinstance(value,(list,tuple,set)): value = [value]
+
+			pos = set()
+			for v in value: pos.update(idx.get(v,[]))
+			matches = pos if matches is None else matches & pos
+
+		if matches is None: return list(self.scans)
+		return [self.scans[i] for i in sorted(matches)]
+
+	def count(self, **kwargs):
+		'''Counts the scans matching the criteria accepted by `find()`
+
+		:return: Number of matching scans
+		:rtype: int
+		'''
+
+		return len(self.find(**kwargs))
+
+if __name__ == '__main__':
+	pass
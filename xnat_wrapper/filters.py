@@ -0,0 +1,134 @@
+import re
+from operator import and_
+
+
+'''
+Keywords that can be used in a filter definition (see `SeriesFilter`)
+'''
+MATCH_TYPES = ['in','prefix','regex']
+FILTER_KEYS = MATCH_TYPES + ['not_{}'.format(m) for m in MATCH_TYPES]
+
+
+class SeriesFilter(object):
+	'''Compiled version of the UID importer filters, built once and then used
+	to filter the series of every study.
+
+	Each filter key (e.g. `seriesDescription`) can be given a list of approved
+	values (exact matches), a single approved value, or a dictionary containing
+	any of the following: `in` (approved values), `prefix` (approved prefixes),
+	`regex` (approved regular expressions), and `not_in`, `not_prefix`, or
+	`not_regex` (rejected values, prefixes, or regular expressions). A series is
+	kept if, for every key, its value matches at least one approved value,
+	prefix, or expression (when any are given) and none of the rejected ones.
+	An empty list of approved values (e.g. `{'seriesDescription': []}`) rejects
+	every series.
+
+	:param filters: Dictionary with keys corresponding to the keyword
+		(e.g. `seriesDescription`) and values corresponding to the approved
+		(or rejected) values, defaults to no filters
+	:type filters: dict, optional
+	'''
+
+	def __init__(self, filters={}):
+		'''Constructor method
+		'''
+
+		self.filters = filters
+		self.rules = []
+		for key,spec in filters.items():
+			if not isinstance(spec, dict): spec = {'in':spec}
+
+			unknown = [k for k in spec if k not in FILTER_KEYS]
+			if unknown:
+				raise ValueError('Unable to compile filter for "{}": Unknown option(s) {}'.format(key,unknown))
+
+			self.rules.append((key,self._compile(spec)))
+
+	def __bool__(self):
+		return len(self.rules) > 0
+
+	@staticmethod
+	def _as_list(values):
+		if values is None: return []
+		if isinstance(values,(list,tuple,set,frozenset)): return list(values)
+		return [values]
+
+	def _compile(self, spec):
+		'''Builds the test for a single filter key. Exact matches use a hashed set,
+		prefixes use a single `str.startswith()` call, and regular expressions are
+		combined into a single expression.
+		'''
+
+		tests = {}
+		for neg in ['','not_']:
+			exact = set(self._as_list(spec.get(neg+'in')))
+			prefix = tuple(str(p) for p in self._as_list(spec.get(neg+'prefix')))
+			regex = self._as_list(spec.get(neg+'regex'))
+			regex = re.compile('|'.join('(?:{})'.format(r) for r in regex)) if regex else None
+
+			if not exact and not prefix and regex is None and (neg or 'in' not in spec):
+				tests[neg] = None
+			elif not prefix and regex is None:
+				tests[neg] = exact.__contains__
+			else:
+				tests[neg] = self._any_test(exact,prefix,regex)
+
+		pos,neg = tests[''],tests['not_']
+		if neg is None: return pos
+		if pos is None: return lambda v: not neg(v)
+		return lambda v: pos(v) and not neg(v)
+
+	@staticmethod
+	def _any_test(exact, prefix, regex):
+		def test(v):
+			if v in exact: return True
+			if v is None: return False
+			v = str(v)
+			if prefix and v.startswith(prefix): return True
+			return regex is not None and regex.search(v) is not None
+		return test
+
+	def mask(self, series):
+		'''Evaluates every series against every filter key, one key at a time.
+		Each test is only run once per distinct value of a key.
+
+		:param list series: List of series information (dictionaries)
+		:return: List of booleans (`True` if the series is kept)
+		:rtype: list
+		'''
+
+		keep = [True]*len(series)
+		for key,test in self.rules:
+			if test is None: continue
+			column = [s.get(key) for s in series]
+			try:
+				results = {v:test(v) for v in set(column)}
+				passed = map(results.__getitem__,column)
+			except TypeError:
+				passed = map(test,column)
+			keep = list(map(and_,keep,passed))
+		return keep
+
+	def apply(self, series):
+		'''Filters a list of series
+
+		:param list series: List of series information (dictionaries)
+		:return: List of the series that passed every filter
+		:rtype: list
+		'''
+
+		if not self.rules: return list(series)
+		return [s for s,k in zip(series,self.mask(series)) if k]
+
+	def matches(self, item):
+		'''Checks if a single series passes every filter
+
+		:param dict item: Series information
+		:return: `True` if the series is kept, otherwise `False`
+		:rtype: bool
+		'''
+
+		return all(test is None or test(item.get(key)) for key,test in self.rules)
+
+if __name__ == '__main__':
+	pass
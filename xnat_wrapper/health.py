@@ -0,0 +1,161 @@
+import time
+import logging
+import threading
+from .utils import format_err
+
+
+'''
+Endpoint used to check the connection (and get the server uptime)
+'''
+UPTIME_URI = '/xapi/siteConfig/uptime/display'
+
+
+class HealthMonitor(object):
+	'''Keeps track of whether an XNAT connection is alive without sending a
+	request for every check. Every successful response received from the server
+	counts as proof that the connection is alive, so the uptime endpoint is only
+	checked when there has been no successful traffic for `window` seconds. An optional heartbeat
+	thread checks the connection in the background so that `is_alive()` never
+	has to wait for a request.
+
+	:param class xnat: An open XNAT connection via pyxnat.Interface()
+	:param window: Number of seconds the result of a check (or a response) is
+		used for, defaults to 30
+	:param heartbeat: Number of seconds between background checks, defaults to
+		None (no heartbeat thread)
+	:type window: float, optional
+	:type heartbeat: float, optional
+	'''
+
+	def __init__(self, xnat, window=30, heartbeat=None):
+		'''Constructor method
+		'''
+
+		self.xnat = xnat
+		self.window = window
+		self.heartbeat = heartbeat
+		self.checks = 0
+
+		self._lock = threading.Lock()
+		self._alive = False
+		self._checked = None
+		self._uptime = None
+		self._uptime_checked = None
+		self._stop = threading.Event()
+		self._thread = None
+
+		self.xnat._http.hooks['response'].append(self.record)
+		if heartbeat: self.start(heartbeat)
+
+	def record(self, res, *args, **kwargs):
+		'''Response hook that marks the connection as alive from any successful 
+		response. Responses read from the response cache are ignored, and an error 
+		response (5xx or 401) clears the last check so that the next call to 
+		`is_alive()` checks the connection.
+
+		:param res: A response received by the session
+		:type res: requests.Response
+		'''
+
+		if res.raw is None: return
+		with self._lock:
+			if res.status_code >= 500 or res.status_code == 401:
+				self._alive = False
+				self._checked = None
+				return
+
+			self._alive = True
+			self._checked = time.monotonic()
+			if res.url.endswith(UPTIME_URI):
+				self._uptime = res.text
+				self._uptime_checked = self._checked
+
+	def _is_recent(self, checked):
+		return checked is not None and time.monotonic() - checked < self.window
+
+	def check(self):
+		'''Checks the connection by requesting the server uptime
+
+		:return: `True` if the server responded, otherwise `False`
+		:rtype: bool
+		'''
+
+		self.checks += 1
+		try:
+			res = self.xnat.get(UPTIME_URI)
+			res.raise_for_status()
+		except Exception as ex:
+			format_err(ex)
+			with self._lock:
+				self._alive = False
+				self._checked = None
+		return self._alive
+
+	def is_alive(self, force=False):
+		'''Checks for a valid XNAT connection, only sending a request if there
+		has been no response within the last `window` seconds
+
+		:param force: Check the connection even if there was a recent response, defaults to False
+		:type force: bool, optional
+		:return: `True` if there is a valid XNAT connection, else `False`
+		:rtype: bool
+		'''
+
+		with self._lock:
+			if not force and self._is_recent(self._checked): return self._alive
+		return self.check()
+
+	def get_uptime(self):
+		'''Returns the server uptime, only sending a request if the last one is
+		more than `window` seconds old
+
+		:return: Amount of time the server has been online (or `None` if the server is offline)
+		:rtype: str
+		'''
+
+		with self._lock:
+			if self._alive and self._is_recent(self._uptime_checked): return self._uptime
+		return self._uptime if self.check() else None
+
+	def start(self, interval=None):
+		'''Starts the heartbeat thread, which checks the connection whenever
+		there has been no response for `interval` seconds
+
+		:param interval: Number of seconds between checks, defaults to `heartbeat`
+			(or `window` if there is no heartbeat)
+		:type interval: float, optional
+		'''
+
+		self.stop()
+		self.heartbeat = interval or self.heartbeat or self.window
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name='xnat-heartbeat', daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		while not self._stop.wait(self.heartbeat):
+			with self._lock:
+				recent = self._checked is not None and time.monotonic() - self._checked < self.heartbeat
+			if not recent: self.check()
+
+	def stop(self):
+		'''Stops the heartbeat thread (if it is running)
+		'''
+
+		if self._thread is None: return
+		self._stop.set()
+		self._thread.join()
+		self._thread = None
+
+	def close(self):
+		'''Stops the heartbeat thread and stops tracking responses
+		'''
+
+		self.stop()
+		try:
+			self.xnat._http.hooks['response'].remove(self.record)
+		except ValueError:
+			logging.debug('Health monitor was not tracking responses.')
+
+if __name__ == '__main__':
+	pass
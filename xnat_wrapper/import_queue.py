@@ -0,0 +1,268 @@
+import time
+import weakref
+import asyncio
+import threading
+from .utils import (
+	format_err,
+	convert_seconds
+)
+from .throttle import AdaptivePoller
+
+
+class QueueSnapshot(object):
+	'''Snapshot of the XNAT import queue. The whole queue is downloaded at most 
+	once per `interval` seconds and indexed by project, so every importer (and 
+	monitor) checking the queue of the same server within the same interval 
+	shares a single request. Callers that poll more often can ask for a newer 
+	snapshot using the `max_age` of `get()`.
+
+	:param class xnat: An open XNAT connection via pyxnat.Interface()
+	:param interval: Number of seconds a snapshot is used for, defaults to 2
+	:type interval: float, optional
+	'''
+
+	_shared = weakref.WeakValueDictionary()
+	_shared_lock = threading.Lock()
+
+	def __init__(self, xnat, interval=2):
+		'''Constructor method
+		'''
+
+		self.xnat = xnat
+		self.interval = interval
+		self._lock = threading.Lock()
+		self._time = None
+		self._index = {}
+
+	@classmethod
+	def shared(cls, xnat, interval=2):
+		'''Returns the snapshot shared by every connection to the same server (and user). 
+		Snapshots are only kept while an importer (or other caller) holds a reference to them.
+
+		:param class xnat: An open XNAT connection via pyxnat.Interface()
+		:param interval: Number of seconds a snapshot is used for (only used 
+			when the shared snapshot is created), defaults to 2
+		:type interval: float, optional
+		:return: The shared queue snapshot
+		:rtype: QueueSnapshot
+		'''
+
+		server = getattr(xnat,'_server',None)
+		key = (server,getattr(xnat,'_user',None)) if server else id(xnat)
+		with cls._shared_lock:
+			snapshot = cls._shared.get(key)
+			if snapshot is None: snapshot = cls._shared[key] = cls(xnat,interval)
+			snapshot.xnat = xnat
+		return snapshot
+
+	def refresh(self):
+		'''Downloads the import queue and indexes it by project. If the download 
+		fails, the previous snapshot is kept and the next call tries again.
+		'''
+
+		try:
+			res = self.xnat.get('/xapi/dqr/query/queue/all?format=json').json()
+			index = {}
+			for item in res: index.setdefault(item['xnatProject'],[]).append(item)
+			self._index = index
+			self._time = time.monotonic()
+		except Exception as ex:
+			format_err(ex)
+
+	def invalidate(self):
+		'''Discards the current snapshot so that the next call to `get()` downloads 
+		the queue (e.g. after submitting an import request)
+		'''
+
+		with self._lock:
+			self._time = None
+
+	def get(self, project=None, max_age=None):
+		'''Returns the queue items for a project, downloading the queue if the 
+		current snapshot is older than the interval (or `max_age`, if it is smaller).
+
+		:param project: The name of the XNAT project, defaults to None (every project)
+		:param max_age: Maximum age of the snapshot in seconds, defaults to the interval
+		:type project: str, optional
+		:type max_age: float, optional
+		:return: List of import queue items
+		:rtype: list
+		'''
+
+		max_age = self.interval if max_age is None else min(max_age,self.interval)
+		with self._lock:
+			if self._time is None or time.monotonic() - self._time >= max_age: self.refresh()
+			if project is None: return [i for items in self._index.values() for i in items]
+			return list(self._index.get(project,[]))
+
+
+class ImportQueueMonitor(object):
+	'''Monitors the XNAT import queue for a project and turns changes in the
+	queue into events. Queue items are compared by study UID between polls,
+	and the time between polls grows while the queue is not changing.
+
+	Each event is a dictionary containing the `event` type, the study `uid`,
+	its `status` and `previous` status, the queue `item`, and the `time` of
+	the event. The event types are:
+
+	- `queued`: A study was added to the queue
+	- `progressing`: The status of a queued study changed
+	- `stalled`: The status of a queued study has not changed for `stall_after` seconds
+	- `completed`: A study left the queue
+	- `drained`: Every study has left the queue (the monitor stops)
+	- `timeout`: The monitor stopped before the queue drained
+
+	The monitor can be used as a generator (`events()`) or as an async iterator
+	(`async for event in monitor`).
+
+	:param importer: The UID importer used to check the import queue
+	:param project: The name of the project to monitor, defaults to the importer project
+	:param timeout: The number of seconds to monitor the queue, defaults to 180
+	:param time_refresh: Restart the timeout each time the queue changes, defaults to True
+	:param wait_time: The number of seconds to wait for studies to arrive in an empty queue, defaults to 60
+	:param stall_after: The number of seconds without a status change before a study is stalled, defaults to 300
+	:param interval: Minimum number of seconds between polls, defaults to 1
+	:param max_interval: Maximum number of seconds between polls, defaults to 30
+	:type importer: UIDImporter
+	:type project: str, optional
+	:type timeout: float, optional
+	:type time_refresh: bool, optional
+	:type wait_time: float, optional
+	:type stall_after: float, optional
+	:type interval: float, optional
+	:type max_interval: float, optional
+	'''
+
+	def __init__(self, importer, project=None, timeout=180, time_refresh=True, wait_time=60,
+				stall_after=300, interval=1, max_interval=30):
+		'''Constructor method
+		'''
+
+		self.importer = importer
+		self.project = project
+		self.timeout = timeout
+		self.time_refresh = time_refresh
+		self.wait_time = wait_time
+		self.stall_after = stall_after
+		self.poller = AdaptivePoller(interval,max_interval)
+
+		self.items = {}
+		self.done = False
+		self._changed = {}
+		self._stalled = set()
+		self._has_populated = False
+		self._s_time = None
+
+	def _event(self, event, uid=None, item=None, previous=None):
+		return {
+			'event': event,
+			'uid': uid,
+			'status': item['status'] if item else None,
+			'previous': previous,
+			'item': item,
+			'time': time.time()
+		}
+
+	def poll(self):
+		'''Checks the import queue once and compares it with the previous check
+
+		:return: List of events
+		:rtype: list
+		'''
+
+		now = time.time()
+		if self._s_time is None: self._s_time = now
+
+		q_data = self.importer.check_import_queue(self.project, self.poller.min_interval)
+		current = {item['studyUID']:item for item in q_data['sessions']}
+
+		events = []
+		for uid,item in current.items():
+			old = self.items.get(uid)
+			if old is None:
+				events.append(self._event('queued',uid,item))
+			elif old['status'] != item['status']:
+				events.append(self._event('progressing',uid,item,old['status']))
+			else:
+				continue
+			self._changed[uid] = now
+			self._stalled.discard(uid)
+
+		for uid,old in self.items.items():
+			if uid in current: continue
+			events.append(self._event('completed',uid,old,old['status']))
+			self._changed.pop(uid,None)
+			self._stalled.discard(uid)
+
+		changed = len(events) > 0
+		for uid,item in current.items():
+			if uid not in self._stalled and now - self._changed[uid] > self.stall_after:
+				self._stalled.add(uid)
+				events.append(self._event('stalled',uid,item,item['status']))
+
+		self.items = current
+		if changed and self.time_refresh: self._s_time = now
+		self.poller.update(changed)
+
+		t_elapsed = now - self._s_time
+		if current:
+			self._has_populated = True
+			if t_elapsed > self.timeout:
+				events.append(self._event('timeout'))
+				self.done = True
+		elif self._has_populated:
+			events.append(self._event('drained'))
+			self.done = True
+		elif t_elapsed > self.wait_time:
+			events.append(self._event('timeout'))
+			self.done = True
+
+		return events
+
+	def events(self):
+		'''Polls the import queue until it drains (or the monitor times out),
+		yielding each event as it is found.
+
+		:return: Iterator of events
+		:rtype: generator
+		'''
+
+		while not self.done:
+			for event in self.poll(): yield event
+			if not self.done: time.sleep(self.poller.interval)
+
+	def __iter__(self):
+		return self.events()
+
+	async def _async_events(self):
+		loop = asyncio.get_running_loop()
+		while not self.done:
+			for event in await loop.run_in_executor(None,self.poll): yield event
+			if not self.done: await asyncio.sleep(self.poller.interval)
+
+	def __aiter__(self):
+		return self._async_events()
+
+	@staticmethod
+	def format_event(event):
+		'''Formats an event as a log message
+
+		:param dict event: An event returned by the monitor
+		:return: Log message
+		:rtype: str
+		'''
+
+		if event['event'] == 'drained':
+			return 'There are no more items in the queue.'
+		if event['event'] == 'timeout':
+			return 'Time limit exceeded. Try manually monitoring the queue in the browser.'
+
+		tmp = event['uid'].split('.')
+		short_uid = '{}...{}'.format('.'.join(tmp[:3]),'.'.join(tmp[-2:]))
+		item = event['item']
+		msg = '{} ({} scans, {} queue time) {}'.format(short_uid,item['num_scans'],convert_seconds(item['sec_queued']),event['event'])
+		if event['event'] in ['progressing','stalled']: msg += ': {}'.format(item['status'])
+		return msg
+
+if __name__ == '__main__':
+	pass
@@ -0,0 +1,134 @@
+import os
+import json
+from .utils import (
+	format_err,
+	write_json
+)
+
+
+class FileManifest(object):
+	'''Local record of the XNAT files that have already been downloaded,
+	stored as a JSON file containing the URI, size, and digest of each file
+	along with its downloaded contents. Comparing the record against a new
+	file listing shows which files are new or have changed.
+
+	:param str fname: Name of the manifest file (`.json` extension not required)
+	'''
+
+	def __init__(self, fname):
+		'''Constructor method
+		'''
+
+		if not fname.endswith('.json'): fname += '.json'
+
+		self.fname = fname
+		self.files = {}
+		self.load()
+
+	@staticmethod
+	def get_default_name(project, resource=''):
+		'''Returns the default manifest file name of a project (and resource): 
+		`json_manifest_<project>` or `json_manifest_<project>_<resource>`, with any 
+		path separators (e.g. from a nested resource name) replaced by `_`
+
+		:param str project: The name of the XNAT project
+		:param resource: The name of the XNAT project resource
+		:type resource: str, optional
+		:return: Name of the manifest file (without extension)
+		:rtype: str
+		'''
+
+		name = '_'.join(['json_manifest',project] + ([resource] if resource else []))
+		for sep in ['/',os.sep,os.altsep]:
+			if sep: name = name.replace(sep,'_')
+		return name
+
+	def load(self):
+		'''Loads the manifest file (if it exists)
+		'''
+
+		self.files = {}
+		if not os.path.isfile(self.fname): return
+
+		try:
+			with open(self.fname,'r') as f:
+				self.files = json.load(f).get('files',{})
+		except Exception as ex:
+			format_err(ex)
+
+	def save(self):
+		'''Writes the manifest to file
+		'''
+
+		write_json({'files':self.files}, self.fname, indent=None)
+
+	@staticmethod
+	def get_signature(entry):
+		'''Returns the values from an XNAT file entry that change when the file changes
+
+		:param dict entry: XNAT file entry (from a file listing)
+		:return: Dictionary containing the `size` and `digest` of the file
+		:rtype: dict
+		'''
+
+		return {
+			'size': str(entry.get('Size','')),
+			'digest': entry.get('digest','')
+		}
+
+	def is_current(self, entry):
+		'''Checks if a file has already been downloaded and has not changed since
+
+		:param dict entry: XNAT file entry (from a file listing)
+		:return: `True` if the stored copy is current, otherwise `False`
+		:rtype: bool
+		'''
+
+		stored = self.files.get(entry['URI'])
+		if stored is None: return False
+		return all(stored.get(k) == v for k,v in self.get_signature(entry).items())
+
+	def get_changed(self, entries):
+		'''Finds the files that are new or have changed
+
+		:param list entries: XNAT file entries (from a file listing)
+		:return: List of the entries that need to be downloaded
+		:rtype: list
+		'''
+
+		return [e for e in entries if not self.is_current(e)]
+
+	def update(self, entry, data):
+		'''Stores the contents of a downloaded file
+
+		:param dict entry: XNAT file entry (from a file listing)
+		:param data: The downloaded contents of the file
+		'''
+
+		self.files[entry['URI']] = dict(self.get_signature(entry),data=data)
+
+	def prune(self, entries):
+		'''Removes files that are no longer in the file listing
+
+		:param list entries: XNAT file entries (from a file listing)
+		:return: Number of files removed
+		:rtype: int
+		'''
+
+		uris = set(e['URI'] for e in entries)
+		removed = [k for k in self.files if k not in uris]
+		for k in removed: del self.files[k]
+		return len(removed)
+
+	def get_data(self, entries):
+		'''Returns the stored contents of a list of files
+
+		:param list entries: XNAT file entries (from a file listing)
+		:return: List of the stored contents (in the same order as `entries`)
+		:rtype: list
+		'''
+
+		return [self.files[e['URI']]['data'] for e in entries if e['URI'] in self.files]
+
+if __name__ == '__main__':
+	pass
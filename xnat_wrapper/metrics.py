@@ -0,0 +1,421 @@
+import time
+import bisect
+import functools
+import threading
+from contextlib import ContextDecorator
+from urllib.parse import urlsplit
+from .utils import (
+	format_err,
+	write_json
+)
+
+
+'''
+Upper bounds (in seconds) of the latency and phase duration histogram buckets
+'''
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+'''
+XNAT collections whose members are replaced by a placeholder in endpoint templates
+(e.g. `/data/projects/MYPROJ/experiments` becomes `/data/projects/{project}/experiments`)
+'''
+COLLECTIONS = {
+	'projects': '{project}',
+	'subjects': '{subject}',
+	'experiments': '{experiment}',
+	'scans': '{scan}',
+	'resources': '{resource}',
+	'files': '{file}',
+	'wrappers': '{wrapper}',
+	'commands': '{command}',
+	'containers': '{container}'
+}
+
+'''
+Path segments that are never replaced by a placeholder (e.g. `/xapi/commands/available`)
+'''
+RESERVED = ['available']
+
+'''
+Name of the phase used for requests made outside of any phase
+'''
+NO_PHASE = 'none'
+
+
+@functools.lru_cache(maxsize=4096)
+def get_endpoint(path):
+	'''Converts a request path to an endpoint template by replacing the
+	members of XNAT collections (see `COLLECTIONS`) with placeholders
+
+	:param str path: The request path (e.g. `/data/experiments/XNAT_E00001/scans`)
+	:return: Endpoint template (e.g. `/data/experiments/{experiment}/scans`)
+	:rtype: str
+	'''
+
+	segments = path.split('/')
+	for i in range(1,len(segments)):
+		if segments[i-1] in COLLECTIONS and segments[i] and segments[i] not in RESERVED:
+			segments[i] = COLLECTIONS[segments[i-1]]
+	return '/'.join(segments)
+
+
+class Histogram(object):
+	'''Cumulative histogram with fixed buckets
+
+	:param buckets: Upper bounds of the buckets, defaults to `DEFAULT_BUCKETS`
+	:type buckets: list, optional
+	'''
+
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		'''Constructor method
+		'''
+
+		self.buckets = buckets
+		self.counts = [0]*(len(buckets)+1)
+		self.count = 0
+		self.sum = 0
+		self.min = None
+		self.max = None
+
+	def observe(self, value):
+		'''Adds a value to the histogram
+		'''
+
+		self.counts[bisect.bisect_left(self.buckets,value)] += 1
+		self.count += 1
+		self.sum += value
+		if self.min is None or value < self.min: self.min = value
+		if self.max is None or value > self.max: self.max = value
+
+	def get_cumulative(self):
+		'''Returns the number of values less than or equal to each bucket bound
+
+		:return: List of `(bound, count)` pairs, ending with `('+Inf', count)`
+		:rtype: list
+		'''
+
+		total = 0
+		output = []
+		for bound,n in zip(self.buckets + ['+Inf'],self.counts):
+			total += n
+			output.append((bound,total))
+		return output
+
+	def to_dict(self):
+		return {
+			'count': self.count,
+			'sum': self.sum,
+			'min': self.min,
+			'max': self.max,
+			'mean': self.sum/self.count if self.count else None,
+			'buckets': dict((str(b),n) for b,n in self.get_cumulative())
+		}
+
+
+class Phase(ContextDecorator):
+	'''Context manager (or decorator) that labels the requests made within it
+	with a phase name and records how long the phase took. Entering a phase
+	that is already the current phase of the thread has no effect, so nested
+	calls are only counted once.
+
+	:param registry: The metrics registry (`None` to do nothing)
+	:param str name: Name of the phase (e.g. `discovery`)
+	:type registry: MetricsRegistry
+	'''
+
+	def __init__(self, registry, name):
+		'''Constructor method
+		'''
+
+		self.registry = registry
+		self.name = name
+		self._local = threading.local()
+
+	def __enter__(self):
+		if not hasattr(self._local,'entered'): self._local.entered = []
+		self._local.entered.append(self.registry is not None and self.registry.push_phase(self.name))
+		return self
+
+	def __exit__(self, *args):
+		if self._local.entered.pop(): self.registry.pop_phase(self.name)
+		return False
+
+
+def timed(name):
+	'''Decorator for methods of classes with a `metrics` attribute (e.g.
+	`CommandUtility`) that runs the method within a phase (see `Phase`)
+
+	:param str name: Name of the phase
+	'''
+
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(self, *args, **kwargs):
+			if self.metrics is None: return func(self,*args,**kwargs)
+			with self.metrics.phase(name):
+				return func(self,*args,**kwargs)
+		return wrapper
+	return decorator
+
+
+class MetricsRegistry(object):
+	'''In-process registry of the HTTP requests made through a `Connector`. Each
+	request is recorded with its phase, method, endpoint template, status, latency,
+	and response size, and aggregated into counters and latency histograms. Phase
+	durations are recorded as histograms as well.
+
+	Requests are labelled with the innermost phase of the thread that made them
+	(`NO_PHASE` for threads that are not within a phase), so work sent to worker
+	threads should run within its own phase (e.g. using `timed()`). Runs of the same
+	phase that overlap (e.g. a phase entered by worker threads while it is running
+	in the main thread) are recorded as a single duration.
+
+	:param callback: Function called with each request (a dictionary containing the
+		`phase`, `method`, `endpoint`, `status`, `seconds`, `bytes`, and `cached`, where
+		`bytes` is 0 for responses without a `Content-Length` since the request is
+		recorded before the body is read)
+	:param buckets: Upper bounds of the histogram buckets, defaults to `DEFAULT_BUCKETS`
+	:type callback: function, optional
+	:type buckets: list, optional
+	'''
+
+	def __init__(self, callback=None, buckets=DEFAULT_BUCKETS):
+		'''Constructor method
+		'''
+
+		self.callback = callback
+		self.buckets = buckets
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		self._running = {}
+		self.reset()
+
+	def reset(self):
+		'''Removes every recorded request and phase
+		'''
+
+		with self._lock:
+			self.requests = {}
+			self.latency = {}
+			self.phases = {}
+
+	'''
+	Phases
+	'''
+
+	def phase(self, name):
+		'''Creates a phase that can be used as a context manager or decorator
+
+		:param str name: Name of the phase (e.g. `discovery`)
+		:return: The phase
+		:rtype: Phase
+		'''
+
+		return Phase(self,name)
+
+	def _stack(self):
+		if not hasattr(self._local,'stack'): self._local.stack = []
+		return self._local.stack
+
+	def push_phase(self, name):
+		'''Starts a phase in the current thread. If the phase is already running 
+		in another thread (e.g. a worker thread started within the phase), the 
+		two are counted as a single run of the phase.
+
+		:param str name: Name of the phase
+		:return: `True` if the phase was started, `False` if it is already the current phase
+		:rtype: bool
+		'''
+
+		stack = self._stack()
+		if stack and stack[-1] == name: return False
+
+		stack.append(name)
+		with self._lock:
+			if name in self._running:
+				self._running[name][0] += 1
+			else:
+				self._running[name] = [1,time.perf_counter()]
+		return True
+
+	def pop_phase(self, name):
+		'''Ends the current phase of the current thread. The duration of the phase 
+		is recorded once it has ended in every thread.
+
+		:param str name: Name of the phase
+		'''
+
+		name = self._stack().pop()
+		with self._lock:
+			running = self._running[name]
+			running[0] -= 1
+			if running[0] > 0: return
+
+			del self._running[name]
+			if name not in self.phases: self.phases[name] = Histogram(self.buckets)
+			self.phases[name].observe(time.perf_counter() - running[1])
+
+	def get_phase(self):
+		'''Returns the phase that requests made by the current thread are labelled with
+
+		:return: Name of the phase
+		:rtype: str
+		'''
+
+		stack = self._stack()
+		return stack[-1] if stack else NO_PHASE
+
+	'''
+	Requests
+	'''
+
+	def record(self, method, url, status, seconds, size=0, cached=False, phase=None):
+		'''Records a single request (called by the HTTP adapter of a `Connector`)
+
+		:param str method: The request method
+		:param str url: The request URL
+		:param int status: The response status (0 if no response was received)
+		:param float seconds: Number of seconds until the response was received
+		:param size: Size of the response in bytes, defaults to 0
+		:param cached: The response was read from the response cache, defaults to False
+		:param phase: Name of the phase, defaults to the phase of the current thread (see `get_phase()`)
+		:type size: int, optional
+		:type cached: bool, optional
+		:type phase: str, optional
+		'''
+
+		if phase is None: phase = self.get_phase()
+		endpoint = get_endpoint(urlsplit(url).path)
+		with self._lock:
+			key = (phase,method,endpoint,status)
+			counts = self.requests.get(key)
+			if counts is None: counts = self.requests[key] = {'count':0,'bytes':0,'cached':0}
+			counts['count'] += 1
+			counts['bytes'] += size
+			counts['cached'] += cached
+
+			key = (phase,method,endpoint)
+			if key not in self.latency: self.latency[key] = Histogram(self.buckets)
+			self.latency[key].observe(seconds)
+
+		if self.callback is not None:
+			try:
+				self.callback({
+					'phase': phase,
+					'method': method,
+					'endpoint': endpoint,
+					'status': status,
+					'seconds': seconds,
+					'bytes': size,
+					'cached': cached
+				})
+			except Exception as ex:
+				format_err(ex)
+
+	def record_bytes(self, method, url, status, size, phase):
+		'''Adds the size of a response body to a request that was already recorded 
+		(for responses whose size is only known once the body has been read)
+
+		:param str method: The request method
+		:param str url: The request URL
+		:param int status: The response status
+		:param int size: Size of the response in bytes
+		:param str phase: Name of the phase the request was recorded with
+		'''
+
+		key = (phase,method,get_endpoint(urlsplit(url).path),status)
+		with self._lock:
+			if key in self.requests: self.requests[key]['bytes'] += size
+
+	'''
+	Exports
+	'''
+
+	def summary(self):
+		'''Totals the requests and time spent in each phase
+
+		:return: Dictionary with phases as keys and dictionaries containing the number
+			of `requests`, `errors`, `bytes`, `request_seconds`, and `seconds` (phase duration) as values
+		:rtype: dict
+		'''
+
+		output = {}
+		def get(phase):
+			if phase not in output: output[phase] = {'requests':0,'errors':0,'bytes':0,'request_seconds':0,'seconds':0}
+			return output[phase]
+
+		with self._lock:
+			for (phase,method,endpoint,status),counts in self.requests.items():
+				get(phase)['requests'] += counts['count']
+				get(phase)['bytes'] += counts['bytes']
+				if status == 0 or status >= 400: get(phase)['errors'] += counts['count']
+			for (phase,method,endpoint),hist in self.latency.items():
+				get(phase)['request_seconds'] += hist.sum
+			for phase,hist in self.phases.items():
+				get(phase)['seconds'] += hist.sum
+		return output
+
+	def to_dict(self):
+		'''Returns every counter and histogram as a JSON-serializable dictionary
+
+		:return: Dictionary containing the `requests`, `latency`, and `phases`
+		:rtype: dict
+		'''
+
+		with self._lock:
+			return {
+				'requests': [dict(phase=p,method=m,endpoint=e,status=s,**c) for (p,m,e,s),c in self.requests.items()],
+				'latency': [dict(phase=p,method=m,endpoint=e,**h.to_dict()) for (p,m,e),h in self.latency.items()],
+				'phases': [dict(phase=p,**h.to_dict()) for p,h in self.phases.items()]
+			}
+
+	def save(self, fname, indent=2):
+		'''Writes the metrics to a JSON file (see `to_dict()`)
+
+		:param str fname: Name of the JSON file (`.json` extension not required)
+		:param indent: Amount of file spacing/indentation for pretty-printing, defaults to 2
+		:type indent: int, optional
+		'''
+
+		write_json(self.to_dict(), fname, indent)
+
+	@staticmethod
+	def _labels(**labels):
+		escape = lambda v: str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+		return '{' + ','.join('{}="{}"'.format(k,escape(v)) for k,v in labels.items()) + '}'
+
+	def to_prometheus(self, prefix='xnat_wrapper'):
+		'''Returns the metrics in the Prometheus text exposition format
+
+		:param prefix: Prefix of every metric name, defaults to `xnat_wrapper`
+		:type prefix: str, optional
+		:return: The metrics
+		:rtype: str
+		'''
+
+		lines = []
+		def histogram(name, desc, items):
+			lines.extend(['# HELP {}_{} {}'.format(prefix,name,desc),'# TYPE {}_{} histogram'.format(prefix,name)])
+			for labels,h in items:
+				for bound,n in h.get_cumulative():
+					lines.append('{}_{}_bucket{} {}'.format(prefix,name,self._labels(le=bound,**labels),n))
+				lines.append('{}_{}_sum{} {}'.format(prefix,name,self._labels(**labels),h.sum))
+				lines.append('{}_{}_count{} {}'.format(prefix,name,self._labels(**labels),h.count))
+
+		with self._lock:
+			for name,field,desc in [('requests_total','count','Number of HTTP requests'),
+									('response_bytes_total','bytes','Number of bytes received'),
+									('cached_requests_total','cached','Number of HTTP requests answered by the response cache')]:
+				lines.extend(['# HELP {}_{} {}'.format(prefix,name,desc),'# TYPE {}_{} counter'.format(prefix,name)])
+				for (p,m,e,s),c in self.requests.items():
+					lines.append('{}_{}{} {}'.format(prefix,name,self._labels(phase=p,method=m,endpoint=e,status=s),c[field]))
+
+			histogram('request_seconds','HTTP request latency in seconds',
+				[(dict(phase=p,method=m,endpoint=e),h) for (p,m,e),h in self.latency.items()])
+			histogram('phase_seconds','Phase duration in seconds',
+				[(dict(phase=p),h) for p,h in self.phases.items()])
+
+		return '\n'.join(lines) + '\n'
+
+if __name__ == '__main__':
+	pass
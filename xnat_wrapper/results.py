@@ -0,0 +1,362 @@
+import math
+import bisect
+import warnings
+from array import array
+from .utils import flatten_json
+from .table import (
+	np,
+	NAN,
+	FLOAT,
+	STRING,
+	ColumnTable,
+	load_csv
+)
+
+
+'''
+Keys (taken from the `bids_meta` of MRIQC JSON files) that identify each scan
+'''
+KEYS = ['subject_id', 'session_id', 'modality']
+
+'''
+Length of the box-and-whisker plot whiskers (as a multiple of the interquartile range)
+'''
+WHISKER = 1.5
+
+
+def quantile(values, q):
+	'''Returns a quantile of sorted values using linear interpolation (the same
+	as the default method of `numpy.percentile()`)
+
+	:param list values: Sorted values (without NaN)
+	:param float q: Quantile between 0 and 1
+	:return: The quantile (NaN if there are no values)
+	:rtype: float
+	'''
+
+	if not values: return NAN
+	pos = q*(len(values)-1)
+	i = int(pos)
+	if i+1 >= len(values): return values[-1]
+	return values[i] + (values[i+1]-values[i])*(pos-i)
+
+def box_stats(values, rows, whisker=WHISKER):
+	'''Computes the box-and-whisker statistics of a single metric (see `ResultsStore.stats()`)
+
+	:param values: Values of the metric (NaN values are ignored)
+	:param rows: Table rows of the values
+	:param whisker: Length of the whiskers (as a multiple of the IQR), defaults to `WHISKER`
+	:type values: list
+	:type rows: list
+	:type whisker: float, optional
+	:return: Dictionary of statistics
+	:rtype: dict
+	'''
+
+	pairs = sorted((v,r) for v,r in zip(values,rows) if not math.isnan(v))
+	values = [v for v,r in pairs]
+	q1,med,q3 = [quantile(values,q) for q in [0.25,0.5,0.75]]
+	lo = bisect.bisect_left(values,q1 - whisker*(q3-q1)) if values else 0
+	hi = bisect.bisect_right(values,q3 + whisker*(q3-q1)) if values else 0
+	return {
+		'n': len(values),
+		'mean': sum(values)/len(values) if values else NAN,
+		'med': med,
+		'q1': q1,
+		'q3': q3,
+		'iqr': q3 - q1,
+		'whislo': values[lo] if lo < hi else NAN,
+		'whishi': values[hi-1] if lo < hi else NAN,
+		'fliers': values[:lo] + values[hi:],
+		'outliers': [r for v,r in pairs[:lo] + pairs[hi:]]
+	}
+
+
+class ResultsStore(object):
+	'''In-memory store of MRIQC results (one row per scan) with the image quality
+	metrics (IQMs) stored as float columns (see `ColumnTable`) and the rows indexed
+	by subject, session, and modality. Box-and-whisker statistics of every IQM are
+	computed for each group of rows at once, using NumPy if it is installed.
+
+	:param keys: Names of the columns that identify each scan, defaults to `KEYS`
+	:type keys: list, optional
+	'''
+
+	def __init__(self, keys=KEYS):
+		'''Constructor method
+		'''
+
+		self.keys = list(keys)
+		self.table = ColumnTable(dict((k,[]) for k in self.keys))
+		self.index = {}
+		self._matrix = None
+
+	def __len__(self):
+		return len(self.table)
+
+	@classmethod
+	def from_json(cls, files, keys=KEYS):
+		'''Creates a store from MRIQC JSON/dict structures (e.g. the output of
+		`CommandUtility.download_json_files()` or `CommandUtility.iter_json_files()`)
+
+		:param files: A list (or any other iterable) of JSON/dict structures
+		:param keys: Names of the values (in `bids_meta`) that identify each scan, defaults to `KEYS`
+		:type files: list
+		:type keys: list, optional
+		:return: The store
+		:rtype: ResultsStore
+		'''
+
+		store = cls(keys)
+		store.extend(files)
+		return store
+
+	@classmethod
+	def from_csv(cls, fname, keys=KEYS, filt=[]):
+		'''Creates a store from a CSV file of MRIQC results (e.g. written by
+		`json_to_csv()` using `keys`). String columns other than `keys` are ignored.
+
+		:param str fname: Name of CSV file (with or without extension)
+		:param keys: Names of the columns that identify each scan, defaults to `KEYS`
+		:param filt: List of column headers (whole or partial) to keep, defaults to all columns
+		:type keys: list, optional
+		:type filt: list, optional
+		:return: The store
+		:rtype: ResultsStore
+		'''
+
+		store = cls(keys)
+		table = load_csv(fname, filt + keys if filt else [], dtypes=dict((k,STRING) for k in keys), use_numpy=False)
+		n = len(table)
+		for k in store.keys:
+			store.table.columns[k] = table[k] if k in table else ['']*n
+		for k in table.numeric:
+			if k not in store.keys: store.table.columns[k] = table[k]
+			store.table.dtypes[k] = FLOAT
+		for row,key in enumerate(zip(*[store.table[k] for k in store.keys])):
+			store.index.setdefault(key,[]).append(row)
+		return store
+
+	'''
+	Rows
+	'''
+
+	@property
+	def iqms(self):
+		'''Names of the IQM columns (in order)
+		'''
+
+		return [k for k in self.table.numeric if k not in self.keys]
+
+	def add(self, data):
+		'''Adds a scan from an MRIQC JSON/dict structure. Values that are not
+		numbers are ignored, and IQMs missing from the scan (or from the scans
+		before it) are stored as NaN.
+
+		:param dict data: A JSON/dict structure
+		:return: Row of the scan
+		:rtype: int
+		'''
+
+		row = len(self)
+		columns = self.table.columns
+		values = flatten_json(data, self.keys)
+		for k in self.keys:
+			columns[k].append(str(values.get(k,'')))
+		for k,v in values.items():
+			if k in self.keys or isinstance(v,bool) or not isinstance(v,(int,float)): continue
+			if k not in columns:
+				columns[k] = array('d',[NAN])*row
+				self.table.dtypes[k] = FLOAT
+			columns[k].append(v)
+		for k in self.iqms:
+			if len(columns[k]) == row: columns[k].append(NAN)
+
+		self.index.setdefault(self.get_key(row),[]).append(row)
+		self._matrix = None
+		return row
+
+	def extend(self, files):
+		'''Adds scans from MRIQC JSON/dict structures (see `add()`)
+
+		:param files: A list (or any other iterable) of JSON/dict structures
+		:type files: list
+		'''
+
+		for data in files: self.add(data)
+
+	def get_key(self, row):
+		'''Returns the values that identify the scan of a row
+
+		:param int row: Row of the scan
+		:return: Tuple of `keys` values (e.g. `(subject_id, session_id, modality)`)
+		:rtype: tuple
+		'''
+
+		return tuple(self.table[k][row] for k in self.keys)
+
+	def get_row(self, row):
+		'''Returns the keys and IQMs of a row
+
+		:param int row: Row of the scan
+		:return: Dictionary with column names as keys
+		:rtype: dict
+		'''
+
+		return dict((k,v[row]) for k,v in self.table.columns.items())
+
+	def select(self, **values):
+		'''Finds the rows of the scans matching the given keys (e.g.
+		`select(subject_id='01', modality='bold')`)
+
+		:return: Sorted list of rows
+		:rtype: list
+		'''
+
+		if sorted(values) == sorted(self.keys):
+			return list(self.index.get(tuple(str(values[k]) for k in self.keys),[]))
+		return self.groupby(None,**values).get('all',[])
+
+	def _check_keys(self, names):
+		for k in names:
+			if k not in self.keys: raise KeyError('"{}" is not one of the keys: {}'.format(k,self.keys))
+
+	def groupby(self, by='modality', **values):
+		'''Groups the rows of the scans matching the given keys (see `select()`)
+
+		:param by: Name (or list of names) of the keys to group by, defaults to
+			`modality` (`None` for a single group named `all`)
+		:type by: str, optional
+		:return: Dictionary with key values (tuples if `by` is a list) as keys and
+			sorted lists of rows as values
+		:rtype: dict
+		'''
+
+		fields = [by] if isinstance(by,str) else list(by or [])
+		self._check_keys(fields + list(values))
+		idx = [self.keys.index(k) for k in fields]
+		match = [(self.keys.index(k),str(v)) for k,v in values.items()]
+		groups = {}
+		for key,r in self.index.items():
+			if not all(key[i] == v for i,v in match): continue
+			if by is None: group = 'all'
+			elif isinstance(by,str): group = key[idx[0]]
+			else: group = tuple(key[i] for i in idx)
+			groups.setdefault(group,[]).extend(r)
+		return dict((k,sorted(v)) for k,v in groups.items())
+
+	'''
+	Statistics
+	'''
+
+	def _get_matrix(self, iqms):
+		'''Returns the IQM columns as a 2D NumPy array (one row per IQM)
+		'''
+
+		if self._matrix is None or self._matrix[0] != iqms:
+			self._matrix = (iqms, np.vstack([np.frombuffer(self.table[k],dtype=np.float64) for k in iqms]))
+		return self._matrix[1]
+
+	def _box_stats(self, matrix, rows, whisker):
+		'''Computes the box-and-whisker statistics of every row of a 2D NumPy array
+		'''
+
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', category=RuntimeWarning)
+			values = np.sort(matrix,axis=1)
+			n = np.sum(~np.isnan(matrix),axis=1)
+			last = np.maximum(n-1,0)
+			def quantile(q):
+				pos = q*last
+				i = np.floor(pos).astype(int)
+				a = np.take_along_axis(values,i[:,None],axis=1)[:,0]
+				b = np.take_along_axis(values,np.minimum(i+1,last)[:,None],axis=1)[:,0]
+				return a + (b-a)*(pos-i)
+
+			q1,med,q3 = quantile(0.25),quantile(0.5),quantile(0.75)
+			iqr = q3 - q1
+			lo = (q1 - whisker*iqr)[:,None]
+			hi = (q3 + whisker*iqr)[:,None]
+			inside = (matrix >= lo) & (matrix <= hi)
+			whislo = np.min(np.where(inside,matrix,np.inf),axis=1)
+			whishi = np.max(np.where(inside,matrix,-np.inf),axis=1)
+			whislo[~np.isfinite(whislo)] = np.nan
+			whishi[~np.isfinite(whishi)] = np.nan
+			mean = np.nanmean(matrix,axis=1)
+
+		fliers = [[] for _ in range(len(matrix))]
+		outliers = [[] for _ in range(len(matrix))]
+		i,j = np.nonzero((matrix < lo) | (matrix > hi))
+		if len(i):
+			order = np.lexsort((matrix[i,j],i))
+			i,j = i[order],j[order]
+			for k,v,r in zip(i.tolist(),matrix[i,j].tolist(),rows[j].tolist()):
+				fliers[k].append(v)
+				outliers[k].append(r)
+
+		keys = ['n','mean','med','q1','q3','iqr','whislo','whishi','fliers','outliers']
+		columns = [x.tolist() for x in [n,mean,med,q1,q3,iqr,whislo,whishi]] + [fliers,outliers]
+		return [dict(zip(keys,stats)) for stats in zip(*columns)]
+
+	def stats(self, by='modality', iqms=None, whisker=WHISKER, use_numpy=None, **values):
+		'''Computes box-and-whisker statistics of every IQM for each group of scans
+		(see `groupby()`). The statistics of each IQM are the number of values (`n`),
+		`mean`, median (`med`), quartiles (`q1` and `q3`), interquartile range (`iqr`),
+		whisker ends (`whislo` and `whishi`, the most extreme values within `whisker`
+		times the IQR of the quartiles), and outliers (`fliers` and their rows, `outliers`).
+		These are the same names used by `matplotlib.axes.Axes.bxp()`. NaN values
+		are ignored.
+
+		With NumPy, the statistics of every IQM are computed in a single pass over
+		the group (as a 2D array), otherwise each IQM is sorted separately.
+
+		:param by: Name (or list of names) of the keys to group by, defaults to
+			`modality` (`None` for a single group named `all`)
+		:param iqms: Names of the IQMs, defaults to all IQMs
+		:param whisker: Length of the whiskers (as a multiple of the IQR), defaults to `WHISKER`
+		:param use_numpy: Use NumPy, defaults to `None` (only if NumPy is installed)
+		:type by: str, optional
+		:type iqms: list, optional
+		:type whisker: float, optional
+		:type use_numpy: bool, optional
+		:return: Dictionary with groups as keys and dictionaries (with IQMs as keys and
+			statistics as values) as values
+		:rtype: dict
+		'''
+
+		iqms = list(iqms or self.iqms)
+		if use_numpy is None: use_numpy = np is not None
+		if use_numpy and np is None: raise ImportError('NumPy is required to compute statistics using NumPy.')
+
+		output = {}
+		matrix = self._get_matrix(iqms) if use_numpy and iqms else None
+		for group,rows in self.groupby(by,**values).items():
+			if matrix is not None:
+				rows = np.array(rows)
+				output[group] = dict(zip(iqms,self._box_stats(matrix[:,rows],rows,whisker)))
+			else:
+				output[group] = dict((k,box_stats([self.table[k][r] for r in rows],rows,whisker)) for k in iqms)
+		return output
+
+	def outliers(self, by='modality', iqms=None, whisker=WHISKER, **values):
+		'''Lists the outliers of every IQM (see `stats()`)
+
+		:param by: Name (or list of names) of the keys to group by, defaults to `modality`
+		:param iqms: Names of the IQMs, defaults to all IQMs
+		:param whisker: Length of the whiskers (as a multiple of the IQR), defaults to `WHISKER`
+		:type by: str, optional
+		:type iqms: list, optional
+		:type whisker: float, optional
+		:return: List of dictionaries containing the `keys`, `group`, `iqm`, and `value`
+		:rtype: list
+		'''
+
+		output = []
+		for group,stats in self.stats(by,iqms,whisker,**values).items():
+			for iqm,s in stats.items():
+				for row,value in zip(s['outliers'],s['fliers']):
+					output.append(dict(zip(self.keys,self.get_key(row)),group=group,iqm=iqm,value=value))
+		return output
+
+if __name__ == '__main__':
+	pass
@@ -0,0 +1,341 @@
+import time
+import logging
+from concurrent.futures import (
+	ThreadPoolExecutor,
+	FIRST_COMPLETED,
+	as_completed,
+	wait
+)
+from .utils import (
+	format_err,
+	convert_seconds
+)
+from .throttle import RateLimiter
+
+
+LEVELS = ['scan','session','project']
+
+
+class CommandScheduler(object):
+	'''Runs the commands of a `CommandUtility` with a bounded number of
+	container launches in flight for each level (project, session, or scan)
+	and an optional ceiling on the number of requests sent per second.
+
+	:param utility: The command utility whose commands, sessions, and scans are used
+	:param concurrency: Maximum number of launches in flight, either for every
+		level or as a dictionary with levels as keys, defaults to 4
+	:param rate: Maximum number of container probes and launches per second
+		(wrapper lookups are cached and not counted), defaults to None (no limit)
+	:param callback: Function called with each progress event
+	:param waiter: Object used by `run_pipeline()` to wait for launched containers to 
+		finish. It must have an `interval` (seconds between polls), a `track(key, result)` 
+		method that receives each launch result, and a `poll()` method that returns a 
+		list of `(key, success)` pairs for the launches that have finished.
+	:type utility: CommandUtility
+	:type concurrency: int or dict, optional
+	:type rate: float, optional
+	:type callback: function, optional
+	:type waiter: object, optional
+	'''
+
+	def __init__(self, utility, concurrency=4, rate=None, callback=None, waiter=None):
+		'''Constructor method
+		'''
+
+		self.utility = utility
+		self.concurrency = concurrency
+		self.limiter = RateLimiter(rate) if rate else None
+		self.callback = callback
+		self.waiter = waiter
+
+	def get_concurrency(self, level):
+		'''Returns the maximum number of launches in flight for a level
+
+		:param str level: The XNAT project level (i.e. project, session, or scan)
+		:return: Maximum number of launches in flight
+		:rtype: int
+		'''
+
+		n = self.concurrency
+		if isinstance(n, dict): n = n.get(level,1)
+		return max(1,int(n))
+
+	def _throttle(self):
+		if self.limiter is not None: self.limiter.acquire()
+
+	def _event(self, event, level, cmd, count, total, item=None):
+		output = {
+			'event': event,
+			'level': level,
+			'command': cmd,
+			'count': count,
+			'total': total,
+			'item': item
+		}
+		if self.callback is not None:
+			try:
+				self.callback(output)
+			except Exception as ex:
+				format_err(ex)
+		return output
+
+	def launch(self, exp, cmd, params={}):
+		'''Finds the wrapper and container information for an experiment and
+		launches the container (rate limited). Runs on the worker threads.
+
+		:param dict exp: An XNAT project, session, or scan
+		:param str cmd: The name of the command
+		:param params: The optional parameters (or `kwargs`) that should be passed to the command
+		:type params: dict, optional
+		:return: The command result (see `CommandUtility.find_and_run_command()`),
+			or `None` if the command cannot be run on the experiment
+		:rtype: dict or None
+		'''
+
+		self._throttle()
+		item = self.utility.prepare_command(exp,cmd,params)
+		if item is None: return None
+
+		self._throttle()
+		item['result'] = self.utility.run_container(item['wrapper']['launch'],item['container']['params'])
+		return item
+
+	def run_level(self, level, cmd):
+		'''Runs a single command on every experiment in a level. Results are
+		stored in the command utility results (in the same order as the
+		experiments) once the level is complete.
+
+		:param str level: The XNAT project level (i.e. project, session, or scan)
+		:param dict cmd: The command name and options
+		:return: Iterator of progress events
+		:rtype: generator
+		'''
+
+		util = self.utility
+		exp_list = util.get_level_experiments(level)
+		if exp_list is None:
+			logging.warning('Unexpected level found in commands: {}'.format(level))
+			return
+		if not exp_list:
+			logging.info('Unable to run command "{}": No {}(s) found.'.format(cmd['name'],level))
+			return
+
+		if 'bids' in cmd['name']:
+			if not util._has_bids:
+				util.check_bids_map()
+
+		n_workers = self.get_concurrency(level)
+		total = len(exp_list)
+		logging.info('Running "{}" on {} {}(s) ({} at a time)'.format(cmd['name'],total,level,n_workers))
+		yield self._event('started',level,cmd['name'],0,total)
+
+		count = 0
+		results = [None]*total
+		with ThreadPoolExecutor(max_workers=n_workers) as pool:
+			futures = {pool.submit(self.launch,e,cmd['name'],cmd['opts']):i for i,e in enumerate(exp_list)}
+			for f in as_completed(futures):
+				count += 1
+				i = futures[f]
+				try:
+					results[i] = f.result()
+				except Exception as ex:
+					format_err(ex)
+
+				if results[i] is None:
+					event = 'skipped'
+				elif results[i]['result']['error']:
+					event = 'failed'
+				else:
+					event = 'launched'
+				yield self._event(event,level,cmd['name'],count,total,results[i] or exp_list[i])
+
+		util._results[level] = [r for r in results if r is not None]
+		yield self._event('finished',level,cmd['name'],count,total)
+
+	def run(self, commands=None):
+		'''Runs every command, one level at a time (in the order of the commands).
+
+		:param commands: Dictionary of commands with the XNAT project level
+			(i.e. project, session, or scan) as the keys and the command
+			name and options as the values, defaults to the utility commands
+		:type commands: dict, optional
+		:return: Iterator of progress events (dictionaries containing the
+			`event`, `level`, `command`, `count`, `total`, and `item`)
+		:rtype: generator
+		'''
+
+		if commands is None: commands = self.utility.commands
+
+		s_time = time.time()
+		for level,cmd in commands.items():
+			for event in self.run_level(level,cmd): yield event
+		logging.info('All commands launched in {}.'.format(convert_seconds(time.time()-s_time)))
+
+	def build_pipeline(self, commands):
+		'''Builds the dependency graph for a set of commands. Each experiment of each 
+		level is a node: a session node depends on the scan nodes of its scans, and 
+		the project node depends on every node of the closest level below it.
+
+		:param dict commands: Dictionary of commands with the XNAT project level 
+			(i.e. project, session, or scan) as the keys and the command 
+			name and options as the values
+		:return: Dictionary of nodes (keyed by `(level, index)`) with the level, 
+			command, experiment, and dependencies of each node
+		:rtype: dict
+		'''
+
+		nodes = {}
+		by_level = {}
+		for level in LEVELS:
+			if level not in commands: continue
+			exp_list = self.utility.get_level_experiments(level) or []
+			by_level[level] = [(level,i) for i in range(len(exp_list))]
+			for i,e in enumerate(exp_list):
+				nodes[(level,i)] = {'level':level,'command':commands[level],'info':e,'deps':set()}
+
+		for level in commands:
+			if level not in LEVELS: logging.warning('Unexpected level found in commands: {}'.format(level))
+
+		if 'session' in by_level and 'scan' in by_level:
+			sessions = {nodes[n]['info'].get('ID'):n for n in by_level['session']}
+			for n in by_level['scan']:
+				uri = nodes[n]['info']['URI'].split('/scans/')[0]
+				parent = sessions.get(uri.split('/')[-1])
+				if parent is not None: nodes[parent]['deps'].add(n)
+
+		if 'project' in by_level:
+			lower = by_level.get('session') or by_level.get('scan') or []
+			for n in by_level['project']: nodes[n]['deps'].update(lower)
+
+		return nodes
+
+	def run_pipeline(self, commands=None, strict=False, wait_timeout=3600):
+		'''Runs every command as a dependency graph (see `build_pipeline()`) instead of 
+		one level at a time: each node is launched as soon as all of its dependencies 
+		are complete. A node is complete when its launch request returns, or, if the 
+		scheduler has a `waiter`, when the waiter reports that its containers finished. 
+		Nodes whose containers have not finished `wait_timeout` seconds after their launch 
+		are reported with a `timeout` event and treated as failed.
+
+		:param commands: Dictionary of commands with the XNAT project level 
+			(i.e. project, session, or scan) as the keys and the command 
+			name and options as the values, defaults to the utility commands
+		:param strict: Skip nodes whose dependencies failed or were skipped, defaults to False
+		:param wait_timeout: Maximum number of seconds to wait for the containers of a 
+			node to finish, defaults to 3600 (`None` for no limit)
+		:type commands: dict, optional
+		:type strict: bool, optional
+		:type wait_timeout: float, optional
+		:return: Iterator of progress events (see `run()`)
+		:rtype: generator
+		'''
+
+		util = self.utility
+		if commands is None: commands = util.commands
+
+		nodes = self.build_pipeline(commands)
+		if not nodes:
+			logging.info('Unable to run pipeline: No experiments found.')
+			return
+
+		for level,cmd in commands.items():
+			if level in LEVELS and 'bids' in cmd['name'] and not util._has_bids:
+				util.check_bids_map()
+
+		dependents = {n:[] for n in nodes}
+		for n,node in nodes.items():
+			for d in node['deps']: dependents[d].append(n)
+		remaining = {n:len(node['deps']) for n,node in nodes.items()}
+		failed = set()
+		ready = [n for n in sorted(nodes,key=self._node_order) if remaining[n] == 0]
+		results = {}
+		futures = {}
+		waiting = {}
+		count = 0
+		total = len(nodes)
+
+		s_time = time.time()
+		logging.info('Running pipeline with {} node(s)'.format(total))
+		pools = {level:ThreadPoolExecutor(max_workers=self.get_concurrency(level)) for level in LEVELS}
+		try:
+			while ready or futures or waiting:
+				for n in ready:
+					node = nodes[n]
+					if strict and any(d in failed for d in node['deps']):
+						futures[pools[node['level']].submit(lambda: None)] = n
+						continue
+					futures[pools[node['level']].submit(self.launch,node['info'],node['command']['name'],node['command']['opts'])] = n
+				ready = []
+
+				timeout = self.waiter.interval if waiting else None
+				if futures:
+					done,_ = wait(list(futures),timeout=timeout,return_when=FIRST_COMPLETED)
+				else:
+					done = []
+					time.sleep(timeout)
+
+				finished = []
+				for f in done:
+					n = futures.pop(f)
+					node = nodes[n]
+					try:
+						results[n] = f.result()
+					except Exception as ex:
+						format_err(ex)
+						results[n] = None
+
+					if results[n] is None:
+						event = 'skipped'
+						failed.add(n)
+					elif results[n]['result']['error']:
+						event = 'failed'
+						failed.add(n)
+					else:
+						event = 'launched'
+					yield self._event(event,node['level'],node['command']['name'],len(results),total,results[n] or node['info'])
+
+					if event == 'launched' and self.waiter is not None:
+						self.waiter.track(n,results[n]['result'])
+						waiting[n] = None if wait_timeout is None else time.time() + wait_timeout
+					else:
+						finished.append(n)
+
+				if waiting:
+					for n,ok in self.waiter.poll():
+						if n not in waiting: continue
+						del waiting[n]
+						if not ok: failed.add(n)
+						node = nodes[n]
+						yield self._event('completed' if ok else 'failed',node['level'],node['command']['name'],len(results),total,results[n])
+						finished.append(n)
+
+					now = time.time()
+					for n in [n for n,t in waiting.items() if t is not None and now > t]:
+						del waiting[n]
+						failed.add(n)
+						node = nodes[n]
+						logging.warning('Containers for {} did not finish within {}.'.format(node['info']['URI'],convert_seconds(wait_timeout)))
+						yield self._event('timeout',node['level'],node['command']['name'],len(results),total,results[n])
+						finished.append(n)
+
+				for n in finished:
+					count += 1
+					for d in dependents[n]:
+						remaining[d] -= 1
+						if remaining[d] == 0: ready.append(d)
+				ready.sort(key=self._node_order)
+		finally:
+			for pool in pools.values(): pool.shutdown(wait=False)
+
+		for level in commands:
+			if level in LEVELS:
+				util._results[level] = [results[n] for n in sorted(results,key=self._node_order) if n[0] == level and results[n] is not None]
+		yield self._event('finished',None,None,count,total)
+		logging.info('Pipeline complete in {}.'.format(convert_seconds(time.time()-s_time)))
+
+	@staticmethod
+	def _node_order(n):
+		return (LEVELS.index(n[0]),n[1])
+
+if __name__ == '__main__':
+	pass
@@ -0,0 +1,234 @@
+import csv
+import logging
+from array import array
+from itertools import islice
+from operator import itemgetter
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+'''
+Cell values treated as missing numbers (stored as NaN in numeric columns)
+'''
+MISSING = ['', 'NA', 'N/A', 'None', 'null']
+
+'''
+Column data types
+'''
+FLOAT = 'float'
+STRING = 'str'
+
+NAN = float('nan')
+
+
+def to_floats(values):
+	'''Converts a sequence of cell values to floats, replacing missing values
+	(see `MISSING`) with NaN
+
+	:param values: Cell values
+	:type values: list
+	:return: List of floats (or `None` if a value is not a number)
+	:rtype: list
+	'''
+
+	output = []
+	for v in values:
+		try:
+			output.append(float(v))
+		except ValueError:
+			if v.strip() not in MISSING: return None
+			output.append(NAN)
+	return output
+
+def infer_dtype(values):
+	'''Infers the data type of a column from a sample of its cell values. A
+	column is numeric if every value is a number or missing.
+
+	:param values: Sample of cell values
+	:type values: list
+	:return: `FLOAT` or `STRING`
+	:rtype: str
+	'''
+
+	return STRING if to_floats(values) is None else FLOAT
+
+
+class ColumnTable(object):
+	'''In-memory table that stores each column separately. Numeric columns are
+	stored as compact float buffers (`array('d')`, or NumPy arrays if requested)
+	and all other columns as lists of strings.
+
+	:param columns: Dictionary with column names as keys and columns as values
+	:param dtypes: Dictionary with column names as keys and data types (`FLOAT`
+		or `STRING`) as values, defaults to `STRING` for lists and `FLOAT` otherwise
+	:type columns: dict, optional
+	:type dtypes: dict, optional
+	'''
+
+	def __init__(self, columns=None, dtypes=None):
+		'''Constructor method
+		'''
+
+		self.columns = dict(columns or {})
+		self.dtypes = dict(dtypes or {})
+		for k,v in self.columns.items():
+			if k not in self.dtypes: self.dtypes[k] = STRING if isinstance(v,list) else FLOAT
+
+	def __len__(self):
+		for v in self.columns.values(): return len(v)
+		return 0
+
+	def __getitem__(self, name):
+		return self.columns[name]
+
+	def __contains__(self, name):
+		return name in self.columns
+
+	@property
+	def names(self):
+		'''Names of the columns (in order)
+		'''
+
+		return list(self.columns)
+
+	@property
+	def numeric(self):
+		'''Names of the numeric columns (in order)
+		'''
+
+		return [k for k in self.columns if self.dtypes[k] == FLOAT]
+
+	def to_numpy(self):
+		'''Converts the numeric columns to NumPy arrays (without copying)
+
+		:raises ImportError: NumPy is not installed
+		'''
+
+		if np is None: raise ImportError('NumPy is required to convert columns to NumPy arrays.')
+		for k in self.numeric:
+			if isinstance(self.columns[k],array): self.columns[k] = np.frombuffer(self.columns[k],dtype=np.float64)
+
+	def to_dict(self, lower=False):
+		'''Converts the table to a dictionary of lists
+
+		:param lower: Convert the column names to lowercase, defaults to False
+		:type lower: bool, optional
+		:return: Dictionary with column names as keys and lists as values
+		:rtype: dict
+		'''
+
+		return {(k.lower() if lower else k):list(v) for k,v in self.columns.items()}
+
+
+def load_csv(fname, filt=[], sample=1000, chunk_size=1000, strings=True, dtypes=None, use_numpy=None):
+	'''Loads a CSV file into a `ColumnTable`. The data type of each column is
+	inferred from the first `sample` rows, and the file is read in chunks of
+	`chunk_size` rows that are transposed and converted one column at a time.
+	A numeric column that contains a non-numeric value after the sample is
+	re-read as strings. Missing values in numeric columns (see `MISSING`) are
+	stored as NaN, and rows with an incorrect number of values are skipped. An
+	empty table is returned if the file is empty or `filt` matches no columns.
+
+	:param str fname: Name of CSV file (with or without extension)
+	:param filt: List of column headers (whole or partial, case-insensitive) to
+		keep, defaults to all columns
+	:param sample: Number of rows used to infer the column data types, defaults to 1000
+	:param chunk_size: Number of rows converted at a time, defaults to 1000
+	:param strings: Keep string columns, defaults to True
+	:param dtypes: Dictionary with column names as keys and data types as values,
+		used instead of the inferred data types (e.g. `{'subject_id': STRING}` to
+		keep leading zeros)
+	:param use_numpy: Store numeric columns as NumPy arrays, defaults to `None`
+		(only if NumPy is installed)
+	:type filt: list, optional
+	:type sample: int, optional
+	:type chunk_size: int, optional
+	:type strings: bool, optional
+	:type dtypes: dict, optional
+	:type use_numpy: bool, optional
+	:return: The table
+	:rtype: ColumnTable
+	'''
+
+	if not fname.endswith('.csv'): fname += '.csv'
+	if use_numpy is None: use_numpy = np is not None
+	forced = dtypes or {}
+
+	with open(fname,'r',newline='') as f:
+		reader = csv.reader(f)
+		header = [h.strip() for h in next(reader,[])]
+		filt = [k.lower() for k in filt]
+		keep = [i for i,h in enumerate(header) if not filt or any(k in h.lower() for k in filt)]
+		names = [header[i] for i in keep]
+		if not keep: return ColumnTable()
+		if len(keep) == 1:
+			getter = lambda row: (row[keep[0]],)
+		else:
+			getter = itemgetter(*keep)
+
+		def read_chunk(size):
+			'''Reads up to `size` rows and transposes the selected columns
+			'''
+
+			rows = list(islice(reader,size))
+			if not rows: return None,0
+			valid = [r for r in rows if len(r) == len(header)]
+			skipped = len(rows) - len(valid)
+			if not valid: return [[] for _ in keep],skipped
+			if len(keep) < len(header): valid = map(getter,valid)
+			return list(zip(*valid)),skipped
+
+		values,skipped = read_chunk(max(sample,1))
+		dtypes = dict((name,forced.get(name) or infer_dtype(col)) for name,col in zip(names,values or [[] for _ in names]))
+		columns = dict((name,array('d') if dtypes[name] == FLOAT else []) for name in names)
+		demoted = []
+
+		while values is not None:
+			for name,col in zip(names,values):
+				if name in demoted: continue
+				if dtypes[name] == STRING:
+					if strings: columns[name].extend(col)
+					continue
+
+				start = len(columns[name])
+				try:
+					columns[name].extend(map(float,col))
+				except ValueError:
+					floats = to_floats(col)
+					if floats is None:
+						demoted.append(name)
+						continue
+					del columns[name][start:]
+					columns[name].extend(floats)
+
+			values,n = read_chunk(chunk_size)
+			skipped += n
+
+	if skipped: logging.warning('Skipped {} lines of {} with an incorrect number of values.'.format(skipped,fname))
+
+	if demoted and strings:
+		idx = [keep[names.index(name)] for name in demoted]
+		for name in demoted:
+			dtypes[name] = STRING
+			columns[name] = []
+		with open(fname,'r',newline='') as f:
+			reader = csv.reader(f)
+			next(reader,None)
+			for row in reader:
+				if len(row) != len(header): continue
+				for name,i in zip(demoted,idx): columns[name].append(row[i])
+
+	if not strings:
+		dtypes.update((name,STRING) for name in demoted)
+		columns = dict((k,v) for k,v in columns.items() if dtypes[k] == FLOAT)
+		dtypes = dict((k,v) for k,v in dtypes.items() if k in columns)
+
+	table = ColumnTable(columns,dtypes)
+	if use_numpy: table.to_numpy()
+	return table
+
+if __name__ == '__main__':
+	pass
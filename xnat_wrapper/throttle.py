@@ -0,0 +1,141 @@
+import time
+import threading
+from urllib.parse import urlparse
+
+
+class HostLimiter(object):
+	'''Limits the number of requests that can be sent to each host at
+	the same time, regardless of how many worker threads are running.
+
+	:param limit: Maximum number of concurrent requests per host, defaults to 8
+	:type limit: int, optional
+	'''
+
+	def __init__(self, limit=8):
+		'''Constructor method
+		'''
+
+		self._lock = threading.Lock()
+		self._slots = {}
+		self.set_limit(limit)
+
+	def set_limit(self, limit):
+		'''Sets the maximum number of concurrent requests per host. Requests
+		that are already holding a slot are not affected.
+
+		:param int limit: Maximum number of concurrent requests per host
+		'''
+
+		with self._lock:
+			self.limit = max(1,int(limit))
+			self._slots = {}
+
+	def slot(self, url):
+		'''Returns the semaphore guarding a host, which can be used as a
+		context manager around a request (e.g. `with limiter.slot(url):`).
+
+		:param str url: The server URL (or any URL on the host)
+		:return: Semaphore shared by every request to the host
+		:rtype: threading.BoundedSemaphore
+		'''
+
+		host = urlparse(url).netloc or url
+		with self._lock:
+			if host not in self._slots:
+				self._slots[host] = threading.BoundedSemaphore(self.limit)
+			return self._slots[host]
+
+
+class RateLimiter(object):
+	'''Token bucket that limits how many requests can be sent per second.
+	Threads calling `acquire()` are delayed (in the order they arrive) 
+	until sending another request would not exceed the rate.
+
+	:param float rate: Maximum number of requests per second
+	:param burst: Number of requests that can be sent at once after 
+		an idle period, defaults to 1
+	:type burst: int, optional
+	'''
+
+	def __init__(self, rate, burst=1):
+		'''Constructor method
+		'''
+
+		if rate <= 0:
+			raise ValueError('Unable to create rate limiter: Rate must be greater than 0.')
+
+		self.rate = float(rate)
+		self.burst = max(1,burst)
+		self._lock = threading.Lock()
+		self._tokens = float(self.burst)
+		self._last = time.monotonic()
+
+	def acquire(self):
+		'''Blocks until a request can be sent without exceeding the rate
+
+		:return: Number of seconds spent waiting
+		:rtype: float
+		'''
+
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._last)*self.rate)
+			self._last = now
+			self._tokens -= 1
+			wait = -self._tokens/self.rate if self._tokens < 0 else 0
+
+		if wait > 0: time.sleep(wait)
+		return wait
+
+
+class AdaptivePoller(object):
+	'''Keeps track of how long to wait between polls. The interval grows 
+	(up to a maximum) each time a poll finds no changes and is reset to the 
+	minimum as soon as something changes.
+
+	:param interval: Minimum number of seconds between polls, defaults to 1
+	:param max_interval: Maximum number of seconds between polls, defaults to 30
+	:param factor: Amount the interval is multiplied by after each idle poll, defaults to 1.5
+	:type interval: float, optional
+	:type max_interval: float, optional
+	:type factor: float, optional
+	'''
+
+	def __init__(self, interval=1, max_interval=30, factor=1.5):
+		'''Constructor method
+		'''
+
+		self.min_interval = interval
+		self.max_interval = max(interval,max_interval)
+		self.factor = factor
+		self.interval = interval
+
+	def update(self, changed):
+		'''Updates the interval after a poll
+
+		:param bool changed: `True` if the poll found any changes
+		:return: Number of seconds to wait before the next poll
+		:rtype: float
+		'''
+
+		if changed:
+			self.interval = self.min_interval
+		else:
+			self.interval = min(self.max_interval, self.interval*self.factor)
+		return self.interval
+
+	def reset(self):
+		'''Resets the interval to the minimum
+		'''
+
+		self.interval = self.min_interval
+
+
+'''
+Limiter shared by every utility that does not define its own, so that
+concurrent work against the same XNAT server is capped process-wide.
+'''
+default_limiter = HostLimiter()
+
+if __name__ == '__main__':
+	pass
@@ -0,0 +1,261 @@
+import time
+from requests.models import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+from .cache import ResponseCache
+from .metrics import MetricsRegistry
+
+
+'''
+Timeout values meaning "use the default timeout of the adapter" and "no timeout, 
+even if the adapter has a default timeout" (e.g. for `launch_timeout`)
+'''
+DEFAULT_TIMEOUT = 'default'
+NO_TIMEOUT = 'none'
+
+'''
+Default HTTP options used by the `Connector` class
+'''
+HTTP_OPTIONS = {
+	'pool_size': 10,
+	'retries': 0,
+	'backoff': 0.5,
+	'timeout': None,
+	'launch_timeout': DEFAULT_TIMEOUT,
+	'cache': None,
+	'metrics': None
+}
+
+'''
+Response statuses that are retried (when retries are enabled)
+'''
+RETRY_STATUSES = [429, 502, 503, 504]
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+	'''HTTP adapter that applies a default timeout to every request sent
+	without one (or with `DEFAULT_TIMEOUT`), and (optionally) answers GET requests
+	from a response cache. Requests sent with `NO_TIMEOUT` have no timeout.
+
+	:param timeout: Default timeout in seconds, or a `(connect, read)` tuple,
+		defaults to None (no timeout)
+	:param cache: Cache used for GET requests, defaults to None (no cache)
+	:param metrics: Registry that every request is recorded in, defaults to None
+	:type timeout: float or tuple, optional
+	:type cache: ResponseCache, optional
+	:type metrics: MetricsRegistry, optional
+	'''
+
+	def __init__(self, timeout=None, cache=None, metrics=None, **kwargs):
+		'''Constructor method
+		'''
+
+		self.timeout = timeout
+		self.cache = cache
+		self.metrics = metrics
+		super(TimeoutHTTPAdapter, self).__init__(**kwargs)
+
+	def send(self, request, **kwargs):
+		if self.metrics is None: return self._send(request, **kwargs)
+
+		s_time = time.perf_counter()
+		try:
+			res = self._send(request, **kwargs)
+		except Exception:
+			self.metrics.record(request.method, request.url, 0, time.perf_counter() - s_time)
+			raise
+
+		phase = self.metrics.get_phase()
+		if res._content_consumed:
+			size = len(res._content or b'')
+		elif 'Content-Length' in res.headers:
+			size = int(res.headers['Content-Length'])
+		else:
+			size = 0
+			self.count_bytes(request, res, phase)
+		self.metrics.record(request.method, request.url, res.status_code, 
+			time.perf_counter() - s_time, size, res.raw is None, phase)
+		return res
+
+	def count_bytes(self, request, res, phase):
+		'''Adds the size of a response without a `Content-Length` (e.g. a chunked 
+		response) to the metrics once its body has been read
+
+		:param request: The prepared request
+		:param res: The response (with an unread body)
+		:param str phase: Name of the phase the request is recorded with
+		:type res: requests.Response
+		'''
+
+		raw = res.raw
+		stream = raw.stream
+		metrics = self.metrics
+		def counted(*args, **kwargs):
+			size = 0
+			try:
+				for chunk in stream(*args, **kwargs):
+					size += len(chunk)
+					yield chunk
+			finally:
+				metrics.record_bytes(request.method, request.url, res.status_code, raw.tell() or size, phase)
+		raw.stream = counted
+
+	def _send(self, request, **kwargs):
+		timeout = kwargs.get('timeout')
+		if timeout is None or timeout == DEFAULT_TIMEOUT: kwargs['timeout'] = self.timeout
+		elif timeout == NO_TIMEOUT: kwargs['timeout'] = None
+		if self.cache is None: return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+		if request.method != 'GET':
+			self.cache.invalidate(request.url)
+			return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+		ttl = self.cache.get_ttl(request.url)
+		if ttl <= 0: return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+		entry = self.cache.get(request.url)
+		if entry is not None:
+			if self.cache.is_fresh(entry): return self.build_cached_response(request, entry)
+			request.headers.update(self.cache.get_validators(entry))
+
+		res = super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+		if res.status_code == 304 and entry is not None:
+			res.close()
+			self.cache.refresh(request.url, ttl)
+			return self.build_cached_response(request, entry)
+		if res.status_code == 200 and 'no-store' not in res.headers.get('Cache-Control',''):
+			self.cache.set(request.url, res.status_code, res.headers, res.content, ttl)
+		return res
+
+	def build_cached_response(self, request, entry):
+		'''Builds a response from a cached response
+
+		:param request: The prepared request
+		:param dict entry: The cached response
+		:return: The response
+		:rtype: requests.Response
+		'''
+
+		res = Response()
+		res.status_code = entry['status']
+		res.reason = 'OK'
+		res.headers = CaseInsensitiveDict(entry['headers'])
+		res.encoding = get_encoding_from_headers(res.headers)
+		res.url = request.url
+		res.request = request
+		res.connection = self
+		res._content = entry['content']
+		res._content_consumed = True
+		return res
+
+
+def timeout_options(timeout):
+	'''Converts a timeout (which may be `DEFAULT_TIMEOUT` or `NO_TIMEOUT`) to the
+	keyword arguments of a request, so it can be sent through any `requests` session
+	(with or without a `TimeoutHTTPAdapter` mounted). The default timeout leaves out
+	the `timeout` argument, and no timeout is sent as `(None, None)` so the adapter
+	does not replace it with its default.
+
+	:param timeout: The timeout (`DEFAULT_TIMEOUT`, `NO_TIMEOUT`, `None`, a number
+		of seconds, or a `(connect, read)` tuple)
+	:return: Keyword arguments of the request
+	:rtype: dict
+	'''
+
+	if timeout is None or timeout == DEFAULT_TIMEOUT: return {}
+	if timeout == NO_TIMEOUT: return {'timeout': (None, None)}
+	return {'timeout': timeout}
+
+def make_retry(retries=0, backoff=0.5, statuses=RETRY_STATUSES):
+	'''Creates the retry policy used by the HTTP adapter. Only idempotent
+	requests (e.g. GET and PUT) are retried, so container launches and
+	imports are never submitted twice.
+
+	:param retries: Maximum number of retries per request, defaults to 0
+	:param backoff: Backoff factor in seconds (the wait before retry `n` is
+		`backoff * 2**(n-1)`), defaults to 0.5
+	:param statuses: Response statuses that are retried, defaults to `RETRY_STATUSES`
+	:type retries: int, optional
+	:type backoff: float, optional
+	:type statuses: list, optional
+	:return: Retry policy
+	:rtype: urllib3.util.retry.Retry
+	'''
+
+	return Retry(
+		total=retries,
+		backoff_factor=backoff,
+		status_forcelist=statuses,
+		raise_on_status=False
+	)
+
+def make_cache(cache):
+	'''Creates the response cache used by the HTTP adapter
+
+	:param cache: `True` for a new cache, the name of a file used to persist a 
+		new cache, an existing `ResponseCache`, or `None` for no cache
+	:return: The response cache (or `None`)
+	:rtype: ResponseCache
+	'''
+
+	if cache is None or cache is False: return None
+	if cache is True: return ResponseCache()
+	if isinstance(cache, str): return ResponseCache(path=cache)
+	return cache
+
+def make_metrics(metrics):
+	'''Creates the metrics registry used by the HTTP adapter
+
+	:param metrics: `True` for a new registry, a function that is called with each 
+		request (see `MetricsRegistry`), an existing `MetricsRegistry`, or `None` for no metrics
+	:return: The metrics registry (or `None`)
+	:rtype: MetricsRegistry
+	'''
+
+	if metrics is None or metrics is False: return None
+	if metrics is True: return MetricsRegistry()
+	if not isinstance(metrics, MetricsRegistry): return MetricsRegistry(callback=metrics)
+	return metrics
+
+def configure_session(session, pool_size=10, retries=0, backoff=0.5, timeout=None, cache=None, 
+					metrics=None, **kwargs):
+	'''Configures the connection pool, retry policy, and default timeout of
+	a `requests` session (such as the one used by `pyxnat.Interface`).
+
+	:param session: The HTTP session to configure
+	:param pool_size: Maximum number of connections kept open per host, defaults to 10
+	:param retries: Maximum number of retries per request, defaults to 0
+	:param backoff: Backoff factor in seconds between retries, defaults to 0.5
+	:param timeout: Default timeout in seconds, or a `(connect, read)` tuple,
+		defaults to None (no timeout)
+	:param cache: Response cache used for GET requests (see `make_cache()`), 
+		defaults to None (no cache)
+	:param metrics: Metrics registry that every request is recorded in (see `make_metrics()`), 
+		defaults to None (no metrics)
+	:type session: requests.Session
+	:type pool_size: int, optional
+	:type retries: int, optional
+	:type backoff: float, optional
+	:type timeout: float or tuple, optional
+	:type cache: ResponseCache, optional
+	:type metrics: MetricsRegistry, optional
+	:return: The HTTP adapter mounted on the session
+	:rtype: TimeoutHTTPAdapter
+	'''
+
+	adapter = TimeoutHTTPAdapter(
+		timeout=timeout,
+		cache=make_cache(cache),
+		metrics=make_metrics(metrics),
+		pool_connections=pool_size,
+		pool_maxsize=pool_size,
+		max_retries=make_retry(retries,backoff)
+	)
+	session.mount('http://',adapter)
+	session.mount('https://',adapter)
+	return adapter
+
+if __name__ == '__main__':
+	pass
@@ -1,10 +1,18 @@
 import time
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from .utils import (
 	format_err,
 	convert_seconds
 )
+from .filters import SeriesFilter
+from .metrics import timed
+from .import_queue import (
+	ImportQueueMonitor,
+	QueueSnapshot
+)
+from .throttle import default_limiter
 
 
 class UIDImporter(object):
@@ -31,7 +39,12 @@ class UIDImporter(object):
 		self.xnat = xnat
 		self.project = project
 		self.studies = studies
+		self.series = {}
 		self.scp = None
+		self.archived = {'studies':set(),'series':set()}
+		self.limiter = default_limiter
+		self.metrics = None
+		self.queue = QueueSnapshot.shared(xnat)
 
 		self.set_uids(uids)
 		self.set_filters(filters)
@@ -65,12 +78,15 @@ class UIDImporter(object):
 
 		:param filt: Dictionary with keys corresponding to the keyword 
 			(e.g. `seriesDescription`) and values corresponding to a list 
-			of approved values (e.g. [`Ax T1`,`Ax T2`]).
+			of approved values (e.g. [`Ax T1`,`Ax T2`]). Prefix, regular 
+			expression, and negative filters are also supported (see `SeriesFilter`).
 		:type filt: dict, optional
 		'''
 
 		self.filters = filt
+		self._filter = SeriesFilter(filt)
 
+	@timed('import')
 	def set_scp_params(self, project=None):
 		'''Sets the parameters for the XNAT DICOM/SCP connection.
 
@@ -92,18 +108,64 @@ class UIDImporter(object):
 		except Exception as ex:
 			format_err(ex)
 
-	def find_studies(self, uids=[], filters={}):
-		'''Find studies using a list of study UIDs
+	@timed('study_query')
+	def query_studies(self, uids):
+		'''Sends a list of study UIDs to the PACS and returns the unfiltered study information
+
+		:param list uids: List of study UIDs
+		:return: Dictionary with study UIDs as keys and the series information as values
+		:rtype: dict
+		'''
+
+		with self.limiter.slot(getattr(self.xnat,'_server','')):
+			res = self.xnat.post('/xapi/dqr/seriesInfo/pacs/1/studies', 
+				data=','.join(uids))
+		res.raise_for_status()
+		return res.json()
+
+	@timed('study_query')
+	def find_studies(self, uids=[], filters={}, chunk_size=None, workers=1, retries=2):
+		'''Find studies using a list of study UIDs. Large lists of UIDs can be split 
+		into chunks that are sent to the PACS separately (and concurrently), in which 
+		case chunks that fail are retried on their own.
 
 		:param uids: List of study UIDs
 		:param filters: Dictionary with keys corresponding to the keyword 
 			(e.g. `seriesDescription`) and values corresponding to a list 
 			of approved values (e.g. [`Ax T1`,`Ax T2`]).
+		:param chunk_size: The maximum number of UIDs sent per request, defaults to None (all at once)
+		:param workers: The number of chunks sent at once (still capped by `limiter`), defaults to 1
+		:param retries: The number of times a failed chunk is retried, defaults to 2
 		:type uids: list, optional
 		:type filters: dict, optional
+		:type chunk_size: int, optional
+		:type workers: int, optional
+		:type retries: int, optional
+		'''
+
+		query = self._query_chunks(uids,filters,chunk_size,retries)
+		try:
+			chunks,delay = next(query)
+			while True:
+				time.sleep(delay)
+				with ThreadPoolExecutor(max_workers=max(1,workers)) as pool:
+					futures = [pool.submit(self.query_studies,c) for c in chunks]
+					results = [f.exception() or f.result() for f in futures]
+				chunks,delay = query.send(results)
+		except StopIteration:
+			pass
+
+	def _query_chunks(self, uids=[], filters={}, chunk_size=None, retries=2):
+		'''Keeps track of the chunks of UIDs sent to the PACS by `find_studies()` 
+		(and `AsyncUIDImporter.find_studies()`), which only send the chunks. Yields 
+		`(chunks, delay)` pairs, where `delay` is the number of seconds to wait before 
+		sending the chunks, and receives the result of each chunk (or the exception 
+		raised). Once every chunk has succeeded (or the retries have run out), the 
+		studies found are filtered and stored in `studies`.
 		'''
 
 		self.studies = {}
+		self.series = {}
 		if uids: self.set_uids(uids)
 		if filters: self.set_filters(filters)
 
@@ -111,44 +173,74 @@ class UIDImporter(object):
 			logging.warning('Unable to get studies: No UIDs found.')
 			return
 
-		data_str = ','.join(self.uids)
-		logging.info('Gathering studies for UID(s): {}'.format(data_str))
+		n = chunk_size or len(self.uids)
+		chunks = [self.uids[i:i+n] for i in range(0,len(self.uids),n)]
+		if len(chunks) == 1:
+			logging.info('Gathering studies for UID(s): {}'.format(','.join(self.uids)))
+		else:
+			logging.info('Gathering studies for {} UIDs in {} chunks...'.format(len(self.uids),len(chunks)))
+
+		'''
+		Send data to the API, which will return an unflitered list of studies
+		'''
+		res = {}
+		for attempt in range(retries+1):
+			delay = 0
+			if attempt > 0:
+				logging.warning('Retrying {} failed chunk(s) (attempt {}/{})...'.format(len(chunks),attempt,retries))
+				delay = 2**(attempt-1)
+
+			failed = []
+			results = yield chunks,delay
+			for c,r in zip(chunks,results):
+				if isinstance(r,Exception):
+					format_err(r)
+					failed.append(c)
+				else:
+					res.update(r)
+
+			chunks = failed
+			if not chunks: break
+
+		if chunks:
+			logging.error('Unable to get studies for {} UID(s) after {} retries.'.format(sum(len(c) for c in chunks),retries))
+
+		self._set_studies(res)
+
+	def _set_studies(self, res):
+		'''Filters the unfiltered study information returned by the PACS and 
+		stores the remaining studies in `studies`
+
+		:param dict res: Dictionary with study UIDs as keys and the series information as values
+		'''
+
 		try:
-			'''
-			Send data to the API, which will return an unflitered list of studies
-			'''
-			res = self.xnat.post('/xapi/dqr/seriesInfo/pacs/1/studies', 
-				data=data_str).json()
-			
 			'''
 			Loop through list of studies and filter out unwanted ones. Any
 			reminaing study information will be added to the "studies" structure
 			'''
 			studies = {}
+			series = {}
 			n_series = 0
 			for uid in self.uids:
 				try:
 					tmp = res[uid]
-					filtered_list = []
-					for item in tmp['results']:
-						add_item = True
-						if self.filters:
-							for k,v in self.filters.items():
-								if item[k] not in v: add_item = False
-						if add_item: filtered_list.append(item)
+					filtered_list = self._filter.apply(tmp['results'])
 					if len(filtered_list) > 0: 
-						s_desc = list(set([i['seriesDescription'] for i in filtered_list]))
-						s_uids = list(set([i['seriesInstanceUid'] for i in filtered_list]))
+						s_desc = list(dict.fromkeys(i['seriesDescription'] for i in filtered_list))
+						s_uids = list(dict.fromkeys(i['seriesInstanceUid'] for i in filtered_list))
 						studies[uid] = {
 							'seriesDescriptions': s_desc,
 							'seriesInstanceUids': s_uids,
 						}
+						series[uid] = {i['seriesInstanceUid']:i['seriesDescription'] for i in filtered_list}
 						n_series += len(s_uids)
 				except Exception as ex:
 					format_err(ex)
 
 			logging.info('Search complete: {} studies with {} series found.'.format(len(studies),n_series))
 			self.studies = studies
+			self.series = series
 		except Exception as ex:
 			format_err(ex)
 
@@ -171,35 +263,150 @@ class UIDImporter(object):
 
 		return self.studies
 
-	def import_studies(self, studies=None):
-		'''Imports a list of studies into an XNAT project
+	@timed('archive_lookup')
+	def find_archived_series(self, project=None):
+		'''Finds the study and series UIDs of every session already archived in 
+		an XNAT project using a single request. The results are kept in a local 
+		index (`archived`) that is used by `remove_archived_studies()`.
+
+		:param project: Name of the XNAT project, defaults to the importer project
+		:type project: str, optional
+		:return: Dictionary containing the set of archived `studies` and `series` UIDs
+		:rtype: dict
+		'''
+
+		if project is None: project = self.project
+
+		self.archived = {'studies':set(),'series':set()}
+		try:
+			uri = '/data/projects/{}/experiments'.format(project)
+			opts = {
+				'format': 'json',
+				'columns': 'ID,xnat:imageSessionData/UID,xnat:imageScanData/UID'
+			}
+			res = self.xnat.get(uri,params=opts).json()
+			for row in res['ResultSet']['Result']:
+				row = {k.lower():v for k,v in row.items()}
+				if row.get('xnat:imagesessiondata/uid'): self.archived['studies'].add(row['xnat:imagesessiondata/uid'])
+				if row.get('xnat:imagescandata/uid'): self.archived['series'].add(row['xnat:imagescandata/uid'])
+		except Exception as ex:
+			format_err(ex)
+
+		return self.archived
+
+	def remove_archived_studies(self, project=None):
+		'''Removes series that are already archived in an XNAT project from the 
+		list of studies, along with any studies that have no series remaining. 
+		The series descriptions of each study are rebuilt from the remaining series 
+		(when the studies were found using `find_studies()`).
+
+		:param project: Name of the XNAT project, defaults to the importer project
+		:type project: str, optional
+		:return: Dictionary containing the number of `studies` and `series` removed
+		:rtype: dict
+		'''
+
+		archived = self.find_archived_series(project)['series']
+
+		saved = {'studies':0,'series':0}
+		self.studies = dict(self.studies)
+		for uid in list(self.studies):
+			s_uids = self.studies[uid]['seriesInstanceUids']
+			keep = [s for s in s_uids if s not in archived]
+			if len(keep) == len(s_uids): continue
+
+			saved['series'] += len(s_uids) - len(keep)
+			if keep:
+				self.studies[uid] = dict(self.studies[uid],seriesInstanceUids=keep)
+				if uid in self.series:
+					desc = self.series[uid]
+					self.studies[uid]['seriesDescriptions'] = list(dict.fromkeys(desc[s] for s in keep if s in desc))
+			else:
+				del self.studies[uid]
+				saved['studies'] += 1
+
+		logging.info('Skipping {} series ({} whole studies) that are already archived.'.format(saved['series'],saved['studies']))
+		return saved
+
+	def import_studies(self, studies=None, skip_archived=False, batch_size=None, 
+					watermark=None, interval=10, timeout=3600):
+		'''Imports a list of studies into an XNAT project. If a `batch_size` is given, 
+		the studies are submitted in batches, and each batch is only submitted once 
+		the number of the project's sessions in the import queue (see `check_import_queue()`) 
+		drops below the `watermark`.
 
 		:param studies: Dictionary with key values corresponding to study UIDs
+		:param skip_archived: Remove series that are already archived in the 
+			project before importing (see `remove_archived_studies()`), defaults to False
+		:param batch_size: The maximum number of studies submitted at once, defaults to None (all at once)
+		:param watermark: The number of queued sessions that the queue must drop below 
+			before the next batch is submitted, defaults to `batch_size`
+		:param interval: The number of seconds between import queue checks, defaults to 10
+		:param timeout: The maximum number of seconds to wait for the queue to drain 
+			before each batch, defaults to 3600
 		:type studies: dict, optional
-		:return: `True` if request was successful, `False` otherwise
+		:type skip_archived: bool, optional
+		:type batch_size: int, optional
+		:type watermark: int, optional
+		:type interval: float, optional
+		:type timeout: float, optional
+		:return: `True` if every request was successful, `False` otherwise
 		:rtype: bool
 		'''
 
 		try:
 			if self.scp is None:
 				self.set_scp_params()
-				logging.warning('Unable to import studies: No dicomscp parameters found.')
-				return False
+				if self.scp is None:
+					logging.warning('Unable to import studies: No dicomscp parameters found.')
+					return False
 
 			if studies is not None: self.studies = studies
+			if skip_archived and self.studies:
+				self.remove_archived_studies(self.scp['project'])
 			if not self.studies:
 				logging.warning('Unable to import studies: No studies found.')
 				return False
 
+			if batch_size is None: return self.submit_import(self.studies)
+
+			if watermark is None: watermark = batch_size
+			items = list(self.studies.items())
+			n_batches = (len(items) + batch_size - 1)//batch_size
+			for i in range(0,len(items),batch_size):
+				n = i//batch_size + 1
+				if i > 0 and not self.wait_for_queue(watermark,interval,timeout):
+					logging.warning('Stopping import: {} of {} batches were submitted.'.format(n-1,n_batches))
+					return False
+
+				logging.info('Submitting batch {}/{}...'.format(n,n_batches))
+				if not self.submit_import(dict(items[i:i+batch_size])): return False
+
+			return True
+		except Exception as ex:
+			format_err(ex)
+		return False
+
+	@timed('import')
+	def submit_import(self, studies):
+		'''Submits a single import request to the XNAT import queue
+
+		:param dict studies: Dictionary with key values corresponding to study UIDs
+		:return: `True` if request was successful, `False` otherwise
+		:rtype: bool
+		'''
+
+		try:
 			logging.info('Importing data from PACS...')
-			logging.debug('Data:\n{}'.format(json.dumps(self.studies,indent=2)))
+			logging.debug('Data:\n{}'.format(json.dumps(studies,indent=2)))
 
 			url = '/xapi/dqr/csvimport/generalImportFromJson?'
 			url += '&'.join(['{}={}'.format(k,v) for k,v in self.scp.items()])
 
 			logging.debug('Post URL: http://172.30.205.46{}'.format(url))
 
-			res = self.xnat.post(url, data=json.dumps(data), headers={'Content-Type': 'application/json'})
+			res = self.xnat.post(url, data=json.dumps(studies), headers={'Content-Type': 'application/json'})
+			self.queue.invalidate()
 			res.raise_for_status()
 			logging.info('...success! Subject(s) were successfully added to {}.'.format(self.scp['project']))
 
@@ -208,11 +415,43 @@ class UIDImporter(object):
 			format_err(ex)
 		return False
 
-	def check_import_queue(self, project=None):
+	def wait_for_queue(self, watermark, interval=10, timeout=3600):
+		'''Waits until the number of the project's sessions in the import queue drops 
+		below a watermark.
+
+		:param int watermark: The number of queued sessions to wait for the queue to drop below
+		:param interval: The number of seconds between import queue checks, defaults to 10
+		:param timeout: The maximum number of seconds to wait, defaults to 3600
+		:type interval: float, optional
+		:type timeout: float, optional
+		:return: `True` if the queue drained below the watermark, `False` if the timeout was reached
+		:rtype: bool
+		'''
+
+		project = self.scp['project'] if self.scp is not None else self.project
+
+		s_time = time.time()
+		while True:
+			n_queued = self.check_import_queue(project, interval)['total_sessions']
+			if n_queued < watermark: return True
+
+			t_elapsed = time.time() - s_time
+			if t_elapsed > timeout:
+				logging.warning('Import queue still has {} sessions after {}.'.format(n_queued,convert_seconds(t_elapsed)))
+				return False
+
+			logging.info('Waiting for import queue to drain ({} sessions queued, watermark {})...'.format(n_queued,watermark))
+			time.sleep(interval)
+
+	@timed('import_queue')
+	def check_import_queue(self, project=None, max_age=None):
 		'''Checks the XNAT import queue for all items related to the project
 
 		:param project: The name of the project which will be used to filter the studies
+		:param max_age: Maximum age in seconds of the shared queue snapshot (see 
+			`QueueSnapshot.get()`), defaults to the interval of the snapshot
 		:type project: str, optional
+		:type max_age: float, optional
 		:return: Dictionary containing the total number of sessions, total number of scans, and a list of all sessions
 		:rtype: dict
 		'''
@@ -225,8 +464,7 @@ class UIDImporter(object):
 			'sessions': []
 		}
 		try:
-			res = self.xnat.get('/xapi/dqr/query/queue/all?format=json').json()
-			for item in res:
+			for item in self.queue.get(project, max_age):
 				if item['xnatProject'] == project:
 					n_series = len(item['seriesIds'].split(','))
 					output['total_sessions'] += 1
@@ -243,6 +481,16 @@ class UIDImporter(object):
 
 		return output
 
+	def get_queue_monitor(self, **kwargs):
+		'''Creates a monitor that turns changes in the project's import queue into events 
+		(see `ImportQueueMonitor` for the available options).
+
+		:return: Import queue monitor for the project
+		:rtype: ImportQueueMonitor
+		'''
+
+		return ImportQueueMonitor(self, **kwargs)
+
 	def monitor_import_queue(self, timeout=180, time_refresh=True):
 		'''Monitors the status of studies that are being imported to a project.
 
@@ -252,46 +500,11 @@ class UIDImporter(object):
 		:type time_refresh: bool, optional
 		'''
 
-		s_time = time.time()
-
-		has_populated = False
-		while True:
-			q_data = self.check_import_queue()
-
-			t_elapsed = time.time() - s_time
-
-			if q_data['total_sessions'] > 0:
-				has_populated = True
-				n_sess = q_data['total_sessions']
-				n_scan = q_data['total_scans']
-				status_str = '{} sessions containing {} scans are currently queued.'.format(n_sess,n_scan)
-				q_statuses = {}
-				for item in q_data['sessions']:
-					tmp = item['studyUID'].split('.')
-					short_uid = '{}...{}'.format('.'.join(tmp[:3]),'.'.join(tmp[-2:]))
-					t_q = convert_seconds(item['sec_queued'])
-					status_str += '\n\t>> {} ({} queue time): '.format(short_uid,t_q)
-					status_str += '{} scans are {}'.format(item['num_scans'],item['status'])
-
-				if t_elapsed > timeout:
-					status_str += 'There are items still in the queue, but is taking longer than usual to finish. '
-					status_str += 'Try manually monitoring these items in the browser. Exiting queue monitor.'
-			else:
-				if has_populated:
-					status_str = 'There are no more items in the queue. Exiting queue monitor.'
-				else:
-					if t_elapsed < 60:
-						status_str = 'Waiting for items to arrive in queue...'
-					else:
-						status_str = 'Time limit exceeded and no items were found. Exiting queue monitor.'
-
-			if status_str != old_status:
-				logging.info('Queue Updated:\n{}'.format(status_str))
-				old_status = status_str
-				if time_refresh: s_time = time.time()
-
-			if 'Exiting queue monitor.' in status_str: return
-			time.sleep(1)
+		monitor = self.get_queue_monitor(timeout=timeout, time_refresh=time_refresh)
+		logging.info('Waiting for items to arrive in queue...')
+		for event in monitor.events():
+			logging.info('Queue Updated: {}'.format(monitor.format_event(event)))
+		logging.info('Exiting queue monitor.')
 
 if __name__ == '__main__': 
 	pass
@@ -1,7 +1,9 @@
 import sys
+import csv
 import json
 import time
 import logging
+import tempfile
 import traceback
 
 def format_err(err_str=None):
@@ -99,42 +101,119 @@ def write_json(data, fname, indent=2):
 	except Exception as ex:
 		format_err(ex)
 
-def json_to_csv(files,fname,keys=[]):
-	'''Converts a list of JSON/dict structures to a list of 
-	comma separated values (CSV) and saves it to a file.
+def flatten_json(data, keys=[], flatten=False, prefix=''):
+	'''Converts a JSON/dict structure to a single CSV row
 
-	:param list files: A list of JSON/dict structures
+	:param dict data: A JSON/dict structure
+	:param keys: A list of keys whose values are taken from nested JSON/dict 
+		structures (and added as columns of the same name)
+	:param flatten: Add every value in nested JSON/dict structures as a column 
+		named using dotted keys (e.g. `bids_meta.subject_id`), defaults to False
+	:type keys: list, optional
+	:type flatten: bool, optional
+	:return: Dictionary with CSV column headers as keys and values as values
+	:rtype: dict
+	'''
+
+	row = {}
+	for key,value in data.items():
+		if isinstance(value,dict):
+			if flatten:
+				for k,v in flatten_json(value,keys,True,'{}{}.'.format(prefix,key)).items():
+					if k not in row: row[k] = v
+			elif keys:
+				_lift_keys(value,keys,row)
+		else:
+			if prefix and key in keys and key not in row: row[key] = value
+			row[prefix+key] = value
+	return row
+
+def _lift_keys(data, keys, row):
+	for key,value in data.items():
+		if isinstance(value,dict):
+			_lift_keys(value,keys,row)
+		elif key in keys and key not in row:
+			row[key] = value
+
+def _get_columns(data, keys, flatten, columns, prefix=''):
+	for key,value in data.items():
+		if not isinstance(value,dict):
+			columns[prefix+key] = None
+		elif flatten:
+			_get_columns(value,keys,True,columns,'{}{}.'.format(prefix,key))
+
+def json_to_csv(files,fname,keys=[],flatten=False,columns=None):
+	'''Converts JSON/dict structures to comma separated values (CSV) and 
+	saves them to a file, one row at a time. The CSV columns are the union of 
+	the keys of every JSON/dict structure (in the order they are first found). 
+	
+	If `files` is a list, it is read twice (once to find the columns and once 
+	to write the rows). Otherwise (e.g. the generator returned by 
+	`CommandUtility.iter_json_files()`), the rows are spilled to a temporary 
+	file while the columns are found, so memory use does not grow with the 
+	number of files. If `columns` are given, the rows are written in a single pass.
+
+	:param files: A list (or any other iterable) of JSON/dict structures
 	:param str fname: The name of the CSV file that will be written to
 	:param keys: A list of CSV column headers that should be added 
 		to the file, which are not already base key/value 
 		pairs in the JSON/dict structures
+	:param flatten: Add every value in nested JSON/dict structures as a column 
+		named using dotted keys (e.g. `bids_meta.subject_id`), defaults to False
+	:param columns: The CSV column headers to write (any other values are dropped), 
+		defaults to None (every column)
+	:type files: iterable
 	:type keys: list, optional
+	:type flatten: bool, optional
+	:type columns: list, optional
+	:return: Number of rows written
+	:rtype: int
 	'''
 
 	if not fname.endswith('.csv'): fname += '.csv'
 
-	headers = []
-	with open(fname,'w') as csv:
+	spill = None
+	if columns is not None:
+		columns = list(columns)
+		rows = ([row.get(c,'') for c in columns] for row in (flatten_json(f,keys,flatten) for f in files))
+	elif isinstance(files,(list,tuple)):
+		columns = dict.fromkeys(keys)
+		for f in files: _get_columns(f,keys,flatten,columns)
+		columns = list(columns)
+		rows = ([row.get(c,'') for c in columns] for row in (flatten_json(f,keys,flatten) for f in files))
+	else:
+		'''
+		New columns are always added after the existing ones, so each spilled 
+		row only needs to be padded with the columns found after it was written
+		'''
+		spill = tempfile.TemporaryFile('w+',encoding='utf-8',newline='')
+		writer = csv.writer(spill)
+		columns = dict.fromkeys(keys)
 		for f in files:
-			if len(headers) == 0:
-				headers.extend(keys)
-				headers.extend([k for k,v in f.items() if not isinstance(v,dict)])
-				line = ','.join(headers)
-				csv.write('{}\n'.format(','.join(headers)))
-
-			output = {h:'' for h in headers}
-			for key,value in f.items():
-				if key in output:
-					output[key] = str(value)
-				else:
-					for k in keys:
-						if k in value: output[k] = str(value[k])
-
-			csv.write('{}\n'.format(','.join([v.replace(',',';') for k,v in output.items()])))
+			row = flatten_json(f,keys,flatten)
+			if not row.keys() <= columns.keys(): columns.update(dict.fromkeys(row))
+			writer.writerow([row.get(c,'') for c in columns])
+		spill.seek(0)
+		columns = list(columns)
+		rows = (r + ['']*(len(columns)-len(r)) for r in csv.reader(spill))
+
+	count = 0
+	try:
+		with open(fname,'w',newline='') as f:
+			writer = csv.writer(f)
+			writer.writerow(columns)
+			for row in rows:
+				writer.writerow(row)
+				count += 1
+	finally:
+		if spill is not None: spill.close()
+
+	return count
 
 def parse_csv(fname,filt=[]):
 	'''Converts a CSV file into a dictionary structure containing all columns 
-	unless specific columns are defined using the `filt` parameter.
+	unless specific columns are defined using the `filt` parameter. For large
+	tables, see `table.load_csv()`, which stores numeric columns as float arrays.
 
 	:param str fname: Name of CSV file (with or without extension)
 	:param filt: List of column headers (whole or partial) to keep
@@ -146,14 +225,12 @@ def parse_csv(fname,filt=[]):
 	count = 0
 	output = {}
 	if not fname.endswith('.csv'): fname += '.csv'
-	with open(fname,'r') as f:
-		for line in f:
+	with open(fname,'r',newline='') as f:
+		for items in csv.reader(f):
 			count += 1
-			line = line.replace('\n','')
 			if count == 1:
-				columns = [h.replace(' ','') for h in line.split(',')]
+				columns = [h.replace(' ','') for h in items]
 			else:
-				items = line.split(',')
 				if len(items) != len(columns):
 					print('Line {} has incorrect amount of inputs: {} != {}'.format(count,len(items),len(columns)))
 					continue
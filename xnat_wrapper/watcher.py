@@ -0,0 +1,272 @@
+import time
+import logging
+from .utils import (
+	format_err,
+	convert_seconds
+)
+from .metrics import timed
+from .throttle import AdaptivePoller
+
+
+'''
+Container statuses after which a container will no longer change
+'''
+SUCCESS_STATUSES = ['Complete','Done']
+FAILED_STATUSES = ['Failed','Killed']
+
+'''
+Status given to containers that are missing from the container listing for
+`max_missing` polls in a row (e.g. containers that were deleted), which are
+treated as failed
+'''
+MISSING_STATUS = 'Missing'
+
+
+class ContainerWatcher(object):
+	'''Class that tracks containers launched by the command utility and
+	watches them until they finish. Every tracked container is checked
+	using a single container listing per poll, and the time between polls
+	grows while nothing changes. Containers that are missing from the listing
+	for `max_missing` polls in a row are given the `MISSING_STATUS` status.
+
+	:param class xnat: An open XNAT connection via pyxnat.Interface()
+	:param project: Name of the XNAT project (limits the container listing
+		to the project), defaults to None
+	:param interval: Minimum number of seconds between polls, defaults to 2
+	:param max_interval: Maximum number of seconds between polls, defaults to 60
+	:param callback: Function called with each state-transition event
+	:param max_missing: Number of polls in a row a container can be missing from 
+		the listing before it is reported as missing, defaults to 5
+	:type project: str, optional
+	:type interval: float, optional
+	:type max_interval: float, optional
+	:type callback: function, optional
+	:type max_missing: int, optional
+	'''
+
+	def __init__(self, xnat, project=None, interval=2, max_interval=60, callback=None, max_missing=5):
+		'''Constructor method
+		'''
+
+		self.xnat = xnat
+		self.project = project
+		self.callback = callback
+		self.max_missing = max_missing
+		self.metrics = None
+		self.poller = AdaptivePoller(interval,max_interval)
+
+		self._ids = {}
+		self._keys = {}
+		self._reported = set()
+
+	@property
+	def interval(self):
+		'''Number of seconds until the next poll
+		'''
+
+		return self.poller.interval
+
+	@staticmethod
+	def get_container_ids(result):
+		'''Finds the container (or workflow) IDs in a launch result
+
+		:param dict result: Result returned by `CommandUtility.run_container()`
+			or `CommandUtility.run_bulk_container()`, or the raw launch report
+		:return: List of `(id type, id)` pairs (e.g. `('container-id', 'a1b2...')`)
+		:rtype: list
+		'''
+
+		if result is None: return []
+		if 'opts' in result and 'result' in result: result = result['result'] or {}
+
+		reports = result.get('successes',[result])
+		ids = []
+		for r in reports:
+			if r.get('container-id'):
+				ids.append(('container-id',str(r['container-id'])))
+			elif r.get('workflow-id'):
+				ids.append(('workflow-id',str(r['workflow-id'])))
+		return ids
+
+	def track(self, key, result):
+		'''Starts tracking the containers from a launch result
+
+		:param key: Any hashable value used to identify the launch (e.g. the experiment URI)
+		:param dict result: Result returned by `CommandUtility.run_container()`
+		:return: Number of containers being tracked for the launch
+		:rtype: int
+		'''
+
+		ids = self.get_container_ids(result)
+		self._keys[key] = ids
+		self._reported.discard(key)
+		for i in ids: self._ids.setdefault(i,{'status':None,'container':None,'missing':0})
+		if not ids: logging.warning('No container IDs found in launch result for {}.'.format(key))
+		self.poller.reset()
+		return len(ids)
+
+	def track_results(self, results):
+		'''Starts tracking every launch in a list of command results
+
+		:param list results: Results returned by `CommandUtility.find_and_run_command()`
+		'''
+
+		for item in results:
+			if item.get('result') is None or item['result']['error']: continue
+			self.track(item['info']['URI'],item['result'])
+
+	def is_finished(self, key):
+		'''Checks if every container of a launch has finished
+
+		:param key: The key used to track the launch
+		:return: `True` if every container finished, otherwise `False`
+		:rtype: bool
+		'''
+
+		return all(self._finished(self._ids[i]['status']) for i in self._keys.get(key,[]))
+
+	def is_successful(self, key):
+		'''Checks if every container of a launch completed successfully
+
+		:param key: The key used to track the launch
+		:return: `True` if every container completed, otherwise `False`
+		:rtype: bool
+		'''
+
+		return all(self._succeeded(self._ids[i]['status']) for i in self._keys.get(key,[]))
+
+	def get_status(self, key=None):
+		'''Returns the last known status of the tracked containers
+
+		:param key: The key used to track a launch (all launches if `None`)
+		:return: Dictionary with container IDs as keys and statuses as values
+		:rtype: dict
+		'''
+
+		keys = list(self._keys) if key is None else [key]
+		return {i[1]:self._ids[i]['status'] for k in keys for i in self._keys.get(k,[])}
+
+	@staticmethod
+	def _succeeded(status):
+		return status is not None and any(status.startswith(s) for s in SUCCESS_STATUSES)
+
+	@classmethod
+	def _finished(cls, status):
+		if status == MISSING_STATUS: return True
+		return cls._succeeded(status) or (status is not None and any(status.startswith(s) for s in FAILED_STATUSES))
+
+	@timed('container_poll')
+	def refresh(self):
+		'''Gets the status of every tracked container using a single container listing. 
+		Containers missing from `max_missing` listings in a row change to `MISSING_STATUS`.
+
+		:return: List of state-transition events (dictionaries containing the `key`,
+			`id`, `old_status`, `status`, and `container`)
+		:rtype: list
+		'''
+
+		pending = [i for i,v in self._ids.items() if not self._finished(v['status'])]
+		if not pending: return []
+
+		if self.project is None:
+			uri = '/xapi/containers'
+		else:
+			uri = '/xapi/projects/{}/containers'.format(self.project)
+
+		events = []
+		try:
+			res = self.xnat.get(uri).json()
+			listing = {}
+			for c in res:
+				for k in ['container-id','workflow-id']:
+					if c.get(k): listing[(k,str(c[k]))] = c
+
+			owners = {i:k for k,ids in self._keys.items() for i in ids}
+			for i in pending:
+				c = listing.get(i)
+				if c is None:
+					self._ids[i]['missing'] += 1
+					if self._ids[i]['missing'] < self.max_missing: continue
+					logging.warning('Container {} is missing from the last {} container listings.'.format(i[1],self.max_missing))
+					status = MISSING_STATUS
+				else:
+					self._ids[i]['missing'] = 0
+					status = c.get('status')
+				if status == self._ids[i]['status']: continue
+
+				event = {
+					'key': owners.get(i),
+					'id': i[1],
+					'old_status': self._ids[i]['status'],
+					'status': status,
+					'container': c
+				}
+				self._ids[i]['status'] = status
+				if c is not None: self._ids[i]['container'] = c
+				events.append(event)
+
+				if self.callback is not None:
+					try:
+						self.callback(event)
+					except Exception as ex:
+						format_err(ex)
+		except Exception as ex:
+			format_err(ex)
+
+		self.poller.update(len(events) > 0)
+		return events
+
+	def poll(self):
+		'''Refreshes the container statuses and returns the launches that finished
+		since the last poll (used by `CommandScheduler.run_pipeline()`).
+
+		:return: List of `(key, success)` pairs
+		:rtype: list
+		'''
+
+		self.refresh()
+
+		output = []
+		for key in self._keys:
+			if key in self._reported or not self.is_finished(key): continue
+			self._reported.add(key)
+			output.append((key,self.is_successful(key)))
+		return output
+
+	def watch(self, timeout=3600):
+		'''Polls the tracked containers until every container has finished (or the
+		timeout is reached), yielding each state-transition event as it is found.
+
+		:param timeout: Maximum number of seconds to watch, defaults to 3600 (`None` for no limit)
+		:type timeout: float, optional
+		:return: Iterator of state-transition events (see `refresh()`)
+		:rtype: generator
+		'''
+
+		s_time = time.time()
+		while True:
+			for event in self.refresh(): yield event
+
+			if all(self.is_finished(k) for k in self._keys):
+				logging.info('All containers finished after {}.'.format(convert_seconds(time.time()-s_time)))
+				return
+			if timeout is not None and time.time() - s_time + self.interval > timeout:
+				logging.warning('Containers are still running, but the watch timeout was reached.')
+				return
+			time.sleep(self.interval)
+
+	def wait(self, timeout=3600):
+		'''Blocks until every tracked container has finished (or the timeout is reached).
+
+		:param timeout: Maximum number of seconds to wait, defaults to 3600 (`None` for no limit)
+		:type timeout: float, optional
+		:return: `True` if every container completed successfully, otherwise `False`
+		:rtype: bool
+		'''
+
+		for event in self.watch(timeout):
+			logging.info('Container {} ({}): {} -> {}'.format(event['id'],event['key'],event['old_status'],event['status']))
+		return all(self.is_successful(k) for k in self._keys)
+
+if __name__ == '__main__':
+	pass